@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+from model_registry import MODEL_MEMORY_ESTIMATES_MB
+
+ADMISSION_MAX_INFERENCES = 2
+ADMISSION_MAX_QUEUED_SECONDS = 60.0
+ADMISSION_STALE_SECONDS = 15.0
+DEGRADATION_POLICIES = ('drop_stale', 'downgrade', 'reject')
+# Share of the queued audio budget from which new sessions are degraded
+SATURATION_RATIO = 0.8
+# Whisper sizes from the smallest up, a downgrade steps one size down
+MODEL_SIZES = tuple(MODEL_MEMORY_ESTIMATES_MB)
+
+
+class PhraseDroppedError(Exception):
+    pass
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server is overloaded, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, key, audio_seconds: float, created_at: float):
+        self.key = key
+        self.audio_seconds = audio_seconds
+        self.created_at = created_at
+        self.granted_at = 0.0
+        self.future: Optional[asyncio.Future] = None
+
+
+class AdmissionController:
+    # Phrases of all sessions compete for a fixed number of inference slots. Waiting phrases are
+    # served by self-clocked weighted fair queuing on their audio length, so a session that talks
+    # a lot only delays itself.
+    def __init__(self, max_inferences: int = ADMISSION_MAX_INFERENCES,
+                 max_queued_seconds: float = ADMISSION_MAX_QUEUED_SECONDS,
+                 stale_seconds: float = ADMISSION_STALE_SECONDS, policies: Tuple[str, ...] = ('drop_stale',)):
+        self.max_inferences = max_inferences
+        self.max_queued_seconds = max_queued_seconds
+        self.stale_seconds = stale_seconds
+        self.policies = policies
+        self.in_flight = 0
+        self.queued_seconds = 0.0
+        self._waiting: List[Tuple[float, int, Ticket]] = []
+        self._order = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict = {}
+        # Processing seconds per second of audio, smoothed, to estimate how long the queue takes to drain
+        self._cost_per_second = 0.5
+
+    def configure(self, max_inferences: Optional[int] = None, max_queued_seconds: Optional[float] = None,
+                  stale_seconds: Optional[float] = None, policies: Optional[Tuple[str, ...]] = None):
+        if policies is not None:
+            unknown = [policy for policy in policies if policy not in DEGRADATION_POLICIES]
+            if unknown:
+                raise ValueError(f"Unknown degradation policies {unknown}, expected some of {DEGRADATION_POLICIES}")
+            self.policies = tuple(policies)
+        if max_inferences is not None:
+            self.max_inferences = max_inferences
+        if max_queued_seconds is not None:
+            self.max_queued_seconds = max_queued_seconds
+        if stale_seconds is not None:
+            self.stale_seconds = stale_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inferences > 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.enabled and self.queued_seconds >= self.max_queued_seconds * SATURATION_RATIO
+
+    def retry_after(self) -> int:
+        drain_seconds = self.queued_seconds * self._cost_per_second / max(1, self.max_inferences)
+        return max(1, math.ceil(drain_seconds))
+
+    def admit_session(self, model_name: str) -> str:
+        # Decides which model a new session gets, or turns it away while the queue is saturated
+        if not self.saturated:
+            return model_name
+        if 'downgrade' in self.policies:
+            size, _, variant = model_name.partition('.')
+            if size in MODEL_SIZES and MODEL_SIZES.index(size) > 0:
+                metrics.inc('admission_downgrades_total')
+                smaller = MODEL_SIZES[MODEL_SIZES.index(size) - 1]
+                return f"{smaller}.{variant}" if variant else smaller
+        if 'reject' in self.policies:
+            metrics.inc('admission_rejected_total')
+            raise AdmissionRejectedError(self.retry_after())
+        return model_name
+
+    async def acquire(self, key, audio_seconds: float, created_at: float, weight: float = 1.0) -> Ticket:
+        ticket = Ticket(key, audio_seconds, created_at)
+        if not self.enabled:
+            return ticket
+        if self.in_flight < self.max_inferences and not self._waiting:
+            self._grant(ticket)
+            return ticket
+        if 'drop_stale' in self.policies and self.queued_seconds + audio_seconds > self.max_queued_seconds:
+            raise self._dropped('queue_full')
+
+        finish = max(self._virtual_time, self._last_finish.get(key, 0.0)) + audio_seconds / weight
+        self._last_finish[key] = finish
+        ticket.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (finish, next(self._order), ticket))
+        self.queued_seconds += audio_seconds
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # Granted right before the session went away, hand the slot on
+            if ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket):
+        if not self.enabled or not ticket.granted_at:
+            return
+        self.in_flight -= 1
+        if ticket.audio_seconds > 0:
+            cost = (time.monotonic() - ticket.granted_at) / ticket.audio_seconds
+            self._cost_per_second += 0.1 * (cost - self._cost_per_second)
+        self._dispatch()
+
+    def forget(self, key):
+        self._last_finish.pop(key, None)
+
+    def _grant(self, ticket: Ticket):
+        self.in_flight += 1
+        ticket.granted_at = time.monotonic()
+        metrics.observe('stage_seconds', ticket.granted_at - ticket.created_at, stage='admission_wait')
+
+    @staticmethod
+    def _dropped(reason: str) -> PhraseDroppedError:
+        metrics.inc('phrases_dropped_total', reason=reason)
+        return PhraseDroppedError(f"Phrase dropped, the server is overloaded ({reason.replace('_', ' ')})")
+
+    def _dispatch(self):
+        while self.in_flight < self.max_inferences and self._waiting:
+            finish, _, ticket = heapq.heappop(self._waiting)
+            self.queued_seconds = max(0.0, self.queued_seconds - ticket.audio_seconds)
+            self._virtual_time = finish
+            if ticket.future.done():
+                continue
+            if 'drop_stale' in self.policies and time.monotonic() - ticket.created_at > self.stale_seconds:
+                ticket.future.set_exception(self._dropped('stale'))
+                continue
+            self._grant(ticket)
+            ticket.future.set_result(None)
+
+
+admission = AdmissionController()
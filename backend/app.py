@@ -1,33 +1,342 @@
 import asyncio
 import argparse
-from flask import Flask
+import os
+from functools import partial
+from typing import Callable, List, Optional
+import threading
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
 from websockets import serve
 
-from ngrok_tunnel import create_ngrok_tunnel
-from websocket_handler import websocket_handler
+from admission_control import (admission, ADMISSION_MAX_INFERENCES, ADMISSION_MAX_QUEUED_SECONDS,
+                               ADMISSION_STALE_SECONDS, DEGRADATION_POLICIES)
+from audio_processing import AudioProcessorManager
+from batch_translation import batch_jobs, BATCH_WORKERS, JOBS_DIR
+from endpointing import endpointer_factory, MAX_PHRASE_DURATION, VAD_TYPES
+from inference_scheduler import scheduler, INFERENCE_WORKERS, SESSION_QUEUE_SIZE, EXECUTOR_TYPES
+from metrics import metrics
+from model_backends import model_backends, MODEL_BACKENDS
+from model_registry import model_registry, parse_model_keys, ModelKey, MODEL_IDLE_TTL, MODEL_MEMORY_BUDGET_MB
+from outbound_queue import outbound_queues, OUTBOUND_QUEUE_SIZE, OUTBOUND_SEND_TIMEOUT, OVERFLOW_POLICIES
+from partial_transcripts import partial_transcribers, PARTIAL_INTERVAL, PARTIAL_MIN_DURATION
+from phrase_pipeline import pipeline_factory, PIPELINE_DEPTH
+from recognition_batcher import recognition_batchers, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from rooms import rooms, ROOM_MAX_MEMBERS
+from session_manager import SESSION_IDLE_TIMEOUT
+from session_store import session_store, SESSION_BACKENDS
+from source_separation import source_separators, SEPARATION_WINDOW, SEPARATION_OVERLAP, SEPARATION_WORKERS
+from startup import readiness
+from translation_cache import translation_cache, CACHE_MEMORY_BUDGET_MB
+from websocket_handler import websocket_handler, session_manager, client_protocols, expire_session, handle_relay_event
+from worker_pool import worker_affinity, parse_affinity, reuseport_socket, run_workers
+
+METRICS_PORT = 9100
 
 app = Flask(__name__)
 CORS(app)
 
 
-async def start_server(port: int):
-    server = await serve(websocket_handler, "127.0.0.1", port)
-    print(f"WebSocket server is running on ws://127.0.0.1:{port}")
-    await server.wait_closed()
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok', 'uptime_seconds': readiness.status()['uptime_seconds']})
+
+
+@app.route('/readyz')
+def readyz():
+    status = readiness.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': "Send the audio as the 'file' form field"}), 400
+    extension = upload.filename.rsplit('.', 1)[-1] if '.' in (upload.filename or '') else 'mp3'
+    input_path = batch_jobs.save_upload(upload.read(), extension)
+    job = batch_jobs.submit(input_path, request.form.get('language_from', 'en'),
+                            request.form.get('language_to', 'ru'), request.form.get('model_name', 'small'),
+                            keep_background=request.form.get('keep_background', '').lower() in ('1', 'true'))
+    return jsonify(job.as_dict()), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Unknown job"}), 404
+    return jsonify(job.as_dict())
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Unknown job"}), 404
+    if job.status != 'done':
+        return jsonify(job.as_dict()), 409
+    return send_file(os.path.abspath(job.output_path), mimetype='audio/wav')
+
+
+@app.route('/rooms/<room_id>')
+def room_stats(room_id):
+    stats = rooms.stats().get(room_id)
+    if stats is None:
+        return jsonify({'error': "Unknown room"}), 404
+    return jsonify(stats)
+
+
+def collect_component_stats():
+    for key, entry in model_registry.stats().items():
+        yield 'model_refcount', {'model': key}, entry['refcount']
+        yield 'model_size_mb', {'model': key}, entry['size_mb']
+    for key, stats in recognition_batchers.stats().items():
+        for size, count in stats['batch_sizes'].items():
+            yield 'recognition_batches_total', {'model': key, 'size': str(size)}, count
+        for bound, count in stats['queue_wait_ms'].items():
+            yield 'recognition_batch_wait_total', {'model': key, 'le_ms': bound}, count
+    cache_stats = translation_cache.stats()
+    memory = cache_stats.pop('memory')
+    for kind, stats in cache_stats.items():
+        for name, value in stats.items():
+            yield f'cache_{name}_total', {'kind': kind}, value
+    yield 'cache_memory_bytes', {}, memory['bytes']
+    yield 'cache_entries', {}, memory['entries']
+    for connection_id, stats in outbound_queues.stats().items():
+        yield 'outbound_queue_depth', {'connection': connection_id}, stats['depth']
+        yield 'outbound_queue_dropped', {'connection': connection_id}, stats['dropped']
+        yield 'outbound_queue_coalesced', {'connection': connection_id}, stats['coalesced']
+    for room_id, stats in rooms.stats().items():
+        yield 'room_members', {'room': room_id}, stats['members']
+        yield 'room_phrases', {'room': room_id}, stats['phrases']
+
+
+def start_metrics_server(port: int):
+    metrics.add_gauge('active_sessions', lambda: len(session_manager.sessions))
+    metrics.add_gauge('connections', lambda: len(client_protocols))
+    metrics.add_gauge('loaded_models', lambda: len(model_registry.stats()))
+    metrics.add_gauge('queue_depth', scheduler.total_queue_depth)
+    metrics.add_gauge('admission_in_flight', lambda: admission.in_flight)
+    metrics.add_gauge('admission_queued_seconds', lambda: admission.queued_seconds)
+    metrics.add_collector(collect_component_stats)
+    metrics.add_collector(readiness.collect)
+    # The websocket server owns the main thread, Flask serves scrapes and batch jobs next to it
+    threading.Thread(target=app.run, kwargs={'host': '127.0.0.1', 'port': port, 'use_reloader': False},
+                     name='metrics', daemon=True).start()
+    print(f"Metrics, health checks and batch jobs are served on http://127.0.0.1:{port}")
+
+
+def prewarm_cache(phrases_path: str, model_keys):
+    with open(phrases_path, encoding='utf-8') as phrases_file:
+        phrases = phrases_file.readlines()
+    for language_from, language_to, model_name in model_keys:
+        manager = AudioProcessorManager()
+        manager.initialize_processor(language_to, language_from, model_name)
+        count = translation_cache.prewarm(manager, phrases)
+        manager.release()
+        print(f"Prewarmed {count} phrases for {language_from}->{language_to} ({model_name})")
+
+
+def start_up(preload_keys: List[ModelKey], warmup_keys: List[ModelKey], cache_prewarm: str = ""):
+    if preload_keys:
+        with readiness.phase('preload'):
+            model_registry.preload(preload_keys)
+    if cache_prewarm:
+        with readiness.phase('cache_prewarm'):
+            prewarm_cache(cache_prewarm, preload_keys)
+    for key in warmup_keys:
+        readiness.warm_up(model_registry.make_key(*key))
+
+
+async def start_server(port: int, worker_index: Optional[int] = None,
+                       startup_work: Optional[Callable[[], None]] = None):
+    if worker_index is None:
+        servers = [await serve(websocket_handler, "127.0.0.1", port)]
+    else:
+        servers = [
+            await serve(websocket_handler, sock=reuseport_socket("127.0.0.1", port)),
+            await serve(websocket_handler, "127.0.0.1", worker_affinity.worker_port(worker_index)),
+        ]
+    sweepers = [
+        asyncio.create_task(model_registry.run_sweeper()),
+        asyncio.create_task(session_manager.run_sweeper(expire_session)),
+        asyncio.create_task(session_store.listen(handle_relay_event)),
+    ]
+    print(f"WebSocket server is running on ws://127.0.0.1:{port}"
+          + (f" (worker {worker_index})" if worker_index is not None else ""))
+    readiness.mark_listening()
+    readiness.run(startup_work or (lambda: None))
+    await asyncio.gather(*(server.wait_closed() for server in servers))
+    for sweeper in sweepers:
+        sweeper.cancel()
+    scheduler.shutdown()
+
+
+def run_worker(index: int, port: int, metrics_port: int, shared_keys: List[ModelKey], warmup: bool,
+               cache_db: str, cache_prewarm: str):
+    session_store.new_worker()
+    # SQLite connections, model threads and CUDA contexts do not survive a fork, so every worker opens
+    # the cache and loads the --preload pairs itself, plus the pairs routed only to it
+    if cache_db:
+        translation_cache.open_store(cache_db)
+    if metrics_port:
+        start_metrics_server(metrics_port + index)
+    worker_affinity.worker_index = index
+    keys = shared_keys + worker_affinity.keys_for(index)
+    asyncio.run(start_server(port, index, partial(start_up, keys, keys if warmup else [], cache_prewarm)))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run Babylon Tower application.')
     parser.add_argument('--port', type=int, default=5000, help='Port number')
     parser.add_argument('--ngrok_token', type=str, default="", help='NGROK token')
     parser.add_argument('--is_debug', type=int, default=1, help='Use debug mode')
+    parser.add_argument('--preload', type=str, default="",
+                        help='Language pairs to load at startup, e.g. "en:ru:small,ru:en:small"')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='Run a dummy phrase through recognition, translation and synthesis of every preloaded '
+                             'pair at startup, /readyz reports ready only after it')
+    parser.add_argument('--model_ttl', type=float, default=MODEL_IDLE_TTL,
+                        help='Seconds to keep unused models loaded')
+    parser.add_argument('--model_memory_budget', type=int, default=MODEL_MEMORY_BUDGET_MB,
+                        help='Memory budget for loaded models in MB')
+    parser.add_argument('--model_backend', type=str, default='torch', choices=MODEL_BACKENDS,
+                        help='How models run: "torch" fp32, "int8" dynamically quantized PyTorch, or "ctranslate2" '
+                             'int8 faster-whisper and Marian (needs the ctranslate2 and faster-whisper packages)')
+    parser.add_argument('--intra_op_threads', type=int, default=0,
+                        help='Threads one model call may use, 0 keeps the library default')
+    parser.add_argument('--inter_op_threads', type=int, default=0,
+                        help='Model calls run in parallel inside the backend, 0 keeps the library default')
+    parser.add_argument('--inference_workers', type=int, default=INFERENCE_WORKERS,
+                        help='Number of inference worker threads or processes')
+    parser.add_argument('--inference_executor', type=str, default='thread', choices=EXECUTOR_TYPES,
+                        help='Pool used for decoding jobs; models always run on the thread pool')
+    parser.add_argument('--session_queue_size', type=int, default=SESSION_QUEUE_SIZE,
+                        help='Pending jobs per session before the server reports it is busy')
+    parser.add_argument('--pipeline_depth', type=int, default=PIPELINE_DEPTH,
+                        help='Phrases of one session in flight at once, the next phrase is recognized while the '
+                             'previous one is translated; results are always delivered in order, 1 disables overlap')
+    parser.add_argument('--admission_max_inferences', type=int, default=ADMISSION_MAX_INFERENCES,
+                        help='Phrases recognized or translated at once across all sessions, '
+                             'waiting phrases are served fairly per session; 0 disables admission control')
+    parser.add_argument('--admission_max_queued_seconds', type=float, default=ADMISSION_MAX_QUEUED_SECONDS,
+                        help='Seconds of phrase audio allowed to wait for a slot')
+    parser.add_argument('--admission_stale_seconds', type=float, default=ADMISSION_STALE_SECONDS,
+                        help='Phrases that waited longer than this are dropped under the drop_stale policy')
+    parser.add_argument('--degradation_policies', type=str, default='drop_stale',
+                        help=f'Comma separated subset of {",".join(DEGRADATION_POLICIES)}: drop stale phrases and '
+                             f'phrases over the queued budget, give new sessions a smaller model, or reject '
+                             f'initialize with a retry_after while the queue is nearly full')
+    parser.add_argument('--outbound_queue_size', type=int, default=OUTBOUND_QUEUE_SIZE,
+                        help='Messages waiting to be sent to one connection before the overflow policy applies')
+    parser.add_argument('--outbound_overflow', type=str, default='drop_oldest', choices=OVERFLOW_POLICIES,
+                        help='What a full send queue does: drop the oldest audio message, coalesce superseded '
+                             'updates such as partial transcripts before dropping audio, or disconnect the peer')
+    parser.add_argument('--outbound_send_timeout', type=float, default=OUTBOUND_SEND_TIMEOUT,
+                        help='Seconds one send may take before the connection is considered dead and closed')
+    parser.add_argument('--room_max_members', type=int, default=ROOM_MAX_MEMBERS,
+                        help='Members one room accepts, every language among them adds a translator per other language')
+    parser.add_argument('--partial_interval', type=float, default=PARTIAL_INTERVAL,
+                        help='Minimum seconds between tentative transcripts of one session for clients that '
+                             'initialize with "partials": true, 0 disables them')
+    parser.add_argument('--partial_min_duration', type=float, default=PARTIAL_MIN_DURATION,
+                        help='Seconds of buffered speech before the first tentative transcript of a phrase')
+    parser.add_argument('--batch_max_size', type=int, default=BATCH_MAX_SIZE,
+                        help='Phrases recognized in one Whisper pass across sessions, 1 disables batching. '
+                             'Capped at --inference_workers, since each waiting phrase holds a worker thread')
+    parser.add_argument('--batch_max_wait_ms', type=float, default=BATCH_MAX_WAIT_MS,
+                        help='How long the first phrase of a batch waits for more phrases, a phrase that '
+                             'arrives alone always waits this long')
+    parser.add_argument('--vad', type=str, default='energy', choices=VAD_TYPES,
+                        help='Voice activity detector used for endpointing, "webrtc" needs the webrtcvad package')
+    parser.add_argument('--max_phrase_duration', type=float, default=MAX_PHRASE_DURATION,
+                        help='Seconds of continuous speech after which a phrase is flushed')
+    parser.add_argument('--session_idle_timeout', type=float, default=SESSION_IDLE_TIMEOUT,
+                        help='Seconds without conversation audio after which a session is closed')
+    parser.add_argument('--session_backend', type=str, default='local', choices=SESSION_BACKENDS,
+                        help='Where sessions are registered, "redis" lets calls span several workers')
+    parser.add_argument('--session_backend_url', type=str, default="",
+                        help='Broker URL for the redis backend, e.g. redis://localhost:6379 or unix:///tmp/redis.sock')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Server processes sharing the port via SO_REUSEPORT, calls across them need --session_backend redis')
+    parser.add_argument('--worker_affinity', type=str, default="",
+                        help='Language pairs owned by one worker, e.g. "en:ru:small=0,ru:en:small=1"; '
+                             'initialize for them elsewhere answers with a redirect to that worker\'s port (port + 1 + index)')
+    parser.add_argument('--metrics_port', type=int, default=METRICS_PORT,
+                        help='Port of the HTTP API (Prometheus /metrics and batch /jobs), '
+                             'worker i uses metrics_port + i, 0 disables it')
+    parser.add_argument('--stage_timings', type=int, default=0,
+                        help='Add per-stage timings in ms to the log data of every translated phrase')
+    parser.add_argument('--cache_memory_mb', type=float, default=CACHE_MEMORY_BUDGET_MB,
+                        help='Memory budget for cached translations and speech in MB, 0 disables the cache')
+    parser.add_argument('--cache_db', type=str, default="",
+                        help='SQLite file that keeps cached translations across restarts')
+    parser.add_argument('--cache_prewarm', type=str, default="",
+                        help='File with one phrase per line to translate for every preloaded pair at startup')
+    parser.add_argument('--batch_workers', type=int, default=BATCH_WORKERS,
+                        help='Segments of a batch file job translated concurrently')
+    parser.add_argument('--jobs_dir', type=str, default=JOBS_DIR,
+                        help='Directory for uploaded files and results of batch jobs')
+    parser.add_argument('--separation_window', type=float, default=SEPARATION_WINDOW,
+                        help='Seconds of audio separated at once for batch jobs that keep the background')
+    parser.add_argument('--separation_overlap', type=float, default=SEPARATION_OVERLAP,
+                        help='Seconds consecutive separation windows share and crossfade')
+    parser.add_argument('--separation_workers', type=int, default=SEPARATION_WORKERS,
+                        help='Separation windows processed concurrently')
     args = parser.parse_args()
 
     PORT = args.port
     NGROK_TOKEN = args.ngrok_token
     IS_DEBUG = args.is_debug
 
+    with readiness.phase('configure'):
+        scheduler.configure(max_workers=args.inference_workers, max_queue_size=args.session_queue_size,
+                            executor_type=args.inference_executor)
+        pipeline_factory.configure(max_in_flight=args.pipeline_depth)
+        outbound_queues.configure(max_size=args.outbound_queue_size, send_timeout=args.outbound_send_timeout,
+                                  policy=args.outbound_overflow)
+        admission.configure(max_inferences=args.admission_max_inferences,
+                            max_queued_seconds=args.admission_max_queued_seconds,
+                            stale_seconds=args.admission_stale_seconds,
+                            policies=tuple(policy for policy in args.degradation_policies.split(',') if policy))
+        rooms.configure(max_members=args.room_max_members)
+        partial_transcribers.configure(interval=args.partial_interval, min_duration=args.partial_min_duration)
+        endpointer_factory.configure(vad_type=args.vad, max_phrase_duration=args.max_phrase_duration)
+        recognition_batchers.configure(max_batch_size=args.batch_max_size, max_wait_ms=args.batch_max_wait_ms,
+                                       max_callers=args.inference_workers)
+        model_backends.configure(backend=args.model_backend, intra_op_threads=args.intra_op_threads,
+                                 inter_op_threads=args.inter_op_threads)
+        model_registry.configure(idle_ttl=args.model_ttl, memory_budget_mb=args.model_memory_budget,
+                                 loader=model_backends.load)
+        session_manager.idle_timeout = args.session_idle_timeout
+        metrics.include_timings = bool(args.stage_timings)
+        session_store.configure(backend=args.session_backend, url=args.session_backend_url)
+        translation_cache.configure(memory_budget_mb=args.cache_memory_mb)
+        batch_jobs.configure(workers=args.batch_workers, jobs_dir=args.jobs_dir)
+        source_separators.configure(window=args.separation_window, overlap=args.separation_overlap,
+                                    workers=args.separation_workers)
+    preload_keys = parse_model_keys(args.preload)
+
     if NGROK_TOKEN:
+        from ngrok_tunnel import create_ngrok_tunnel
         create_ngrok_tunnel(NGROK_TOKEN, PORT)
 
-    asyncio.run(start_server(PORT))
+    if args.workers > 1:
+        if args.session_backend == 'local':
+            print("Warning: with the local session backend both sides of a call must reach the same worker")
+        worker_affinity.configure(PORT, parse_affinity(args.worker_affinity))
+        run_workers(args.workers, lambda index: run_worker(index, PORT, args.metrics_port, preload_keys,
+                                                           bool(args.warmup), args.cache_db, args.cache_prewarm))
+    else:
+        if args.cache_db:
+            translation_cache.open_store(args.cache_db)
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        # Sockets open right away, models load behind /readyz
+        asyncio.run(start_server(PORT, startup_work=partial(start_up, preload_keys,
+                                                            preload_keys if args.warmup else [],
+                                                            args.cache_prewarm)))
@@ -0,0 +1,152 @@
+import struct
+import threading
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+
+from utils import SAMPLE_RATE, CHANNELS
+
+OPUS_FRAME_SIZE = SAMPLE_RATE * 20 // 1000
+OPUS_BITRATE = 24000
+# Ogg Opus granule positions always count 48 kHz samples
+OPUS_GRANULE_RATE = 48000
+OPUS_PRE_SKIP = 312
+OGG_MAX_SEGMENTS = 255
+
+
+def _ogg_crc_table() -> List[int]:
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def ogg_crc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+class Mp3Encoder:
+    codec = 'mp3'
+    mime_type = 'audio/mpeg'
+
+    def __init__(self):
+        self._output = BytesIO()
+
+    def encode(self, audio_np: np.ndarray) -> bytes:
+        self._output.seek(0)
+        self._output.truncate()
+        sf.write(self._output, audio_np, SAMPLE_RATE, format='mp3')
+        return self._output.getvalue()
+
+
+class Pcm16Encoder:
+    codec = 'pcm16'
+    mime_type = f'audio/L16;rate={SAMPLE_RATE};channels={CHANNELS}'
+
+    def __init__(self):
+        self._samples = np.empty(0, dtype=np.int16)
+
+    def encode(self, audio_np: np.ndarray) -> bytes:
+        audio_np = np.asarray(audio_np, dtype=np.float32)
+        if self._samples.size < audio_np.size:
+            self._samples = np.empty(audio_np.size, dtype=np.int16)
+        samples = self._samples[:audio_np.size]
+        np.multiply(np.clip(audio_np, -1.0, 1.0), 32767, out=samples, casting='unsafe')
+        return samples.tobytes()
+
+
+class OggOpusEncoder:
+    codec = 'ogg_opus'
+    mime_type = 'audio/ogg; codecs=opus'
+
+    def __init__(self):
+        import opuslib
+        self._encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = OPUS_BITRATE
+        self._pcm = Pcm16Encoder()
+        self._serial = 0
+        self._output = BytesIO()
+
+    def encode(self, audio_np: np.ndarray) -> bytes:
+        # Every clip is a complete Ogg stream, so the encoder starts from a clean state each time
+        self._encoder.reset_state()
+        self._serial = (self._serial + 1) & 0xFFFFFFFF
+        self._output.seek(0)
+        self._output.truncate()
+
+        pcm = self._pcm.encode(audio_np)
+        frame_bytes = OPUS_FRAME_SIZE * 2
+        if len(pcm) % frame_bytes:
+            pcm += bytes(frame_bytes - len(pcm) % frame_bytes)
+        packets = [self._encoder.encode(pcm[start:start + frame_bytes], OPUS_FRAME_SIZE)
+                   for start in range(0, len(pcm), frame_bytes)]
+
+        head = b'OpusHead' + struct.pack('<BBHIhB', 1, CHANNELS, OPUS_PRE_SKIP, SAMPLE_RATE, 0, 0)
+        vendor = b'babelTower'
+        tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+        self._write_page([head], granule=0, sequence=0, header_type=0x02)
+        self._write_page([tags], granule=0, sequence=1)
+
+        total_samples = len(audio_np) * OPUS_GRANULE_RATE // SAMPLE_RATE
+        samples_per_packet = OPUS_FRAME_SIZE * OPUS_GRANULE_RATE // SAMPLE_RATE
+        sequence, page, segments, written = 2, [], 0, 0
+        for packet in packets:
+            packet_segments = len(packet) // 255 + 1
+            if page and segments + packet_segments > OGG_MAX_SEGMENTS:
+                self._write_page(page, OPUS_PRE_SKIP + written, sequence)
+                sequence, page, segments = sequence + 1, [], 0
+            page.append(packet)
+            segments += packet_segments
+            written += samples_per_packet
+        self._write_page(page, OPUS_PRE_SKIP + total_samples, sequence, header_type=0x04)
+        return self._output.getvalue()
+
+    def _write_page(self, packets: List[bytes], granule: int, sequence: int, header_type: int = 0):
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule, self._serial, sequence, 0, len(lacing))
+        page = bytearray(header + lacing + b''.join(packets))
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        self._output.write(page)
+
+
+ENCODERS: Dict[str, type] = {
+    Mp3Encoder.codec: Mp3Encoder,
+    Pcm16Encoder.codec: Pcm16Encoder,
+    OggOpusEncoder.codec: OggOpusEncoder,
+}
+
+
+class LockedEncoder:
+    # Encoders reuse their buffers between calls, yet one is shared by every job that plays on the same
+    # connection or room, so it encodes for one thread at a time
+    def __init__(self, encoder):
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self.codec = encoder.codec
+        self.mime_type = encoder.mime_type
+
+    def encode(self, audio_np: np.ndarray) -> bytes:
+        with self._lock:
+            return self._encoder.encode(audio_np)
+
+
+def create_encoder(codec: Optional[str] = None) -> LockedEncoder:
+    try:
+        return LockedEncoder(ENCODERS.get(codec, Mp3Encoder)())
+    except Exception as e:
+        # opuslib raises a bare Exception when the libopus shared library is missing
+        print(f"Codec '{codec}' is unavailable, using mp3: {e}")
+        return LockedEncoder(Mp3Encoder())
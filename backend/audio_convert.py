@@ -0,0 +1,132 @@
+from functools import lru_cache
+from io import BytesIO
+from math import gcd
+from typing import Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+
+INT16_SCALE = 32768.0
+# Filter half-length in input periods of the faster rate and Kaiser beta, the defaults of scipy's resample_poly
+FILTER_HALF_WIDTH = 10
+KAISER_BETA = 5.0
+
+
+def int16_to_float32(samples, out: Optional[np.ndarray] = None) -> np.ndarray:
+    samples = np.frombuffer(samples, dtype=np.int16) if not isinstance(samples, np.ndarray) else samples
+    if out is None:
+        out = np.empty(samples.shape, dtype=np.float32)
+    np.multiply(samples, 1 / INT16_SCALE, out=out, casting='unsafe')
+    return out
+
+
+def float32_to_int16(audio: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        out = np.empty(audio.shape, dtype=np.int16)
+    scaled = np.multiply(audio, INT16_SCALE, dtype=np.float32)
+    np.clip(scaled, -INT16_SCALE, INT16_SCALE - 1, out=scaled)
+    np.copyto(out, scaled, casting='unsafe')
+    return out
+
+
+def downmix(frames: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # (samples, channels) to mono by averaging, mono input passes through without a copy
+    if frames.ndim == 1:
+        return frames
+    if frames.shape[1] == 1:
+        return frames[:, 0]
+    # Column by column, a reduction over the short channel axis is several times slower
+    out = np.add(frames[:, 0], frames[:, 1], out=out, dtype=np.float32)
+    for channel in range(2, frames.shape[1]):
+        out += frames[:, channel]
+    out *= 1 / frames.shape[1]
+    return out
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up: int, down: int) -> Tuple[np.ndarray, int]:
+    # Kaiser windowed sinc low-pass at the lower of both Nyquist rates, split into `up` phases.
+    # Each phase is reversed so it applies as a dot product to a window of ascending input samples.
+    max_rate = max(up, down)
+    half_length = FILTER_HALF_WIDTH * max_rate
+    positions = np.arange(-half_length, half_length + 1)
+    taps = np.sinc(positions / max_rate) / max_rate * np.kaiser(len(positions), KAISER_BETA) * up
+    phase_length = -(-len(taps) // up)
+    padded = np.zeros(phase_length * up)
+    padded[:len(taps)] = taps
+    phases = padded.reshape(phase_length, up).T[:, ::-1]
+    return np.ascontiguousarray(phases, dtype=np.float32), half_length
+
+
+class Resampler:
+    # Polyphase resampling between two fixed rates. The last input samples are kept between calls,
+    # so the chunks of a stream come out as if the whole stream had been resampled at once.
+    def __init__(self, rate_from: int, rate_to: int):
+        divisor = gcd(rate_from, rate_to)
+        self.up = rate_to // divisor
+        self.down = rate_from // divisor
+        self._phases, self._delay = polyphase_filter(self.up, self.down)
+        self._taps = self._phases.shape[1]
+        self._work = np.zeros(self._taps - 1 + 2 * self._taps, dtype=np.float32)
+        self._consumed = 0
+        self._produced = 0
+
+    def output_length(self, input_length: int) -> int:
+        return -(-input_length * self.up // self.down)
+
+    def process(self, audio: np.ndarray, final: bool = False) -> np.ndarray:
+        if self.up == self.down:
+            return audio
+        history = self._taps - 1
+        total = self._consumed + len(audio)
+        if final:
+            end = self.output_length(total)
+        else:
+            # Only outputs whose whole filter window has arrived, the rest waits for the next chunk
+            end = max(self._produced, -(-(total * self.up - self._delay) // self.down))
+
+        # Work buffer: filter history, the new chunk and zero padding for the final outputs
+        needed = history + len(audio) + self._taps
+        if needed > len(self._work):
+            work = np.zeros(max(needed, 2 * len(self._work)), dtype=np.float32)
+            work[:history] = self._work[:history]
+            self._work = work
+        self._work[history:history + len(audio)] = audio
+        self._work[history + len(audio):needed] = 0
+        windows = sliding_window_view(self._work[:needed], self._taps)
+
+        out = np.empty(end - self._produced, dtype=np.float32)
+        for phase in range(self.up):
+            first = self._produced + (phase - self._produced) % self.up
+            if first >= end:
+                continue
+            position = first * self.down + self._delay
+            start = position // self.up - self._consumed
+            count = -(-(end - first) // self.up)
+            out[first - self._produced::self.up] = windows[start::self.down][:count] @ self._phases[position % self.up]
+
+        self._work[:history] = self._work[len(audio):len(audio) + history]
+        self._consumed = total
+        self._produced = end
+        return out
+
+
+def resample(audio: np.ndarray, rate_from: int, rate_to: int) -> np.ndarray:
+    if rate_from == rate_to:
+        return audio
+    return Resampler(rate_from, rate_to).process(np.asarray(audio, dtype=np.float32), final=True)
+
+
+def decode_audio_file(file_data: bytes, sample_rate: int, audio_format: str = 'mp3') -> np.ndarray:
+    # Mono float32 at sample_rate. libsndfile reads wav/flac/ogg/mp3 in-process, other containers go through ffmpeg.
+    try:
+        frames, file_rate = sf.read(BytesIO(file_data), dtype='float32', always_2d=True)
+    except (RuntimeError, TypeError):
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(BytesIO(file_data), format=audio_format)
+        if segment.sample_width != 2:
+            segment = segment.set_sample_width(2)
+        frames = int16_to_float32(segment.raw_data).reshape(-1, segment.channels)
+        file_rate = segment.frame_rate
+    return resample(downmix(frames), file_rate, sample_rate)
@@ -1,74 +1,311 @@
+import re
+import threading
+import time
 from datetime import datetime
-from utils import is_silent, audio_bytes_to_base64, SAMPLE_RATE, EXPECTED_SILENCE_DURATION, SAMPLE_WIDTH, CHANNELS
-from babylon_sts import AudioProcessor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from audio_codecs import create_encoder, LockedEncoder
+from utils import normalize_audio, SAMPLE_RATE
+from endpointing import endpointer_factory
+from metrics import metrics
+from model_registry import model_registry
+from partial_transcripts import PartialTranscriber
+from phrase_buffer import PhraseBuffer
+from recognition_batcher import recognition_batchers
+from translation_cache import translation_cache
+
+# Cached synthesis output before encoding, shared by every codec
+RAW_AUDIO_VARIANT = 'f32'
+
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def is_translated(segment: Dict) -> bool:
+    # Same filter as babylon_sts process_audio, which only skips segments Whisper is certain are silence
+    return int(segment['no_speech_prob']) < 0.3
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences = [sentence.strip() for sentence in SENTENCE_END.split(text)]
+    return [sentence for sentence in sentences if sentence]
 
 
 class AudioProcessorManager:
     def __init__(self):
         self.audio_processor = None
         self.last_timestamp = None
-        self.buffered_audio = []
+        self.buffered_audio = PhraseBuffer()
+        self.endpointer = endpointer_factory.create()
+        # take_phrase runs on the pool while the event loop may clear the phrase of a removed session
+        self._phrase_lock = threading.RLock()
+        # Encodes what goes back to the user, phrases of a call are played by the opponent in its codec
+        self.encoder = create_encoder()
+        self.peer_encoder: Optional[LockedEncoder] = None
         self.language_to = None
         self.language_from = None
         self.model_name = None
+        # Stage durations in ms of the phrase being processed, sent along with log_data when enabled.
+        # Pipelined phrases of one session run on different threads at once, so each thread keeps its own.
+        self._phrase = threading.local()
+        self.phrase_started_at = None
+        self.buffering_ms = None
+        # Id of the phrase being buffered, tentative transcripts and the final result share it
+        self.phrase_id = 0
+        self.partials: Optional[PartialTranscriber] = None
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        if not hasattr(self._phrase, 'timings'):
+            self._phrase.timings = {}
+        return self._phrase.timings
+
+    @timings.setter
+    def timings(self, timings: Dict[str, float]):
+        self._phrase.timings = timings
+
+    def stage(self, name: str):
+        return metrics.stage(name, self.timings)
 
     def initialize_processor(self, language_to, language_from, model_name):
+        # Shared models are reference counted, so drop the previous pair before switching
+        self.release()
+        self.audio_processor = model_registry.acquire(language_from, language_to, model_name)
         self.language_to = language_to
         self.language_from = language_from
         self.model_name = model_name
 
-        if language_from == 'en' and model_name != 'large':
-            model_name = f"{model_name}.en"
-        self.audio_processor = AudioProcessor(
-            language_to=language_to,
-            language_from=language_from,
-            model_name=model_name,
-            sample_rate=SAMPLE_RATE
-        )
+    def release(self):
+        if self.audio_processor is not None:
+            model_registry.release(self.language_from, self.language_to, self.model_name)
+            self.audio_processor = None
+        self.clear_phrase()
 
-    def translate_audio(self, audio_data: bytes):
+    def clear_phrase(self):
+        with self._phrase_lock:
+            self.buffered_audio.clear()
+            self.endpointer.reset()
+            self.phrase_started_at = None
+            self.phrase_id += 1
+
+    def translate_audio(self, audio_data, on_segment=None):
         if self.audio_processor is None:
             raise ValueError("Audio processor is not initialized. Use 'initialize' method before.")
 
+        timings = self.phrase_timings()
+        recognized = self.recognize_phrase(audio_data, timings)
+        return self.finish_phrase(timings, *recognized, on_segment, encoder=self.encoder)
+
+    def phrase_timings(self) -> Dict[str, float]:
+        # Opens the timings of a flushed phrase with the time it spent buffering
+        timings = {'buffering': self.buffering_ms} if self.buffering_ms is not None else {}
+        self.buffering_ms = None
+        return timings
+
+    def recognize_phrase(self, audio_data, timings: Dict[str, float]):
+        self.timings = timings
         timestamp = datetime.utcnow()
-        final_audio, log_data = self.audio_processor.process_audio(timestamp, audio_data)
-        return audio_bytes_to_base64(final_audio), log_data
+        audio_np = normalize_audio(audio_data)
+        return timestamp, audio_np, self.recognize(audio_np)
+
+    def finish_phrase(self, timings: Dict[str, float], timestamp: datetime, audio_np: np.ndarray,
+                      recognized_result, on_segment=None, encoder: Optional[LockedEncoder] = None):
+        self.timings = timings
+        final_audio, log_data = self.translate_recognized(timestamp, audio_np, recognized_result, on_segment,
+                                                          encoder)
+        if final_audio is not None:
+            final_audio = self.encode_segment(final_audio, encoder)
+        if metrics.include_timings:
+            log_data['stage_timings'] = self.timings
+        return final_audio, log_data
+
+    def recognize(self, audio_np: np.ndarray):
+        with self.stage('recognition'):
+            # Batching decodes with the PyTorch Whisper model directly, other backends transcribe one by one
+            if recognition_batchers.enabled and getattr(self.audio_processor, 'audio_model', None) is not None:
+                # The batcher takes the model lock itself, holding it here would keep other sessions out of the batch
+                return recognition_batchers.get(self.model_key, self.audio_processor).recognize(audio_np)
+            with model_registry.model_lock(self.model_key, 'recognition'):
+                return self.audio_processor.recognize_speech(audio_np)
+
+    def encode_segment(self, audio_np: np.ndarray, encoder: Optional[LockedEncoder] = None) -> bytes:
+        with self.stage('encode'):
+            return (encoder or self.encoder).encode(audio_np)
+
+    @property
+    def model_key(self):
+        return model_registry.make_key(self.language_from, self.language_to, self.model_name)
+
+    def cached_translate(self, text: str) -> str:
+        with self.stage('translation'):
+            translated_text = translation_cache.get_text(self.model_key, text)
+            if translated_text is None:
+                with model_registry.model_lock(self.model_key, 'translation'):
+                    translated_text = self.audio_processor.translate_text(text)
+                translation_cache.put_text(self.model_key, text, translated_text)
+            return translated_text
+
+    def voices(self) -> Optional[List[str]]:
+        # Silero speakers of the target language, None when the backend does not list them
+        speakers = getattr(getattr(self.audio_processor, 'tts_model', None), 'speakers', None)
+        return None if speakers is None else list(speakers)
+
+    def cached_synthesize(self, text: str, voice: Optional[str] = None) -> np.ndarray:
+        # voice picks another Silero speaker of the target language than the processor's default
+        if voice == getattr(self.audio_processor, 'speaker_name', None):
+            voice = None
+        variant = RAW_AUDIO_VARIANT if voice is None else f'{RAW_AUDIO_VARIANT}:{voice}'
+        with self.stage('synthesis'):
+            audio = translation_cache.get_audio(self.model_key, text, variant)
+            if audio is not None:
+                return np.frombuffer(audio, dtype=np.float32)
+            with model_registry.model_lock(self.model_key, 'synthesis'):
+                if voice is None:
+                    audio_np = self.audio_processor.synthesize_speech(text)
+                else:
+                    try:
+                        audio_np = self.audio_processor.tts_model.apply_tts(text=text, sample_rate=SAMPLE_RATE,
+                                                                            speaker=voice)
+                    except Exception as e:
+                        raise ValueError(f"Synthesis error for text '{text}' with voice '{voice}': {e}")
+            audio_np = np.asarray(audio_np, dtype=np.float32)
+            translation_cache.put_audio(self.model_key, text, variant, audio_np.tobytes())
+            return audio_np
+
+    def translate_recognized(self, timestamp: datetime, audio_np: np.ndarray, recognized_result, on_segment=None,
+                             encoder: Optional[LockedEncoder] = None):
+        # Mirrors AudioProcessor.process_audio, with recognition done by the caller.
+        # With on_segment every synthesized sentence is encoded and passed on as soon as it is ready.
+        recognized_segments = recognized_result['segments']
+        recognized_language = recognized_result['language']
+
+        if not recognized_segments or recognized_language == self.language_to:
+            if on_segment:
+                on_segment(self.encode_segment(audio_np, encoder))
+            return None if on_segment else audio_np, {
+                "timestamp": timestamp,
+                "original_text": recognized_result['text'],
+                "translated_text": recognized_result['text'],
+                "synthesis_delay": (datetime.utcnow() - timestamp).total_seconds(),
+                "recognize_result": recognized_result
+            }
+
+        pieces = []
+        audio_length = 0
+        translated_texts = []
+        for segment in recognized_segments:
+            translated_text = ""
+            if is_translated(segment):
+                translated_text = self.cached_translate(segment['text'])
+            translated_texts.append(translated_text)
+            if not translated_text:
+                continue
+
+            sentences = split_sentences(translated_text) if on_segment else [translated_text]
+            for index, sentence in enumerate(sentences):
+                piece = self.cached_synthesize(sentence)
+                silence_duration = int(segment['start'] * SAMPLE_RATE) - audio_length if index == 0 else 0
+                if silence_duration > 0:
+                    piece = np.pad(piece, (silence_duration, 0), 'constant')
+                audio_length += len(piece)
+                if on_segment:
+                    on_segment(self.encode_segment(piece, encoder))
+                else:
+                    pieces.append(piece)
+
+        final_audio = np.concatenate(pieces) if pieces else np.array([], dtype=np.float32)
+        return None if on_segment else final_audio, {
+            "timestamp": timestamp,
+            "original_text": " ".join(segment['text'] for segment in recognized_segments),
+            "translated_text": " ".join(translated_texts),
+            "synthesis_delay": (datetime.utcnow() - timestamp).total_seconds(),
+            "recognize_result": recognized_result
+        }
 
     def translate_text(self, text: str):
         if self.audio_processor is None:
             raise ValueError("Audio processor is not initialized. Use 'initialize' method before.")
 
-        translated_text = self.audio_processor.translate_text(text)
-        translated_audio = self.audio_processor.synthesize_speech(translated_text)
-        return audio_bytes_to_base64(translated_audio), translated_text
+        self.timings = {}
+        translated_text = self.cached_translate(text)
+        # Encoded audio is cached per codec on top of the raw synthesis, repeated phrases skip both steps
+        translated_audio = translation_cache.get_audio(self.model_key, translated_text, self.encoder.codec)
+        if translated_audio is None:
+            translated_audio = self.encode_segment(self.cached_synthesize(translated_text))
+            translation_cache.put_audio(self.model_key, translated_text, self.encoder.codec, translated_audio)
+        return translated_audio, translated_text
+
+    def partial_transcript(self, phrase_id: int, audio):
+        # Tentative text of an unfinished phrase, translated uncached since it will change
+        audio_np = normalize_audio(audio)
+        # Same model locks as final phrases, a partial decode shares Whisper's kv-cache hooks with them
+        with metrics.stage('partial_recognition'), model_registry.model_lock(self.model_key, 'recognition'):
+            original_text = self.partials.transcribe(self.audio_processor, phrase_id, audio_np)
+        if not original_text:
+            return original_text, ''
+        with metrics.stage('partial_translation'), model_registry.model_lock(self.model_key, 'translation'):
+            return original_text, self.audio_processor.translate_text(original_text)
 
-    def collect_complete_phrase(self, raw_audio_data: bytes):
-        self.buffered_audio.append(raw_audio_data)
-        combined_audio = b''.join(self.buffered_audio)
-        result = None
+    def collect_complete_phrase(self, raw_audio_data: bytes, on_segment=None):
+        phrase = self.take_phrase(raw_audio_data)
+        if phrase is None:
+            return None
+        if not len(phrase):
+            return None, {"error": "Audio too silent"}
+        return self.process_phrase(phrase, on_segment)
 
-        last_silence_duration = int(EXPECTED_SILENCE_DURATION * SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS)
-        if len(combined_audio) >= last_silence_duration:
-            # check if combined_audio ends with expected silence duration
-            last_duration = combined_audio[-last_silence_duration:]
-            if is_silent(last_duration):
-                result = self.process_buffered_audio()
+    def take_phrase(self, raw_audio_data: bytes) -> Optional[np.ndarray]:
+        # Buffers a chunk and returns the phrase it completes, a phrase without speech comes back empty
+        chunk = np.frombuffer(raw_audio_data, dtype=np.int16)
+        with self._phrase_lock:
+            if self.phrase_started_at is None:
+                self.phrase_started_at = time.monotonic()
+            self.buffered_audio.append(chunk)
 
-        return result
+            if self.endpointer.feed(chunk):
+                return self.take_buffered_audio()
 
-    def process_buffered_audio(self):
-        if not self.buffered_audio:
-            return
+            if self.endpointer.is_too_long(self.buffered_audio):
+                # Continuous speech never reaches the hangover, flush at the quietest point to bound latency
+                split_point = self.endpointer.find_split_point(self.buffered_audio)
+                phrase = self.buffered_audio.take(split_point)
+                self.endpointer.reset(has_speech=True)
+                self.end_phrase_buffering()
+                self.phrase_id += 1
+                return phrase
 
-        combined_audio = b''.join(self.buffered_audio)
-        self.buffered_audio = []
+            return None
 
-        if is_silent(combined_audio):
-            return None, {"error": "Audio too silent"}
+    def take_buffered_audio(self) -> Optional[np.ndarray]:
+        with self._phrase_lock:
+            if not len(self.buffered_audio):
+                return None
+
+            has_speech = self.endpointer.has_speech
+            combined_audio = self.buffered_audio.take()
+            self.endpointer.reset()
+            self.phrase_id += 1
+
+            if not has_speech:
+                self.phrase_started_at = None
+                return combined_audio[:0]
+
+            self.end_phrase_buffering()
+            return combined_audio
+
+    def end_phrase_buffering(self):
+        # Buffering is the wait between the first chunk of a phrase and its endpoint
+        if self.phrase_started_at is not None:
+            buffering = time.monotonic() - self.phrase_started_at
+            metrics.observe('stage_seconds', buffering, stage='buffering')
+            self.buffering_ms = round(buffering * 1000, 3)
+        self.phrase_started_at = time.monotonic() if len(self.buffered_audio) else None
 
+    def process_phrase(self, phrase: np.ndarray, on_segment=None):
         try:
-            processed_file_base64, log_data = self.translate_audio(combined_audio)
-            return processed_file_base64, log_data
+            processed_audio, log_data = self.translate_audio(phrase, on_segment)
+            return processed_audio, log_data
         except Exception as e:
             print(f"Translation error: {e}")
             return None, {"error": str(e)}
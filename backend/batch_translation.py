@@ -0,0 +1,362 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from audio_convert import downmix, float32_to_int16, int16_to_float32, Resampler
+from audio_processing import AudioProcessorManager
+from endpointing import endpointer_factory, Endpointer
+from phrase_buffer import PhraseBuffer
+from source_separation import source_separators, SEPARATION_WORKERS
+from utils import normalize_audio, SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+
+BATCH_WORKERS = 2
+READ_BLOCK_DURATION = 0.5
+CROSSFADE_DURATION = 0.01
+JOBS_DIR = 'jobs'
+
+Segment = Tuple[int, np.ndarray, bool]
+
+
+def read_pcm_blocks(path: str, block_duration: float = READ_BLOCK_DURATION) -> Iterator[np.ndarray]:
+    # ffmpeg decodes and resamples any container as a stream, so the file is never held in memory
+    block_bytes = int(block_duration * SAMPLE_RATE) * SAMPLE_WIDTH
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-i', path,
+               '-f', 's16le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-']
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        yield from read_soundfile_blocks(path, block_duration)
+        return
+
+    try:
+        while block := process.stdout.read(block_bytes):
+            yield np.frombuffer(block, dtype=np.int16)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode:
+        raise ValueError(f"ffmpeg could not decode {path}: {process.stderr.read().decode(errors='replace').strip()}")
+
+
+def read_soundfile_blocks(path: str, block_duration: float) -> Iterator[np.ndarray]:
+    sample_rate = sf.info(path).samplerate
+    resampler = Resampler(sample_rate, SAMPLE_RATE)
+    for block in sf.blocks(path, blocksize=int(block_duration * sample_rate), dtype='float32', always_2d=True):
+        yield float32_to_int16(resampler.process(downmix(block)))
+    tail = resampler.process(np.zeros(0, dtype=np.float32), final=True)
+    if len(tail):
+        yield float32_to_int16(tail)
+
+
+def split_segments(blocks: Iterable[np.ndarray], endpointer: Endpointer) -> Iterator[Segment]:
+    # Same endpointing as live audio, but silent stretches are kept so the output keeps the input's timing
+    buffer = PhraseBuffer()
+    index = 0
+    for block in blocks:
+        buffer.append(block)
+        if endpointer.feed(block):
+            has_speech = endpointer.has_speech
+            endpointer.reset()
+            yield index, buffer.take(), has_speech
+            index += 1
+        elif endpointer.is_too_long(buffer):
+            segment = buffer.take(endpointer.find_split_point(buffer))
+            endpointer.reset(has_speech=True)
+            yield index, segment, True
+            index += 1
+    if len(buffer):
+        yield index, buffer.take(), endpointer.has_speech
+
+
+class StitchWriter:
+    # Appends pieces to a WAV file as they come, the seam between two pieces is crossfaded
+    def __init__(self, path: str, crossfade_duration: float = CROSSFADE_DURATION):
+        self._file = sf.SoundFile(path, 'w', samplerate=SAMPLE_RATE, channels=CHANNELS, subtype='PCM_16')
+        self.crossfade_samples = int(crossfade_duration * SAMPLE_RATE)
+        self._tail = np.empty(0, dtype=np.float32)
+        self.samples_written = 0
+
+    def write(self, piece: np.ndarray):
+        piece = np.asarray(piece, dtype=np.float32)
+        fade = min(self.crossfade_samples, len(self._tail), len(piece))
+        if fade:
+            ramp = np.linspace(0, 1, fade, dtype=np.float32)
+            mixed = self._tail[len(self._tail) - fade:] * (1 - ramp) + piece[:fade] * ramp
+            audio = np.concatenate((self._tail[:len(self._tail) - fade], mixed, piece[fade:]))
+        else:
+            audio = np.concatenate((self._tail, piece))
+        # The end of the piece waits for the next one to fade into
+        keep = min(self.crossfade_samples, len(audio))
+        self._file.write(audio[:len(audio) - keep])
+        self.samples_written += len(audio) - keep
+        self._tail = audio[len(audio) - keep:]
+
+    def close(self):
+        self._file.write(self._tail)
+        self.samples_written += len(self._tail)
+        self._file.close()
+
+
+class Checkpoint:
+    # Finished segments of a job, stored next to the output until the job completes
+    def __init__(self, output_path: str, fingerprint: Dict):
+        self.directory = output_path + '.parts'
+        manifest_path = os.path.join(self.directory, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest:
+                if json.load(manifest) != fingerprint:
+                    shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(manifest_path, 'w') as manifest:
+            json.dump(fingerprint, manifest)
+
+    def _path(self, index: int) -> str:
+        return os.path.join(self.directory, f'{index:06d}.npy')
+
+    def load(self, index: int) -> Optional[np.ndarray]:
+        path = self._path(index)
+        return np.load(path) if os.path.exists(path) else None
+
+    def save(self, index: int, audio: np.ndarray):
+        temporary_path = self._path(index) + '.tmp'
+        with open(temporary_path, 'wb') as part:
+            np.save(part, np.asarray(audio, dtype=np.float32))
+        os.replace(temporary_path, self._path(index))
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class BatchJob:
+    def __init__(self, input_path: str, output_path: str, language_from: str = 'en', language_to: str = 'ru',
+                 model_name: str = 'small', workers: int = BATCH_WORKERS, job_id: Optional[str] = None,
+                 keep_background: bool = False):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.input_path = input_path
+        self.output_path = output_path
+        self.language_from = language_from
+        self.language_to = language_to
+        self.model_name = model_name
+        self.workers = workers
+        # Dubbing: the translated speech is laid over the input with its voice removed
+        self.keep_background = keep_background
+        self.status = 'queued'
+        self.error = ''
+        self.segments_done = 0
+        self.segments_resumed = 0
+        self.segments_failed = 0
+        self.seconds_processed = 0.0
+        self.on_progress: Optional[Callable[['BatchJob'], None]] = None
+        self._managers: 'Queue[AudioProcessorManager]' = Queue()
+        self._checkpoint: Optional[Checkpoint] = None
+        self._background: Optional[sf.SoundFile] = None
+        self._lock = threading.Lock()
+
+    def as_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'error': self.error,
+            'segments_done': self.segments_done,
+            'segments_resumed': self.segments_resumed,
+            'segments_failed': self.segments_failed,
+            'seconds_processed': round(self.seconds_processed, 2),
+            'keep_background': self.keep_background,
+        }
+
+    def fingerprint(self) -> Dict:
+        stat = os.stat(self.input_path)
+        return {
+            'input': os.path.abspath(self.input_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'language_from': self.language_from, 'language_to': self.language_to, 'model_name': self.model_name,
+            'vad': endpointer_factory.vad_type, 'max_phrase_duration': endpointer_factory.max_phrase_duration,
+        }
+
+    def run(self):
+        self._checkpoint = Checkpoint(self.output_path, self.fingerprint())
+        writer: Optional[StitchWriter] = None
+        try:
+            if self.keep_background:
+                self.status = 'separating'
+                self._report()
+                self._background = sf.SoundFile(self.separate_background())
+            self.status = 'running'
+            # The managers share the registry's models, whose locks let one segment be recognized
+            # while another is translated or synthesized, but never run one model twice at once
+            for _ in range(self.workers):
+                manager = AudioProcessorManager()
+                self._managers.put(manager)
+                manager.initialize_processor(self.language_to, self.language_from, self.model_name)
+
+            writer = StitchWriter(self.output_path)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch') as executor:
+                # Segments are written in order; a bounded window keeps memory flat on long files
+                pending: 'deque[Future]' = deque()
+                blocks = read_pcm_blocks(self.input_path)
+                for index, samples, has_speech in split_segments(blocks, endpointer_factory.create()):
+                    pending.append(self._submit(executor, index, samples, has_speech))
+                    while pending and (len(pending) > 2 * self.workers or pending[0].done()):
+                        self._write(writer, pending.popleft().result())
+                while pending:
+                    self._write(writer, pending.popleft().result())
+            writer.close()
+            self.status = 'done'
+        except Exception as e:
+            if writer is not None:
+                writer.close()
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"Batch job {self.job_id} failed: {e}")
+        finally:
+            while not self._managers.empty():
+                self._managers.get().release()
+            if self._background is not None:
+                self._background.close()
+        if self.status == 'done':
+            self._checkpoint.remove()
+        self._report()
+
+    def separate_background(self) -> str:
+        # A first pass streams the input through the separator into the checkpoint, a resumed job reuses it
+        path = os.path.join(self._checkpoint.directory, 'background.wav')
+        if os.path.exists(path):
+            return path
+        temporary_path = path + '.tmp'
+        blocks = (int16_to_float32(block) for block in read_pcm_blocks(self.input_path))
+        with sf.SoundFile(temporary_path, 'w', samplerate=SAMPLE_RATE, channels=CHANNELS, subtype='FLOAT',
+                          format='WAV') as background_file:
+            for _, background in source_separators.separate_blocks(blocks, SAMPLE_RATE):
+                background_file.write(background)
+        os.replace(temporary_path, path)
+        return path
+
+    def _submit(self, executor: ThreadPoolExecutor, index: int, samples: np.ndarray, has_speech: bool) -> Future:
+        future = Future()
+        if not has_speech:
+            future.set_result((len(samples), np.zeros(len(samples), dtype=np.float32)))
+            return future
+        audio = self._checkpoint.load(index)
+        if audio is not None:
+            self.segments_resumed += 1
+            future.set_result((len(samples), audio))
+            return future
+        return executor.submit(self._translate, index, samples)
+
+    def _translate(self, index: int, samples: np.ndarray) -> Tuple[int, np.ndarray]:
+        manager = self._managers.get()
+        try:
+            audio_np = normalize_audio(samples)
+            recognized_result = manager.recognize(audio_np)
+            translated_audio, _ = manager.translate_recognized(datetime.utcnow(), audio_np, recognized_result)
+        except Exception as e:
+            # One bad segment should not cost the whole file, it is replaced by silence of the same length
+            print(f"Batch job {self.job_id} segment {index} failed: {e}")
+            with self._lock:
+                self.segments_failed += 1
+            return len(samples), np.zeros(len(samples), dtype=np.float32)
+        finally:
+            self._managers.put(manager)
+        self._checkpoint.save(index, translated_audio)
+        return len(samples), translated_audio
+
+    def _write(self, writer: StitchWriter, result: Tuple[int, np.ndarray]):
+        input_samples, audio = result
+        if self._background is not None:
+            # Segments are written in input order, so the background is read alongside. Speech shorter
+            # than its segment is padded, the background plays on and later segments keep their timing.
+            background = self._background.read(input_samples, dtype='float32')
+            mixed = np.zeros(max(len(audio), len(background)), dtype=np.float32)
+            mixed[:len(audio)] += audio
+            mixed[:len(background)] += background
+            audio = mixed
+        writer.write(audio)
+        self.segments_done += 1
+        self.seconds_processed += input_samples / SAMPLE_RATE
+        self._report()
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress(self)
+
+
+class BatchJobManager:
+    def __init__(self, workers: int = BATCH_WORKERS, jobs_dir: str = JOBS_DIR):
+        self.workers = workers
+        self.jobs_dir = jobs_dir
+        self.jobs: Dict[str, BatchJob] = {}
+
+    def configure(self, workers: Optional[int] = None, jobs_dir: Optional[str] = None):
+        if workers is not None:
+            self.workers = workers
+        if jobs_dir is not None:
+            self.jobs_dir = jobs_dir
+
+    def save_upload(self, data: bytes, extension: str) -> str:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        extension = ''.join(char for char in extension if char.isalnum()) or 'bin'
+        path = os.path.join(self.jobs_dir, f'{uuid.uuid4().hex}.{extension}')
+        with open(path, 'wb') as upload:
+            upload.write(data)
+        return path
+
+    def submit(self, input_path: str, language_from: str, language_to: str, model_name: str,
+               on_progress: Optional[Callable[[BatchJob], None]] = None, keep_background: bool = False) -> BatchJob:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job = BatchJob(input_path, '', language_from, language_to, model_name, self.workers,
+                       keep_background=keep_background)
+        job.output_path = os.path.join(self.jobs_dir, f'{job.job_id}.wav')
+        job.on_progress = on_progress
+        self.jobs[job.job_id] = job
+        threading.Thread(target=job.run, name=f'batch-{job.job_id}', daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self.jobs.get(job_id)
+
+
+batch_jobs = BatchJobManager()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate a recorded audio file segment by segment.')
+    parser.add_argument('input', type=str, help='Audio file in any format ffmpeg reads')
+    parser.add_argument('output', type=str, help='WAV file to write, rerunning the same command resumes a crashed job')
+    parser.add_argument('--language_from', type=str, default='en', help='Spoken language')
+    parser.add_argument('--language_to', type=str, default='ru', help='Target language')
+    parser.add_argument('--model_name', type=str, default='small', help='Whisper model size')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='Segments translated concurrently')
+    parser.add_argument('--keep_background', action='store_true',
+                        help='Separate the voice from the input and keep the rest under the translated speech')
+    parser.add_argument('--separation_workers', type=int, default=SEPARATION_WORKERS,
+                        help='Windows of the input separated concurrently with --keep_background')
+    args = parser.parse_args()
+
+    source_separators.configure(workers=args.separation_workers)
+    job = BatchJob(args.input, args.output, args.language_from, args.language_to, args.model_name, args.workers,
+                   keep_background=args.keep_background)
+    job.on_progress = lambda progress: print(f"\r{progress.segments_done} segments, "
+                                             f"{progress.seconds_processed:.1f} s processed", end='', flush=True)
+    job.run()
+    print()
+    if job.status != 'done':
+        raise SystemExit(f"Translation failed: {job.error}")
+    print(f"Translated {job.segments_done} segments ({job.segments_resumed} resumed, "
+          f"{job.segments_failed} failed) into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from audio_convert import downmix, resample
+from benchmarks.micro import synthetic_audio
+from benchmarks.results import ResourceMeter, summarize, write_results
+from model_backends import model_backends, MODEL_BACKENDS
+from model_registry import model_registry
+from utils import SAMPLE_RATE
+
+Sample = Tuple[str, np.ndarray, Optional[str]]
+
+
+def load_samples(samples_dir: str) -> List[Sample]:
+    # Audio files with an optional reference transcript next to them: talk.wav + talk.txt
+    samples = []
+    for name in sorted(os.listdir(samples_dir)):
+        base, extension = os.path.splitext(name)
+        if extension.lower() not in ('.wav', '.flac', '.ogg'):
+            continue
+        audio, sample_rate = sf.read(os.path.join(samples_dir, name), dtype='float32', always_2d=True)
+        audio = resample(downmix(audio), sample_rate, SAMPLE_RATE)
+        reference_path = os.path.join(samples_dir, base + '.txt')
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as reference_file:
+                reference = reference_file.read().strip()
+        samples.append((name, audio, reference))
+    if not samples:
+        raise ValueError(f"No .wav, .flac or .ogg files in {samples_dir}")
+    return samples
+
+
+def words(text: str) -> List[str]:
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    expected, actual = words(reference), words(hypothesis)
+    if not expected:
+        return float(bool(actual))
+    distances = list(range(len(actual) + 1))
+    for i, expected_word in enumerate(expected, 1):
+        previous, distances[0] = distances[0], i
+        for j, actual_word in enumerate(actual, 1):
+            previous, distances[j] = distances[j], min(
+                distances[j] + 1, distances[j - 1] + 1, previous + (expected_word != actual_word)
+            )
+    return distances[-1] / len(expected)
+
+
+def bench_backend(backend: str, key, samples: List[Sample], baseline: Optional[List[str]]) -> Tuple[Dict, List[str]]:
+    meter = ResourceMeter().start()
+    started = time.perf_counter()
+    try:
+        processor = model_backends.load(key, backend)
+    except Exception as e:
+        print(f"{backend}: skipped, {e}")
+        return {'error': str(e)}, []
+    load_seconds = time.perf_counter() - started
+    processor.recognize_speech(samples[0][1])  # warm-up
+
+    recognition, translation, synthesis, errors, translations = [], [], [], [], []
+    for name, audio, reference in samples:
+        started = time.perf_counter()
+        text = processor.recognize_speech(audio)['text'].strip()
+        recognition.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        translated_text = processor.translate_text(text) if text else ''
+        translation.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        if translated_text:
+            processor.synthesize_speech(translated_text)
+        synthesis.append(time.perf_counter() - started)
+        if reference is not None:
+            errors.append(word_error_rate(reference, text))
+        translations.append(translated_text)
+
+    audio_seconds = sum(len(audio) for _, audio, _ in samples) / SAMPLE_RATE
+    result = {
+        'load_seconds': round(load_seconds, 3),
+        'recognition': summarize(recognition),
+        'translation': summarize(translation),
+        'synthesis': summarize(synthesis),
+        'realtime_factor': round(audio_seconds / sum(recognition + translation + synthesis), 2),
+        'resources': meter.stop(),
+    }
+    if errors:
+        result['word_error_rate'] = round(float(np.mean(errors)), 4)
+    if baseline:
+        # Without reference translations the first backend is the yardstick
+        result['translation_divergence'] = round(float(np.mean([
+            word_error_rate(expected, actual) for expected, actual in zip(baseline, translations)
+        ])), 4)
+    print(f"{backend}: {result['realtime_factor']}x realtime, WER {result.get('word_error_rate', 'n/a')}")
+    return result, translations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare accuracy and latency of the model backends.')
+    parser.add_argument('--backends', type=str, default=','.join(MODEL_BACKENDS),
+                        help='Comma separated backends, the first one is the baseline for translations')
+    parser.add_argument('--language_from', type=str, default='en', help='Spoken language of the samples')
+    parser.add_argument('--language_to', type=str, default='ru', help='Target language')
+    parser.add_argument('--model_name', type=str, default='small', help='Whisper model size')
+    parser.add_argument('--samples_dir', type=str, default="",
+                        help='Recordings with optional .txt references, synthetic audio (latency only) if empty')
+    parser.add_argument('--intra_op_threads', type=int, default=0, help='Threads one model call may use')
+    parser.add_argument('--inter_op_threads', type=int, default=0, help='Model calls run in parallel')
+    parser.add_argument('--output', type=str, default="", help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    model_backends.configure(intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+    key = model_registry.make_key(args.language_from, args.language_to, args.model_name)
+    if args.samples_dir:
+        samples = load_samples(args.samples_dir)
+    else:
+        samples = [(f'synthetic_{seed}', synthetic_audio(3.0, seed=seed).astype(np.float32) / 32768, None)
+                   for seed in range(5)]
+
+    results = {}
+    baseline = None
+    for backend in filter(None, args.backends.split(',')):
+        results[backend], translations = bench_backend(backend, key, samples, baseline)
+        if baseline is None and translations:
+            baseline = translations
+    # Peak RSS only grows within a process, run one backend at a time to compare memory
+    write_results(args.output, 'backends', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from io import BytesIO
+from typing import Dict, List
+
+from websockets import connect, serve
+
+from benchmarks.micro import CHUNK_DURATION, synthetic_audio
+from benchmarks.results import ResourceMeter, summarize, write_results
+from benchmarks.stub_processor import stub_loader
+from metrics import metrics
+from model_registry import model_registry
+from translation_cache import translation_cache
+from utils import SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS, bytes_to_base64
+from websocket_handler import websocket_handler
+
+
+def load_chunks(chunks_dir: str) -> List[bytes]:
+    # Recorded webm chunks, sent in file name order as one phrase
+    names = sorted(name for name in os.listdir(chunks_dir) if name.endswith('.webm'))
+    if not names:
+        raise ValueError(f"No .webm chunks in {chunks_dir}")
+    chunks = []
+    for name in names:
+        with open(os.path.join(chunks_dir, name), 'rb') as chunk_file:
+            chunks.append(chunk_file.read())
+    return chunks
+
+
+def synthetic_chunks(speech_seconds: float, silence_seconds: float) -> List[bytes]:
+    # Same shape as the frontend sends: every chunk is a complete webm/opus file
+    from pydub import AudioSegment
+    audio = synthetic_audio(speech_seconds, seed=1).tobytes() + synthetic_audio(silence_seconds, False, 2).tobytes()
+    chunk_bytes = int(CHUNK_DURATION * SAMPLE_RATE) * SAMPLE_WIDTH
+    chunks = []
+    for start in range(0, len(audio), chunk_bytes):
+        segment = AudioSegment(audio[start:start + chunk_bytes], frame_rate=SAMPLE_RATE,
+                               sample_width=SAMPLE_WIDTH, channels=CHANNELS)
+        output = BytesIO()
+        segment.export(output, format='webm', codec='libopus')
+        chunks.append(output.getvalue())
+    return chunks
+
+
+class ClientStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.completed = 0
+        self.timeouts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+async def run_client(url: str, chunks: List[bytes], phrases: int, realtime: bool, timeout: float,
+                     stats: ClientStats):
+    async with connect(url, max_size=None) as websocket:
+        await websocket.send(json.dumps({
+            'type': 'initialize',
+            'payload': {'language_from': 'en', 'language_to': 'ru', 'model_name': 'small'},
+        }))
+        while json.loads(await websocket.recv())['type'] != 'initialized':
+            pass
+
+        phrase_done = asyncio.Event()
+        last_sent = time.monotonic()
+
+        async def read_responses():
+            async for message in websocket:
+                stats.bytes_received += len(message)
+                if isinstance(message, bytes):
+                    continue
+                data = json.loads(message)
+                # Silent flushes are answered as well, only translated phrases count
+                if data['type'] == 'audio_processed' and not data['payload'].get('error'):
+                    stats.latencies.append(time.monotonic() - last_sent)
+                    phrase_done.set()
+
+        reader = asyncio.create_task(read_responses())
+        for _ in range(phrases):
+            phrase_done.clear()
+            for chunk in chunks:
+                message = json.dumps({'type': 'audio_data', 'payload': {'audio': bytes_to_base64(chunk)}})
+                await websocket.send(message)
+                stats.bytes_sent += len(message)
+                last_sent = time.monotonic()
+                if realtime:
+                    await asyncio.sleep(CHUNK_DURATION)
+            try:
+                await asyncio.wait_for(phrase_done.wait(), timeout)
+                stats.completed += 1
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+        reader.cancel()
+
+
+async def run_load_test(args, chunks: List[bytes]) -> Dict:
+    server = await serve(websocket_handler, '127.0.0.1', 0, max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    url = f'ws://127.0.0.1:{port}'
+    clients = [ClientStats() for _ in range(args.clients)]
+
+    meter = ResourceMeter().start()
+    started = time.monotonic()
+    await asyncio.gather(*(
+        run_client(url, chunks, args.phrases, args.realtime, args.timeout, stats) for stats in clients
+    ))
+    elapsed = time.monotonic() - started
+    resources = meter.stop()
+    server.close()
+    await server.wait_closed()
+
+    completed = sum(stats.completed for stats in clients)
+    return {
+        'phrases_completed': completed,
+        'phrases_timed_out': sum(stats.timeouts for stats in clients),
+        'throughput_phrases_per_second': round(completed / elapsed, 3),
+        'latency': summarize([latency for stats in clients for latency in stats.latencies]),
+        'bytes_sent': sum(stats.bytes_sent for stats in clients),
+        'bytes_received': sum(stats.bytes_received for stats in clients),
+        # Server and clients share the process, CPU and RSS cover both
+        'resources': resources,
+        'server_stages': metrics.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive simulated clients against websocket_handler with stub models.')
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent WebSocket clients')
+    parser.add_argument('--phrases', type=int, default=5, help='Phrases each client sends')
+    parser.add_argument('--chunks_dir', type=str, default="",
+                        help='Directory of recorded .webm chunks forming one phrase, synthetic audio if empty')
+    parser.add_argument('--realtime', type=int, default=1, help='Pace chunks like a live microphone')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a translated phrase')
+    parser.add_argument('--recognition_ms', type=float, default=200, help='Stub recognition latency')
+    parser.add_argument('--translation_ms', type=float, default=50, help='Stub translation latency')
+    parser.add_argument('--synthesis_ms', type=float, default=150, help='Stub synthesis latency')
+    parser.add_argument('--cache_memory_mb', type=float, default=0,
+                        help='Translation cache budget, off by default since every phrase has the same text')
+    parser.add_argument('--output', type=str, default="", help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    model_registry.configure(loader=stub_loader(args.recognition_ms, args.translation_ms, args.synthesis_ms))
+    translation_cache.configure(memory_budget_mb=args.cache_memory_mb)
+    chunks = load_chunks(args.chunks_dir) if args.chunks_dir else synthetic_chunks(2.0, 1.0)
+    results = asyncio.run(run_load_test(args, chunks))
+    write_results(args.output, 'load_test', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import time
+from io import BytesIO
+from typing import Callable, Dict, List
+
+import numpy as np
+import soundfile as sf
+
+from audio_convert import Resampler
+from audio_processing import AudioProcessorManager
+from benchmarks.results import ResourceMeter, summarize, write_results
+from benchmarks.stub_processor import StubAudioProcessor
+from utils import SAMPLE_RATE, audio_base64_to_bytes, audio_bytes_to_base64, audio_file_to_array, is_silent
+
+# The frontend records a complete webm file every 500 ms
+CHUNK_DURATION = 0.5
+# A typical uploaded file: CD rate stereo
+UPLOAD_SAMPLE_RATE = 44100
+
+
+def synthetic_audio(seconds: float, speech: bool = True, seed: int = 0) -> np.ndarray:
+    # Voiced speech is approximated by harmonics of a 150 Hz pitch under a 4 Hz syllable envelope
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    noise = rng.normal(0, 100, t.size)
+    if not speech:
+        return noise.astype(np.int16)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    voice = sum(np.sin(2 * np.pi * 150 * harmonic * t) / harmonic for harmonic in range(1, 6))
+    return np.clip(envelope * voice * 6000 + noise, -32768, 32767).astype(np.int16)
+
+
+def time_calls(fn: Callable, args_list: List[tuple]) -> List[float]:
+    durations = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def bench(name: str, fn: Callable, args_list: List[tuple], audio_seconds: float) -> Dict:
+    try:
+        fn(*args_list[0])  # warm-up, also surfaces missing codecs before timing
+        durations = time_calls(fn, args_list)
+    except Exception as e:
+        print(f"{name}: skipped, {e}")
+        return {'error': str(e)}
+    result = summarize(durations)
+    total = sum(durations)
+    result['calls_per_second'] = round(len(durations) / total, 1) if total else 0
+    # How many seconds of audio one second of CPU gets through
+    result['realtime_factor'] = round(audio_seconds * len(durations) / total, 1) if total else 0
+    print(f"{name}: p50 {result['p50_ms']} ms, {result['realtime_factor']}x realtime")
+    return result
+
+
+def pydub_file_to_array(file_data: bytes, audio_format: str = 'wav') -> np.ndarray:
+    # The conversion uploads went through before audio_convert, kept as the baseline
+    from pydub import AudioSegment
+    audio_segment = AudioSegment.from_file(BytesIO(file_data), format=audio_format)
+    audio_segment = audio_segment.set_frame_rate(SAMPLE_RATE).set_channels(1).set_sample_width(2)
+    return np.frombuffer(audio_segment.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def bench_file_conversion(iterations: int, seconds: float) -> Dict:
+    # Stereo 44.1 kHz WAV to mono 24 kHz float32, the old pydub path against the NumPy one
+    left = synthetic_audio(seconds * UPLOAD_SAMPLE_RATE / SAMPLE_RATE, seed=3)
+    right = synthetic_audio(seconds * UPLOAD_SAMPLE_RATE / SAMPLE_RATE, seed=4)
+    file_io = BytesIO()
+    sf.write(file_io, np.stack([left, right], axis=1), UPLOAD_SAMPLE_RATE, format='wav', subtype='PCM_16')
+    args_list = [(file_io.getvalue(), 'wav')] * iterations
+    return {
+        'pydub': bench('file_to_array_pydub', pydub_file_to_array, args_list, seconds),
+        'numpy': bench('file_to_array_numpy', audio_file_to_array, args_list, seconds),
+    }
+
+
+def bench_resampler(iterations: int, rate_from: int) -> Dict:
+    # Streaming resampling of 500 ms chunks into the processor rate
+    chunk = synthetic_audio(CHUNK_DURATION * rate_from / SAMPLE_RATE).astype(np.float32) / 32768
+    resampler = Resampler(rate_from, SAMPLE_RATE)
+    return bench(f'resample_{rate_from}', resampler.process, [(chunk,)] * iterations, CHUNK_DURATION)
+
+
+def bench_collect_complete_phrase(iterations: int, speech_seconds: float, silence_seconds: float) -> Dict:
+    # Zero-latency stub models, so only buffering, endpointing and encoding are measured
+    manager = AudioProcessorManager()
+    manager.audio_processor = StubAudioProcessor(0, 0, 0)
+    manager.language_from, manager.language_to, manager.model_name = 'en', 'ru', 'small'
+    stream = np.concatenate([synthetic_audio(speech_seconds, seed=1), synthetic_audio(silence_seconds, False, 2)])
+    chunk_size = int(CHUNK_DURATION * SAMPLE_RATE)
+    chunks = [(stream[start:start + chunk_size].tobytes(),) for start in range(0, len(stream), chunk_size)]
+    return bench('collect_complete_phrase', manager.collect_complete_phrase, chunks * iterations, CHUNK_DURATION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the audio hot paths.')
+    parser.add_argument('--iterations', type=int, default=200, help='Calls per benchmark')
+    parser.add_argument('--phrase_seconds', type=float, default=3.0, help='Length of the encoded test phrase')
+    parser.add_argument('--output', type=str, default="", help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    chunk = synthetic_audio(CHUNK_DURATION)
+    phrase = synthetic_audio(args.phrase_seconds).astype(np.float32) / 32768
+    meter = ResourceMeter().start()
+    results = {'is_silent': bench('is_silent', is_silent, [(chunk.tobytes(),)] * args.iterations, CHUNK_DURATION)}
+
+    results['audio_bytes_to_base64'] = bench('audio_bytes_to_base64', audio_bytes_to_base64,
+                                             [(phrase,)] * args.iterations, args.phrase_seconds)
+    try:
+        encoded = audio_bytes_to_base64(phrase)
+    except Exception as e:
+        encoded = None
+        results['audio_base64_to_bytes'] = {'error': f"no encoded input: {e}"}
+    if encoded:
+        results['audio_base64_to_bytes'] = bench('audio_base64_to_bytes', audio_base64_to_bytes,
+                                                 [(encoded,)] * args.iterations, args.phrase_seconds)
+
+    results['file_to_array'] = bench_file_conversion(max(1, args.iterations // 10), args.phrase_seconds)
+    for rate_from in (16000, 44100, 48000):
+        results[f'resample_{rate_from}'] = bench_resampler(args.iterations, rate_from)
+
+    results['collect_complete_phrase'] = bench_collect_complete_phrase(
+        max(1, args.iterations // 10), speech_seconds=args.phrase_seconds, silence_seconds=1.0
+    )
+    results['resources'] = meter.stop()
+    write_results(args.output, 'micro', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    # Latencies in seconds in, milliseconds out
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples) * 1000
+    return {
+        'count': len(samples),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+
+class ResourceMeter:
+    # CPU time and peak RSS of this process between start() and stop()
+    def start(self):
+        self._wall = time.monotonic()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        return self
+
+    def stop(self) -> Dict[str, float]:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wall = time.monotonic() - self._wall
+        cpu = (usage.ru_utime - self._usage.ru_utime) + (usage.ru_stime - self._usage.ru_stime)
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        rss_divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return {
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'cpu_utilization': round(cpu / wall, 3) if wall else 0,
+            'max_rss_mb': round(usage.ru_maxrss / rss_divisor, 1),
+        }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def write_results(path: str, benchmark: str, config: Dict, results: Dict):
+    report = {
+        'benchmark': benchmark,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as output:
+            output.write(text + '\n')
+    print(text)
@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+
+from model_registry import ModelKey
+from utils import SAMPLE_RATE
+
+
+class StubAudioProcessor:
+    # Same interface as babylon_sts.AudioProcessor, sleeps instead of running models
+    def __init__(self, recognition_ms: float = 200, translation_ms: float = 50, synthesis_ms: float = 150,
+                 speech_ratio: float = 1.0):
+        self.recognition_delay = recognition_ms / 1000
+        self.translation_delay = translation_ms / 1000
+        self.synthesis_delay = synthesis_ms / 1000
+        self.speech_ratio = speech_ratio
+
+    def recognize_speech(self, audio_np: np.ndarray):
+        time.sleep(self.recognition_delay)
+        text = f"phrase of {len(audio_np) / SAMPLE_RATE:.2f} seconds."
+        return {
+            'text': text,
+            'language': 'en',
+            'segments': [{'text': text, 'start': 0.0, 'end': len(audio_np) / SAMPLE_RATE, 'no_speech_prob': 0.0}],
+        }
+
+    def translate_text(self, text: str) -> str:
+        time.sleep(self.translation_delay)
+        return text.upper()
+
+    def synthesize_speech(self, text: str) -> np.ndarray:
+        time.sleep(self.synthesis_delay)
+        # Roughly a second of speech per 15 characters
+        duration = max(1, int(len(text) / 15 * SAMPLE_RATE * self.speech_ratio))
+        return (0.1 * np.sin(np.arange(duration) * 2 * np.pi * 220 / SAMPLE_RATE)).astype(np.float32)
+
+
+def stub_loader(recognition_ms: float, translation_ms: float, synthesis_ms: float):
+    def load(_: ModelKey) -> StubAudioProcessor:
+        return StubAudioProcessor(recognition_ms, translation_ms, synthesis_ms)
+    return load
@@ -0,0 +1,83 @@
+import struct
+from typing import Dict, Tuple
+
+from audio_codecs import create_encoder
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_BINARY = 'binary'
+PROTOCOLS = (PROTOCOL_JSON, PROTOCOL_BINARY)
+
+MAGIC = b'BT'
+VERSION = 1
+# magic, version, message type, codec, reserved, sequence number, session id
+HEADER = struct.Struct('!2sBBBxI16s')
+
+MESSAGE_TYPES: Dict[str, int] = {
+    'audio_data': 1,
+    'conversation_audio_data': 2,
+    'translate_audio': 3,
+    'room_audio_data': 4,
+    'audio_processed': 16,
+    'conversation_audio': 17,
+    'translated_audio': 18,
+    'translated_text': 19,
+    'audio_processed_chunk': 20,
+    'conversation_audio_chunk': 21,
+    'room_audio': 22,
+}
+CODECS: Dict[str, int] = {
+    'pcm16': 0,
+    'webm_opus': 1,
+    'mp3': 2,
+    'ogg_opus': 3,
+}
+MESSAGE_TYPE_NAMES = {value: name for name, value in MESSAGE_TYPES.items()}
+CODEC_NAMES = {value: name for name, value in CODECS.items()}
+
+
+def pack_frame(message_type: str, session_id: str, sequence: int, codec: str, audio: bytes) -> bytes:
+    session_bytes = bytes.fromhex(session_id) if session_id else bytes(16)
+    header = HEADER.pack(MAGIC, VERSION, MESSAGE_TYPES[message_type], CODECS[codec], sequence, session_bytes)
+    return header + audio
+
+
+def unpack_frame(frame: bytes) -> Tuple[str, str, int, str, bytes]:
+    if len(frame) < HEADER.size:
+        raise ValueError("Binary frame is shorter than its header")
+    magic, version, message_type, codec, sequence, session_bytes = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported binary frame {magic!r} v{version}")
+    if message_type not in MESSAGE_TYPE_NAMES or codec not in CODEC_NAMES:
+        raise ValueError(f"Unknown message type {message_type} or codec {codec}")
+    session_id = session_bytes.hex() if any(session_bytes) else ''
+    # A copy rather than a memoryview, the audio may be pickled for the process pool
+    return MESSAGE_TYPE_NAMES[message_type], session_id, sequence, CODEC_NAMES[codec], bytes(frame[HEADER.size:])
+
+
+class ClientProtocol:
+    def __init__(self):
+        self.protocol = PROTOCOL_JSON
+        self.stream_audio = False
+        self.partials = False
+        self.encoder = create_encoder()
+        self._sequence = 0
+
+    @property
+    def is_binary(self) -> bool:
+        return self.protocol == PROTOCOL_BINARY
+
+    @property
+    def codec(self) -> str:
+        return self.encoder.codec
+
+    def negotiate(self, requested: str, stream_audio: bool = False, codec: str = None, partials: bool = False) -> str:
+        self.protocol = requested if requested in PROTOCOLS else PROTOCOL_JSON
+        self.stream_audio = bool(stream_audio)
+        self.partials = bool(partials)
+        if codec and codec != self.encoder.codec:
+            self.encoder = create_encoder(codec)
+        return self.protocol
+
+    def next_sequence(self) -> int:
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        return self._sequence
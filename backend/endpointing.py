@@ -0,0 +1,120 @@
+from typing import Optional
+
+import numpy as np
+
+from audio_convert import float32_to_int16, int16_to_float32, resample
+from phrase_buffer import PhraseBuffer
+from utils import SAMPLE_RATE, SILENCE_THRESHOLD, EXPECTED_SILENCE_DURATION
+
+FRAME_DURATION = 0.02
+MAX_PHRASE_DURATION = 15.0
+VAD_TYPES = ('energy', 'webrtc')
+WEBRTC_SAMPLE_RATE = 16000
+
+
+class EnergyVad:
+    def __init__(self, min_threshold: float = SILENCE_THRESHOLD, snr_ratio: float = 3.0,
+                 zcr_threshold: float = 0.25, noise_adaptation: float = 0.05):
+        self.min_threshold = min_threshold
+        self.snr_ratio = snr_ratio
+        self.zcr_threshold = zcr_threshold
+        self.noise_adaptation = noise_adaptation
+        self.noise_floor = min_threshold / snr_ratio
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        energy = np.mean(np.abs(frame, dtype=np.int32))
+        zero_crossing_rate = np.count_nonzero(np.diff(np.signbit(frame))) / len(frame)
+
+        speech = energy > max(self.min_threshold, self.noise_floor * self.snr_ratio)
+        # Fricatives (s, f, sh) are quiet but noisy, they only have to stand out from the noise floor
+        if not speech and zero_crossing_rate > self.zcr_threshold:
+            speech = energy > max(self.min_threshold / 2, self.noise_floor * self.snr_ratio / 2)
+
+        if speech:
+            # Let the floor creep up slowly so a lasting rise in background noise is not speech forever
+            self.noise_floor += self.noise_adaptation * 0.02 * (energy - self.noise_floor)
+        else:
+            self.noise_floor += self.noise_adaptation * (energy - self.noise_floor)
+        return speech
+
+    def reset(self):
+        self.noise_floor = self.min_threshold / self.snr_ratio
+
+
+class WebRtcVad:
+    def __init__(self, aggressiveness: int = 2):
+        try:
+            import webrtcvad
+        except ImportError:
+            raise ValueError("WebRTC VAD requires the 'webrtcvad' package")
+        self._vad = webrtcvad.Vad(aggressiveness)
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        # WebRTC VAD only accepts 8/16/32/48 kHz, each frame is resampled on its own to keep its exact length
+        frame_16k = float32_to_int16(resample(int16_to_float32(frame), SAMPLE_RATE, WEBRTC_SAMPLE_RATE))
+        return self._vad.is_speech(frame_16k.tobytes(), WEBRTC_SAMPLE_RATE)
+
+    def reset(self):
+        pass
+
+
+class Endpointer:
+    def __init__(self, vad, frame_duration: float = FRAME_DURATION,
+                 hangover_duration: float = EXPECTED_SILENCE_DURATION,
+                 max_phrase_duration: float = MAX_PHRASE_DURATION):
+        self.vad = vad
+        self.frame_size = int(SAMPLE_RATE * frame_duration)
+        self.hangover_frames = max(1, int(hangover_duration / frame_duration))
+        self.max_phrase_samples = int(SAMPLE_RATE * max_phrase_duration)
+        self.has_speech = False
+        self._silent_frames = 0
+        self._pending = np.empty(0, dtype=np.int16)
+
+    def feed(self, chunk: np.ndarray) -> bool:
+        samples = np.concatenate((self._pending, chunk)) if self._pending.size else chunk
+        frames_end = len(samples) - len(samples) % self.frame_size
+        for start in range(0, frames_end, self.frame_size):
+            if self.vad.is_speech(samples[start:start + self.frame_size]):
+                self.has_speech = True
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+        self._pending = samples[frames_end:].copy()
+        return self._silent_frames >= self.hangover_frames
+
+    def is_too_long(self, buffer: PhraseBuffer) -> bool:
+        return len(buffer) >= self.max_phrase_samples
+
+    def find_split_point(self, buffer: PhraseBuffer) -> int:
+        # Cut at the quietest frame of the second half so neither part becomes a fragment
+        energies = buffer.frame_energies(self.frame_size, start=len(buffer) // 2)
+        if not energies.size:
+            return len(buffer)
+        return len(buffer) // 2 + int(np.argmin(energies)) * self.frame_size
+
+    def reset(self, has_speech: bool = False):
+        self.has_speech = has_speech
+        self._silent_frames = 0
+        # An unfinished frame belongs to the phrase that was just taken or dropped
+        self._pending = np.empty(0, dtype=np.int16)
+
+
+class EndpointerFactory:
+    def __init__(self, vad_type: str = 'energy', max_phrase_duration: float = MAX_PHRASE_DURATION):
+        self.vad_type = vad_type
+        self.max_phrase_duration = max_phrase_duration
+
+    def configure(self, vad_type: Optional[str] = None, max_phrase_duration: Optional[float] = None):
+        if vad_type is not None:
+            if vad_type not in VAD_TYPES:
+                raise ValueError(f"Unknown VAD type '{vad_type}', expected one of {VAD_TYPES}")
+            self.vad_type = vad_type
+        if max_phrase_duration is not None:
+            self.max_phrase_duration = max_phrase_duration
+
+    def create(self) -> Endpointer:
+        vad = WebRtcVad() if self.vad_type == 'webrtc' else EnergyVad()
+        return Endpointer(vad, max_phrase_duration=self.max_phrase_duration)
+
+
+endpointer_factory = EndpointerFactory()
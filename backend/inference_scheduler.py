@@ -0,0 +1,121 @@
+import asyncio
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from metrics import metrics
+
+INFERENCE_WORKERS = 2
+SESSION_QUEUE_SIZE = 8
+EXECUTOR_TYPES = ('thread', 'process')
+
+# Session whose job is running, set by its worker task and inherited by the tasks the job creates
+current_session: ContextVar = ContextVar('current_session', default=None)
+
+
+class SchedulerBusyError(Exception):
+    pass
+
+
+class InferenceScheduler:
+    def __init__(self, max_workers: int = INFERENCE_WORKERS, max_queue_size: int = SESSION_QUEUE_SIZE,
+                 executor_type: str = 'thread'):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.executor_type = executor_type
+        self._thread_executor: Optional[ThreadPoolExecutor] = None
+        self._process_executor: Optional[ProcessPoolExecutor] = None
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._running: Dict[str, Set[Future]] = {}
+
+    def configure(self, max_workers: Optional[int] = None, max_queue_size: Optional[int] = None,
+                  executor_type: Optional[str] = None):
+        if executor_type is not None and executor_type not in EXECUTOR_TYPES:
+            raise ValueError(f"Unknown executor type '{executor_type}', expected one of {EXECUTOR_TYPES}")
+        self.shutdown()
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if max_queue_size is not None:
+            self.max_queue_size = max_queue_size
+        if executor_type is not None:
+            self.executor_type = executor_type
+
+    def _executor(self, picklable: bool) -> Executor:
+        # Shared models live in this process, so only self-contained jobs may leave it
+        if picklable and self.executor_type == 'process':
+            if self._process_executor is None:
+                self._process_executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._process_executor
+        if self._thread_executor is None:
+            self._thread_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        return self._thread_executor
+
+    async def run_blocking(self, fn: Callable, *args, picklable: bool = False) -> Any:
+        future = self._executor(picklable).submit(fn, *args)
+        session_id = current_session.get()
+        if session_id is not None:
+            running = self._running.setdefault(session_id, set())
+            running.add(future)
+            future.add_done_callback(running.discard)
+        return await asyncio.wrap_future(future)
+
+    async def wait_session(self, session_id: str):
+        # Cancelling a session's tasks does not stop the calls already running on the pool, whatever
+        # they use, e.g. the session's models, has to outlive them
+        running = self._running.pop(session_id, set())
+        if running:
+            await asyncio.wait([asyncio.wrap_future(future) for future in list(running)])
+
+    def submit(self, session_id: str, job: Callable[..., Awaitable], *args):
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = asyncio.Queue(maxsize=self.max_queue_size)
+            self._workers[session_id] = asyncio.create_task(self._worker(session_id, queue))
+        try:
+            queue.put_nowait((job, args, time.monotonic()))
+        except asyncio.QueueFull:
+            raise SchedulerBusyError(f"Session queue is full ({self.max_queue_size} pending jobs)")
+
+    def queue_depth(self, session_id: str) -> int:
+        queue = self._queues.get(session_id)
+        return queue.qsize() if queue else 0
+
+    def total_queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def cancel_session(self, session_id: str):
+        self._queues.pop(session_id, None)
+        worker = self._workers.pop(session_id, None)
+        if worker:
+            worker.cancel()
+
+    def shutdown(self):
+        for session_id in list(self._workers):
+            self.cancel_session(session_id)
+        if self._thread_executor:
+            self._thread_executor.shutdown(wait=False, cancel_futures=True)
+            self._thread_executor = None
+        if self._process_executor:
+            self._process_executor.shutdown(wait=False, cancel_futures=True)
+            self._process_executor = None
+
+    @staticmethod
+    async def _worker(session_id: str, queue: asyncio.Queue):
+        # Jobs of one session run strictly one after another in arrival order
+        current_session.set(session_id)
+        while True:
+            job, args, enqueued_at = await queue.get()
+            metrics.observe('stage_seconds', time.monotonic() - enqueued_at, stage='queue_wait')
+            try:
+                await job(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Inference job error: {e}")
+            finally:
+                queue.task_done()
+
+
+scheduler = InferenceScheduler()
@@ -0,0 +1,143 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Sub-buckets per power of two, values land within ~6% of their true size like an HDR histogram
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+METRIC_PREFIX = 'babylon_'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in items) + '}'
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f'{value:.6f}'
+
+
+class Histogram:
+    # Log-linear buckets over integer microseconds: constant relative error, fixed memory per decade
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket_index(value: int) -> int:
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return shift * SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index: int) -> int:
+        shift = max(0, index // SUB_BUCKETS - 1)
+        return (index - shift * SUB_BUCKETS) << shift
+
+    def record(self, seconds: float):
+        index = self.bucket_index(max(0, int(seconds * 1_000_000)))
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, quantile: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return (self.bucket_value(index) + self.bucket_value(index + 1)) / 2 / 1_000_000
+        return self.max
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+        self.include_timings = False
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.record(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, name: str, read: Callable[[], float]):
+        self._gauges[name] = read
+
+    def add_collector(self, collect: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]):
+        # Collectors turn component stats into (name, labels, value) samples at scrape time
+        self._collectors.append(collect)
+
+    @contextmanager
+    def stage(self, name: str, timings: Optional[Dict[str, float]] = None):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.observe('stage_seconds', elapsed, stage=name)
+            if timings is not None:
+                timings[name] = round(timings.get(name, 0) + elapsed * 1000, 3)
+
+    def percentile(self, name: str, quantile: float, **labels) -> float:
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return histogram.percentile(quantile) if histogram else 0.0
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name + format_labels(labels): {
+                    'count': histogram.count,
+                    **{f'p{int(quantile * 100)}_ms': round(histogram.percentile(quantile) * 1000, 3)
+                       for quantile in QUANTILES},
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = METRIC_PREFIX + name
+                if f'# TYPE {metric} summary' not in lines:
+                    lines.append(f'# TYPE {metric} summary')
+                for quantile in QUANTILES:
+                    value = histogram.percentile(quantile)
+                    lines.append(f'{metric}{format_labels(labels, {"quantile": str(quantile)})} {value:.6f}')
+                lines.append(f'{metric}_sum{format_labels(labels)} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{format_labels(labels)} {histogram.count}')
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f'{METRIC_PREFIX}{name}{format_labels(labels)} {format_value(value)}')
+        for name, read in sorted(self._gauges.items()):
+            lines.append(f'{METRIC_PREFIX}{name} {format_value(read())}')
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                lines.append(f'{METRIC_PREFIX}{name}{format_labels(tuple(labels.items()))} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
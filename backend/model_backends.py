@@ -0,0 +1,146 @@
+import os
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from model_registry import ModelKey
+from utils import SAMPLE_RATE
+
+MODEL_BACKENDS = ('torch', 'int8', 'ctranslate2')
+
+if TYPE_CHECKING:
+    from babylon_sts import AudioProcessor
+    from babylon_sts.processor import RecognizeResult
+
+
+def set_torch_threads(intra_op_threads: int, inter_op_threads: int):
+    # Torch thread pools are per process, so they cover every model of the torch based backends
+    if not intra_op_threads and not inter_op_threads:
+        return
+    import torch
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Only possible before the first parallel op, a second configure keeps the old value
+            print(f"Inter-op threads are already fixed at {torch.get_num_interop_threads()}")
+
+
+def quantize_int8(processor: 'AudioProcessor') -> 'AudioProcessor':
+    # Dynamic quantization stores Linear weights as int8 and quantizes activations on the fly,
+    # which is where Whisper and Marian spend most of their CPU time
+    import torch
+    import whisper
+    for module in processor.audio_model.modules():
+        # Whisper's Linear only adds a dtype cast to nn.Linear, quantize_dynamic matches exact types
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    processor.audio_model = torch.quantization.quantize_dynamic(
+        processor.audio_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    processor.translation_model = torch.quantization.quantize_dynamic(
+        processor.translation_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return processor
+
+
+class CTranslate2Processor:
+    # Same interface as babylon_sts.AudioProcessor with int8 CTranslate2 models for recognition
+    # (faster-whisper) and translation, speech synthesis stays on Silero
+    def __init__(self, language_to: str, language_from: str, model_name: str, sample_rate: int = SAMPLE_RATE,
+                 intra_op_threads: int = 0, inter_op_threads: int = 1):
+        try:
+            import ctranslate2
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ValueError("The ctranslate2 backend needs the 'ctranslate2' and 'faster-whisper' packages")
+        from babylon_sts.processor import lang_settings, load_or_download_translation_model, load_silero_model
+
+        self.language_to = language_to
+        self.language_from = language_from
+        self.sample_rate = sample_rate
+        self.speaker = lang_settings[language_to]['speaker']
+        self.speaker_name = lang_settings[language_to]['speaker_name']
+
+        self.whisper_model = WhisperModel(model_name, device='cpu', compute_type='int8',
+                                          cpu_threads=intra_op_threads, num_workers=max(1, inter_op_threads))
+        self.tokenizer, translation_model = load_or_download_translation_model(language_to, language_from)
+        del translation_model
+        converted_dir = f"local_model_{language_from}_{language_to}_ct2"
+        if not os.path.exists(converted_dir):
+            converter = ctranslate2.converters.TransformersConverter(f"local_model_{language_from}_{language_to}")
+            converter.convert(converted_dir, quantization='int8')
+        self.translator = ctranslate2.Translator(converted_dir, device='cpu', compute_type='int8',
+                                                 intra_threads=intra_op_threads,
+                                                 inter_threads=max(1, inter_op_threads))
+        self.tts_model, self.example_text = load_silero_model(language_to, self.speaker)
+
+    def recognize_speech(self, audio_np: np.ndarray) -> 'RecognizeResult':
+        from babylon_sts.processor import lang_settings
+        try:
+            segments, info = self.whisper_model.transcribe(
+                audio_np.astype(np.float32), language=lang_settings[self.language_from]['translation_key']
+            )
+            segments = [
+                {'start': segment.start, 'end': segment.end, 'text': segment.text,
+                 'no_speech_prob': segment.no_speech_prob}
+                for segment in segments
+            ]
+        except Exception as e:
+            raise ValueError(f"Recognition error: {e}")
+        return {'text': ''.join(segment['text'] for segment in segments), 'segments': segments,
+                'language': info.language}
+
+    def translate_text(self, text: str) -> str:
+        try:
+            tokens = self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text))
+            hypothesis = self.translator.translate_batch([tokens])[0].hypotheses[0]
+            return self.tokenizer.decode(self.tokenizer.convert_tokens_to_ids(hypothesis), skip_special_tokens=True)
+        except Exception as e:
+            raise ValueError(f"Translated error '{text}': {e}")
+
+    def synthesize_speech(self, text: str) -> np.ndarray:
+        try:
+            return self.tts_model.apply_tts(text=text, sample_rate=self.sample_rate, speaker=self.speaker_name)
+        except Exception as e:
+            raise ValueError(f"Synthesis error for text '{text}': {e}")
+
+
+class ModelBackends:
+    def __init__(self, backend: str = 'torch', intra_op_threads: int = 0, inter_op_threads: int = 0):
+        self.backend = backend
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def configure(self, backend: Optional[str] = None, intra_op_threads: Optional[int] = None,
+                  inter_op_threads: Optional[int] = None):
+        if backend is not None:
+            if backend not in MODEL_BACKENDS:
+                raise ValueError(f"Unknown model backend '{backend}', expected one of {MODEL_BACKENDS}")
+            self.backend = backend
+        if intra_op_threads is not None:
+            self.intra_op_threads = intra_op_threads
+        if inter_op_threads is not None:
+            self.inter_op_threads = inter_op_threads
+        if self.backend != 'ctranslate2':
+            set_torch_threads(self.intra_op_threads, self.inter_op_threads)
+
+    def load(self, key: ModelKey, backend: Optional[str] = None):
+        language_from, language_to, model_name = key
+        backend = backend or self.backend
+        if backend == 'ctranslate2':
+            return CTranslate2Processor(language_to, language_from, model_name, SAMPLE_RATE,
+                                        self.intra_op_threads, self.inter_op_threads)
+        from babylon_sts import AudioProcessor
+        processor = AudioProcessor(
+            language_to=language_to,
+            language_from=language_from,
+            model_name=model_name,
+            sample_rate=SAMPLE_RATE
+        )
+        return quantize_int8(processor) if backend == 'int8' else processor
+
+
+model_backends = ModelBackends()
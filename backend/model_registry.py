@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from utils import SAMPLE_RATE
+
+if TYPE_CHECKING:
+    # Importing babylon_sts pulls in torch, transformers and whisper, models load it on first use
+    from babylon_sts import AudioProcessor
+
+MODEL_IDLE_TTL = 600
+MODEL_MEMORY_BUDGET_MB = 8192
+MODEL_SWEEP_INTERVAL = 30
+# Approximate resident size of Whisper + Marian + Silero weights for each Whisper size
+MODEL_MEMORY_ESTIMATES_MB = {
+    'tiny': 600,
+    'base': 700,
+    'small': 1300,
+    'medium': 2900,
+    'large': 5500,
+}
+
+ModelKey = Tuple[str, str, str]
+# Models of a pair that each take one call at a time
+MODEL_STAGES = ('recognition', 'translation', 'synthesis')
+
+
+def resolve_model_name(language_from: str, model_name: str) -> str:
+    if language_from == 'en' and model_name != 'large' and not model_name.endswith('.en'):
+        return f"{model_name}.en"
+    return model_name
+
+
+def estimate_model_size(model_name: str) -> int:
+    return MODEL_MEMORY_ESTIMATES_MB.get(model_name.split('.')[0], MODEL_MEMORY_ESTIMATES_MB['large'])
+
+
+def parse_model_keys(value: str) -> List[ModelKey]:
+    # "en:ru:small,ru:en:small" -> [('en', 'ru', 'small'), ('ru', 'en', 'small')]
+    keys = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        language_from, language_to, *rest = item.split(':')
+        keys.append((language_from, language_to, rest[0] if rest else 'small'))
+    return keys
+
+
+class ModelEntry:
+    def __init__(self, key: ModelKey, processor: 'AudioProcessor', size_mb: int, pinned: bool = False):
+        self.key = key
+        self.processor = processor
+        self.size_mb = size_mb
+        self.pinned = pinned
+        self.refcount = 0
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    def __init__(self, idle_ttl: float = MODEL_IDLE_TTL, memory_budget_mb: int = MODEL_MEMORY_BUDGET_MB):
+        self.idle_ttl = idle_ttl
+        self.memory_budget_mb = memory_budget_mb
+        self._entries: 'OrderedDict[ModelKey, ModelEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[ModelKey, threading.Lock] = {}
+        self._model_locks: Dict[Tuple[ModelKey, str], threading.Lock] = {}
+        self._evict_callbacks: List[Callable[[ModelKey, 'AudioProcessor'], None]] = []
+        self.loader: Callable[[ModelKey], 'AudioProcessor'] = self._load
+
+    def configure(self, idle_ttl: Optional[float] = None, memory_budget_mb: Optional[int] = None,
+                  loader: Optional[Callable[[ModelKey], 'AudioProcessor']] = None):
+        if idle_ttl is not None:
+            self.idle_ttl = idle_ttl
+        if memory_budget_mb is not None:
+            self.memory_budget_mb = memory_budget_mb
+        if loader is not None:
+            self.loader = loader
+
+    def add_evict_callback(self, callback: Callable[[ModelKey, 'AudioProcessor'], None]):
+        self._evict_callbacks.append(callback)
+
+    @staticmethod
+    def make_key(language_from: str, language_to: str, model_name: str) -> ModelKey:
+        return language_from, language_to, resolve_model_name(language_from, model_name)
+
+    def acquire(self, language_from: str, language_to: str, model_name: str) -> 'AudioProcessor':
+        key = self.make_key(language_from, language_to, model_name)
+        entry = self._checkout(key)
+        if entry:
+            return entry.processor
+
+        with self._load_lock(key):
+            # Another session may have finished loading the same key while we waited
+            entry = self._checkout(key)
+            if entry:
+                return entry.processor
+
+            size_mb = estimate_model_size(key[2])
+            self.evict_idle(reserve_mb=size_mb)
+            processor = self.loader(key)
+            entry = ModelEntry(key, processor, size_mb)
+            with self._lock:
+                entry.refcount = 1
+                self._entries[key] = entry
+            return processor
+
+    def release(self, language_from: str, language_to: str, model_name: str):
+        key = self.make_key(language_from, language_to, model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.refcount > 0:
+                entry.refcount -= 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+        self.evict_idle()
+
+    def preload(self, keys: List[ModelKey]):
+        for language_from, language_to, model_name in keys:
+            key = self.make_key(language_from, language_to, model_name)
+            self.acquire(*key)
+            with self._lock:
+                self._entries[key].pinned = True
+            self.release(*key)
+            print(f"Preloaded models for {key}")
+
+    def evict_idle(self, reserve_mb: int = 0):
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refcount == 0 and not entry.pinned and now - entry.last_used > self.idle_ttl:
+                    evicted.append(self._entries.pop(key))
+
+            # Entries are kept in LRU order, so the oldest idle models go first
+            used_mb = sum(entry.size_mb for entry in self._entries.values())
+            for key, entry in list(self._entries.items()):
+                if used_mb + reserve_mb <= self.memory_budget_mb:
+                    break
+                if entry.refcount == 0:
+                    evicted.append(self._entries.pop(key))
+                    used_mb -= entry.size_mb
+
+        for entry in evicted:
+            print(f"Evicted models for {entry.key}")
+            for callback in self._evict_callbacks:
+                callback(entry.key, entry.processor)
+        return len(evicted)
+
+    async def run_sweeper(self, interval: float = MODEL_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                ':'.join(key): {'refcount': entry.refcount, 'size_mb': entry.size_mb, 'pinned': entry.pinned}
+                for key, entry in self._entries.items()
+            }
+
+    def _checkout(self, key: ModelKey) -> Optional[ModelEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry.refcount += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+            return entry
+
+    def _load_lock(self, key: ModelKey) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def model_lock(self, key: ModelKey, stage: str) -> threading.Lock:
+        # Whisper installs kv-cache hooks on its shared decoder for every decode, and neither Marian nor Silero
+        # is thread safe, so every call into a model holds its lock. The models of a pair lock separately,
+        # pipelined phrases still recognize one phrase while another is synthesized.
+        if stage not in MODEL_STAGES:
+            raise ValueError(f"Unknown model stage '{stage}', expected one of {MODEL_STAGES}")
+        with self._lock:
+            return self._model_locks.setdefault((key, stage), threading.Lock())
+
+    @staticmethod
+    def _load(key: ModelKey) -> 'AudioProcessor':
+        from babylon_sts import AudioProcessor
+        language_from, language_to, model_name = key
+        return AudioProcessor(
+            language_to=language_to,
+            language_from=language_from,
+            model_name=model_name,
+            sample_rate=SAMPLE_RATE
+        )
+
+
+model_registry = ModelRegistry()
@@ -1,9 +1,8 @@
-from pyngrok import ngrok
-
 NGROK_PERMANENT_URL = "curious-goldfish-next.ngrok-free.app"
 
 
 def create_ngrok_tunnel(token, port):
+    from pyngrok import ngrok
     ngrok.set_auth_token(token)
     # Close existing tunnels to avoid error
     for tunnel in ngrok.get_tunnels():
@@ -0,0 +1,210 @@
+import asyncio
+import weakref
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+from websockets.exceptions import ConnectionClosed
+
+from metrics import metrics
+
+OUTBOUND_QUEUE_SIZE = 32
+OUTBOUND_SEND_TIMEOUT = 10.0
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+
+class OutboundMessage:
+    # Frames that go out back to back, e.g. the JSON metadata and the binary audio of one message
+    def __init__(self, frames: Tuple, droppable: bool = False, coalesce_key: Optional[Hashable] = None):
+        self.frames = frames
+        self.droppable = droppable
+        self.coalesce_key = coalesce_key
+
+
+# Queued after the last message when the connection should be closed once everything before it is sent
+CLOSE = OutboundMessage(())
+
+
+class OutboundQueue:
+    # Everything sent to one connection goes through here and is written by a task of its own, so a slow
+    # or stalled peer never blocks the coroutine that produced the message, e.g. the other side of a call
+    def __init__(self, connection, max_size: int = OUTBOUND_QUEUE_SIZE,
+                 send_timeout: float = OUTBOUND_SEND_TIMEOUT, policy: str = 'drop_oldest', closed: bool = False):
+        self.connection = connection
+        self.max_size = max_size
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.closed = closed
+        self._messages: Deque[OutboundMessage] = deque()
+        self._wakeup = asyncio.Event()
+        # A queue that starts closed drops everything and has no writer to clean up
+        self._writer = asyncio.create_task(self._run()) if not closed else None
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages)
+
+    def put(self, *frames, droppable: bool = False, coalesce_key: Optional[Hashable] = None) -> bool:
+        # Never waits, returns False when the message was dropped instead
+        if self.closed:
+            return False
+        message = OutboundMessage(frames, droppable, coalesce_key)
+        if coalesce_key is not None and self.policy == 'coalesce' and self._coalesce(message):
+            return True
+        if len(self._messages) >= self.max_size and not self._make_room(message):
+            return False
+        self._messages.append(message)
+        self._wakeup.set()
+        return True
+
+    def close_after_sent(self):
+        if not self.closed:
+            self.closed = True
+            self._messages.append(CLOSE)
+            self._wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self._messages.clear()
+        if self._writer:
+            self._writer.cancel()
+
+    async def drain(self):
+        # Sends what is queued and closes the connection, a peer that stopped reading gets one send timeout
+        self.close_after_sent()
+        if self._writer is None:
+            return
+        try:
+            await asyncio.wait_for(self._writer, self.send_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+
+    def _coalesce(self, message: OutboundMessage) -> bool:
+        # A newer message with the same key, e.g. the next partial transcript, makes the queued one stale
+        for index, queued in enumerate(self._messages):
+            if queued.coalesce_key == message.coalesce_key:
+                del self._messages[index]
+                self._messages.append(message)
+                self.coalesced += 1
+                metrics.inc('outbound_coalesced_total')
+                return True
+        return False
+
+    def _make_room(self, message: OutboundMessage) -> bool:
+        if self.policy != 'disconnect':
+            victim = next((queued for queued in self._messages if queued.droppable), None)
+            if victim is not None:
+                self._messages.remove(victim)
+                self._drop('overflow')
+                return True
+            if message.droppable:
+                self._drop('overflow')
+                return False
+        # Nothing that may be dropped is queued, the peer is not reading at all
+        self._drop('disconnect')
+        self._disconnect()
+        self._writer.cancel()
+        return False
+
+    def _drop(self, reason: str):
+        self.dropped += 1
+        metrics.inc('outbound_dropped_total', reason=reason)
+
+    def _disconnect(self):
+        self.closed = True
+        self._messages.clear()
+        # Closing runs the usual disconnect path of the connection's own handler
+        asyncio.ensure_future(self._close_connection())
+
+    async def _close_connection(self):
+        try:
+            await asyncio.wait_for(self.connection.close(), self.send_timeout)
+        except (asyncio.TimeoutError, ConnectionClosed):
+            pass
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._messages:
+                message = self._messages.popleft()
+                if message is CLOSE:
+                    await self._close_connection()
+                    return
+                try:
+                    for frame in message.frames:
+                        with metrics.stage('send'):
+                            await asyncio.wait_for(self.connection.send(frame), self.send_timeout)
+                        metrics.inc('bytes_out_total', len(frame))
+                except asyncio.TimeoutError:
+                    print(f"Send to {self.connection.id} timed out after {self.send_timeout} s, disconnecting")
+                    metrics.inc('outbound_send_timeouts_total')
+                    self._disconnect()
+                    return
+                except ConnectionClosed:
+                    self.closed = True
+                    self._messages.clear()
+                    return
+                except Exception as e:
+                    print(f"Send to {self.connection.id} failed: {e}")
+                    continue
+                self.sent += 1
+
+
+class OutboundQueues:
+    def __init__(self, max_size: int = OUTBOUND_QUEUE_SIZE, send_timeout: float = OUTBOUND_SEND_TIMEOUT,
+                 policy: str = 'drop_oldest'):
+        self.max_size = max_size
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self._queues: Dict = {}
+        # Connections whose queue was removed or drained, e.g. a client that left while its batch job runs
+        self._retired: 'weakref.WeakSet' = weakref.WeakSet()
+
+    def configure(self, max_size: Optional[int] = None, send_timeout: Optional[float] = None,
+                  policy: Optional[str] = None):
+        if policy is not None:
+            if policy not in OVERFLOW_POLICIES:
+                raise ValueError(f"Unknown overflow policy '{policy}', expected one of {OVERFLOW_POLICIES}")
+            self.policy = policy
+        if max_size is not None:
+            self.max_size = max_size
+        if send_timeout is not None:
+            self.send_timeout = send_timeout
+
+    def get(self, connection) -> OutboundQueue:
+        queue = self._queues.get(connection.id)
+        if queue is not None and queue.connection is connection:
+            return queue
+        if connection in self._retired or getattr(connection, 'closed', False):
+            # Late messages to a connection that is gone are dropped, without a queue that nobody removes
+            return OutboundQueue(connection, closed=True)
+        if queue:
+            queue.close()
+        queue = self._queues[connection.id] = OutboundQueue(connection, self.max_size, self.send_timeout,
+                                                            self.policy)
+        return queue
+
+    def remove(self, connection_id):
+        queue = self._queues.pop(connection_id, None)
+        if queue:
+            self._retired.add(queue.connection)
+            queue.close()
+
+    async def drain(self, connection_id):
+        queue = self._queues.pop(connection_id, None)
+        if queue:
+            self._retired.add(queue.connection)
+            await queue.drain()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            str(connection_id): {'depth': queue.depth, 'dropped': queue.dropped, 'coalesced': queue.coalesced,
+                                 'sent': queue.sent}
+            for connection_id, queue in self._queues.items()
+        }
+
+
+outbound_queues = OutboundQueues()
@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+PARTIAL_INTERVAL = 1.0
+PARTIAL_MIN_DURATION = 1.0
+
+if TYPE_CHECKING:
+    from babylon_sts import AudioProcessor
+
+
+def common_prefix(previous: str, current: str) -> str:
+    words = []
+    for previous_word, current_word in zip(previous.split(), current.split()):
+        if previous_word != current_word:
+            break
+        words.append(current_word)
+    return ' '.join(words)
+
+
+class PartialTranscriber:
+    # Tentative transcripts of the phrase that is still being spoken. Words two consecutive reruns
+    # agree on are considered stable and forced as the decoder prefix, so reruns only decode the tail.
+    def __init__(self, interval: float = PARTIAL_INTERVAL, min_duration: float = PARTIAL_MIN_DURATION):
+        self.interval = interval
+        self.min_samples = int(min_duration * SAMPLE_RATE)
+        self.last_run_at = 0.0
+        self.task = None
+        self._lock = threading.Lock()
+        self._phrase_id = None
+        self._hypothesis = ''
+        self.stable = ''
+
+    def due(self, buffered_samples: int, now: Optional[float] = None) -> bool:
+        # At most one rerun in flight and one per interval, whatever the chunk rate of the client
+        now = time.monotonic() if now is None else now
+        return ((self.task is None or self.task.done()) and buffered_samples >= self.min_samples
+                and now - self.last_run_at >= self.interval)
+
+    def transcribe(self, processor: 'AudioProcessor', phrase_id: int, audio_np: np.ndarray) -> str:
+        # The caller holds the model's recognition lock, self._lock only guards the hypothesis
+        import torch
+        import whisper
+        from babylon_sts.processor import lang_settings
+
+        with self._lock:
+            if phrase_id != self._phrase_id:
+                self._phrase_id, self._hypothesis, self.stable = phrase_id, '', ''
+            prefix = self.stable
+
+        model = getattr(processor, 'audio_model', None)
+        if model is None or len(audio_np) > whisper.audio.N_SAMPLES:
+            text = processor.recognize_speech(audio_np)['text'].strip()
+        else:
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio_np), model.dims.n_mels).to(model.device)
+            options = whisper.DecodingOptions(
+                language=lang_settings[processor.language_from]['translation_key'],
+                fp16=torch.cuda.is_available(),
+                without_timestamps=True,
+                prefix=prefix or None,
+            )
+            # The forced prefix is not part of the decoded text
+            text = f"{prefix} {whisper.decode(model, mel, options).text.strip()}".strip()
+
+        with self._lock:
+            if phrase_id == self._phrase_id:
+                self.stable = common_prefix(self._hypothesis, text)
+                self._hypothesis = text
+        return text
+
+
+class PartialTranscriberFactory:
+    def __init__(self, interval: float = PARTIAL_INTERVAL, min_duration: float = PARTIAL_MIN_DURATION):
+        self.interval = interval
+        self.min_duration = min_duration
+
+    def configure(self, interval: Optional[float] = None, min_duration: Optional[float] = None):
+        if interval is not None:
+            self.interval = interval
+        if min_duration is not None:
+            self.min_duration = min_duration
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def create(self) -> PartialTranscriber:
+        return PartialTranscriber(self.interval, self.min_duration)
+
+
+partial_transcribers = PartialTranscriberFactory()
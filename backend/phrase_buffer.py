@@ -0,0 +1,80 @@
+from typing import Optional
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+INITIAL_CAPACITY = SAMPLE_RATE * 5
+
+
+class PhraseBuffer:
+    def __init__(self, initial_capacity: int = INITIAL_CAPACITY):
+        self._capacity = initial_capacity
+        self._samples: Optional[np.ndarray] = None
+        # _energy[i] is the sum of |sample| over the first i samples, so any window energy is one subtraction
+        self._energy = np.zeros(initial_capacity + 1, dtype=np.int64)
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, raw_audio_data):
+        chunk = np.frombuffer(raw_audio_data, dtype=np.int16)
+        if not chunk.size:
+            return
+        self._reserve(self._length + chunk.size)
+
+        start, end = self._length, self._length + chunk.size
+        self._samples[start:end] = chunk
+        np.cumsum(np.abs(chunk, dtype=np.int32), out=self._energy[start + 1:end + 1])
+        self._energy[start + 1:end + 1] += self._energy[start]
+        self._length = end
+
+    def frame_energies(self, frame_size: int, start: int = 0) -> np.ndarray:
+        boundaries = self._energy[start:self._length + 1:frame_size]
+        return np.diff(boundaries) / frame_size
+
+    def peek(self) -> np.ndarray:
+        # Filled samples are never written again, the view stays valid while chunks keep arriving
+        if self._samples is None:
+            return np.empty(0, dtype=np.int16)
+        return self._samples[:self._length]
+
+    def take(self, count: Optional[int] = None) -> np.ndarray:
+        # Hand the filled storage over as a view and continue in fresh storage,
+        # so the consumer can keep reading it while new chunks arrive
+        if self._samples is None:
+            return np.empty(0, dtype=np.int16)
+        count = self._length if count is None else min(count, self._length)
+        storage = self._samples
+        remainder = self._length - count
+
+        self._samples = None
+        self._length = 0
+        if remainder:
+            self._reserve(remainder)
+            self._samples[:remainder] = storage[count:count + remainder]
+            self._energy[1:remainder + 1] = self._energy[count + 1:count + remainder + 1] - self._energy[count]
+            self._length = remainder
+        return storage[:count]
+
+    def clear(self):
+        self._samples = None
+        self._length = 0
+
+    def _reserve(self, size: int):
+        if self._samples is not None and size <= self._samples.size:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        if capacity != self._capacity:
+            energy = np.zeros(capacity + 1, dtype=np.int64)
+            energy[:self._length + 1] = self._energy[:self._length + 1]
+            self._energy = energy
+            self._capacity = capacity
+
+        samples = np.empty(capacity, dtype=np.int16)
+        if self._samples is not None:
+            samples[:self._length] = self._samples[:self._length]
+        self._samples = samples
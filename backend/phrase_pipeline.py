@@ -0,0 +1,100 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+PIPELINE_DEPTH = 2
+
+# A send waiting for its turn, e.g. partial(send_audio_message, connection, ...)
+Send = Callable[[], Awaitable]
+Emit = Callable[[Send], None]
+Stage = Callable[[Any, Emit], Awaitable[Any]]
+
+
+class PhrasePipeline:
+    # Phrases of one session flow through the stages concurrently: while phrase N is translated,
+    # phrase N+1 is already recognized. Every stage still takes phrases in order, one at a time,
+    # and whatever a phrase emits is held back until all earlier phrases have been delivered.
+    def __init__(self, max_in_flight: int = PIPELINE_DEPTH):
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._stage_locks: List[asyncio.Lock] = []
+        # Output queues in submission order, the reorder buffer the delivery task drains
+        self._outputs: asyncio.Queue = asyncio.Queue()
+        self._tasks: Set[asyncio.Task] = set()
+        self._delivery: Optional[asyncio.Task] = None
+
+    async def submit(self, value: Any, *stages: Stage,
+                     on_error: Optional[Callable[[Exception, Emit], None]] = None):
+        # Waits while max_in_flight phrases are undelivered, which backs up the session queue
+        output = await self._open()
+        task = asyncio.create_task(self._run(value, stages, output, on_error))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def deliver(self, send: Send):
+        # A ready result, e.g. for a silent phrase, still waits for the phrases before it
+        output = await self._open()
+        output.put_nowait(send)
+        output.put_nowait(None)
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._delivery:
+            self._delivery.cancel()
+            self._delivery = None
+
+    async def _open(self) -> asyncio.Queue:
+        await self._slots.acquire()
+        output = asyncio.Queue()
+        self._outputs.put_nowait(output)
+        if self._delivery is None:
+            self._delivery = asyncio.create_task(self._deliver())
+        return output
+
+    def _stage_lock(self, index: int) -> asyncio.Lock:
+        while len(self._stage_locks) <= index:
+            self._stage_locks.append(asyncio.Lock())
+        return self._stage_locks[index]
+
+    async def _run(self, value: Any, stages, output: asyncio.Queue, on_error):
+        try:
+            for index, stage in enumerate(stages):
+                # Locks wake waiters in FIFO order, so phrases cannot overtake each other inside a stage
+                async with self._stage_lock(index):
+                    value = await stage(value, output.put_nowait)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if on_error:
+                on_error(e, output.put_nowait)
+            else:
+                print(f"Pipeline stage error: {e}")
+        finally:
+            output.put_nowait(None)
+
+    async def _deliver(self):
+        while True:
+            output = await self._outputs.get()
+            while (send := await output.get()) is not None:
+                try:
+                    await send()
+                except Exception as e:
+                    print(f"Pipeline delivery error: {e}")
+            self._slots.release()
+
+
+class PipelineFactory:
+    def __init__(self, max_in_flight: int = PIPELINE_DEPTH):
+        self.max_in_flight = max_in_flight
+
+    def configure(self, max_in_flight: Optional[int] = None):
+        if max_in_flight is not None:
+            if max_in_flight < 1:
+                raise ValueError("Pipeline depth must be at least 1")
+            self.max_in_flight = max_in_flight
+
+    def create(self) -> PhrasePipeline:
+        return PhrasePipeline(self.max_in_flight)
+
+
+pipeline_factory = PipelineFactory()
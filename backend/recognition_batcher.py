@@ -0,0 +1,189 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+from model_registry import ModelKey, model_registry
+
+BATCH_MAX_SIZE = 1
+BATCH_MAX_WAIT_MS = 50
+# Upper bounds (ms) of the queue wait histogram buckets, the last one catches everything slower
+QUEUE_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+# Same rule Whisper's transcribe() uses to drop a window as silence
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+
+if TYPE_CHECKING:
+    from babylon_sts import AudioProcessor
+    from babylon_sts.processor import RecognizeResult
+
+
+class RecognitionRequest:
+    def __init__(self, audio_np: np.ndarray):
+        self.audio_np = audio_np
+        self.enqueued_at = time.monotonic()
+        self.future: Future = Future()
+
+
+class BatchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batch_sizes: Dict[int, int] = {}
+        self.queue_wait_ms = [0] * len(QUEUE_WAIT_BUCKETS_MS)
+
+    def record(self, batch: List[RecognitionRequest], started_at: float):
+        with self._lock:
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            for request in batch:
+                wait_ms = (started_at - request.enqueued_at) * 1000
+                bucket = next(i for i, bound in enumerate(QUEUE_WAIT_BUCKETS_MS) if wait_ms <= bound)
+                self.queue_wait_ms[bucket] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                'queue_wait_ms': {str(bound): count for bound, count in zip(QUEUE_WAIT_BUCKETS_MS, self.queue_wait_ms)},
+            }
+
+
+class RecognitionBatcher:
+    def __init__(self, key: ModelKey, processor: 'AudioProcessor', max_batch_size: int, max_wait_ms: float):
+        self.processor = processor
+        self.model_lock = model_registry.model_lock(key, 'recognition')
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchStats()
+        self._requests: 'queue.Queue[Optional[RecognitionRequest]]' = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='recognition-batcher', daemon=True)
+        self._thread.start()
+
+    def recognize(self, audio_np: np.ndarray) -> 'RecognizeResult':
+        import whisper
+        # Whisper works on 30 second windows, longer phrases keep the regular transcribe path
+        if len(audio_np) > whisper.audio.N_SAMPLES:
+            with self.model_lock:
+                return self.processor.recognize_speech(audio_np)
+
+        request = RecognitionRequest(audio_np)
+        self._requests.put(request)
+        return request.future.result()
+
+    def close(self):
+        self._requests.put(None)
+
+    def _collect_batch(self, first: RecognitionRequest) -> List[RecognitionRequest]:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = self._collect_batch(request)
+            self.stats.record(batch, time.monotonic())
+            try:
+                with self.model_lock:
+                    results = self._recognize_batch([item.audio_np for item in batch])
+            except Exception as e:
+                error = ValueError(f"Recognition error: {e}")
+                for item in batch:
+                    item.future.set_exception(error)
+                continue
+            for item, result in zip(batch, results):
+                item.future.set_result(result)
+
+    def _recognize_batch(self, audios: List[np.ndarray]) -> List['RecognizeResult']:
+        import torch
+        import whisper
+        from babylon_sts.processor import lang_settings
+
+        model = self.processor.audio_model
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio_np.astype(np.float32)), model.dims.n_mels)
+            for audio_np in audios
+        ]).to(model.device)
+        options = whisper.DecodingOptions(
+            language=lang_settings[self.processor.language_from]['translation_key'],
+            fp16=torch.cuda.is_available(),
+            without_timestamps=True
+        )
+        decoded = whisper.decode(model, mel, options)
+
+        results = []
+        for audio_np, result in zip(audios, decoded):
+            text = result.text.strip()
+            is_silence = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+            segments = [] if is_silence or not text else [{
+                'start': 0.0,
+                'end': len(audio_np) / self.processor.sample_rate,
+                'text': text,
+                'no_speech_prob': result.no_speech_prob,
+            }]
+            results.append({'text': '' if is_silence else text, 'segments': segments, 'language': result.language})
+        return results
+
+
+class RecognitionBatchers:
+    def __init__(self, max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batchers: Dict[ModelKey, RecognitionBatcher] = {}
+        self._lock = threading.Lock()
+        model_registry.add_evict_callback(self.remove)
+
+    def configure(self, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None,
+                  max_callers: Optional[int] = None):
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+        if max_wait_ms is not None:
+            self.max_wait_ms = max_wait_ms
+        # Every phrase waiting for its batch holds the inference thread that submitted it, so a batch never
+        # grows past the number of threads. Capped there, a full batch goes out without waiting max_wait_ms.
+        if max_callers is not None and self.max_batch_size > max_callers:
+            print(f"Recognition batches are capped at {max_callers} phrases, one per inference worker")
+            self.max_batch_size = max_callers
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    def get(self, key: ModelKey, processor: 'AudioProcessor') -> RecognitionBatcher:
+        with self._lock:
+            batcher = self._batchers.get(key)
+            if batcher is None or batcher.processor is not processor:
+                if batcher:
+                    batcher.close()
+                batcher = self._batchers[key] = RecognitionBatcher(key, processor, self.max_batch_size,
+                                                                         self.max_wait_ms)
+            return batcher
+
+    def remove(self, key: ModelKey, processor: 'AudioProcessor' = None):
+        with self._lock:
+            batcher = self._batchers.pop(key, None)
+        if batcher:
+            batcher.close()
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {':'.join(key): batcher.stats.snapshot() for key, batcher in self._batchers.items()}
+
+
+recognition_batchers = RecognitionBatchers()
@@ -0,0 +1,252 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_codecs import create_encoder, LockedEncoder
+from audio_processing import AudioProcessorManager, is_translated
+from metrics import metrics
+from utils import normalize_audio
+
+ROOM_MAX_MEMBERS = 16
+# Work a room does per phrase, each stage is counted once when done and once per listener that shared it
+ROOM_STAGES = ('recognition', 'translation', 'synthesis', 'encode')
+
+Delivery = Tuple[List['RoomMember'], str, bytes, Dict]
+
+
+class RoomMember:
+    __slots__ = ('user_id', 'connection', 'language', 'voice', 'codec', 'processor')
+
+    def __init__(self, user_id, connection, language: str, voice: Optional[str], codec: str):
+        self.user_id = user_id
+        self.connection = connection
+        # Members hear the room in the language they speak
+        self.language = language
+        self.voice = voice
+        self.codec = codec
+        # Buffers and endpoints this member's speech, recognition runs on the room's shared models
+        self.processor = AudioProcessorManager()
+
+
+class RoomStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phrases = 0
+        self.done = dict.fromkeys(ROOM_STAGES, 0)
+        # What one pipeline per listener, like a two-party session, would have run
+        self.needed = dict.fromkeys(ROOM_STAGES, 0)
+
+    def add_phrase(self):
+        with self._lock:
+            self.phrases += 1
+
+    def record(self, stage: str, done: int, needed: int):
+        with self._lock:
+            self.done[stage] += done
+            self.needed[stage] += needed
+        metrics.inc('room_work_total', done, stage=stage, outcome='done')
+        metrics.inc('room_work_total', needed - done, stage=stage, outcome='avoided')
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'phrases': self.phrases,
+                **{stage: {'done': self.done[stage], 'avoided': self.needed[stage] - self.done[stage]}
+                   for stage in ROOM_STAGES},
+            }
+
+
+class Room:
+    # Every phrase is recognized once, translated once per listener language, synthesized once per
+    # (language, voice) and encoded once per (language, voice, codec), then fanned out to the listeners
+    def __init__(self, room_id: str, model_name: str):
+        self.room_id = room_id
+        self.model_name = model_name
+        self.members: Dict = {}
+        self.stats = RoomStats()
+        self.last_active = time.monotonic()
+        self._translators: Dict[Tuple[str, str], AudioProcessorManager] = {}
+        self._encoders: Dict[str, LockedEncoder] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def languages(self) -> List[str]:
+        return sorted({member.language for member in list(self.members.values())})
+
+    def translator(self, language_from: str, language_to: str) -> Optional[AudioProcessorManager]:
+        with self._lock:
+            return self._translators.get((language_from, language_to))
+
+    def load_translators(self):
+        # Blocking, a pair is loaded the first time its two languages meet in the room
+        languages = self.languages
+        pairs = [(source, target) for source in languages for target in languages if source != target]
+        for pair in pairs:
+            if self.translator(*pair):
+                continue
+            manager = AudioProcessorManager()
+            manager.initialize_processor(pair[1], pair[0], self.model_name)
+            with self._lock:
+                self._translators[pair] = manager
+
+    def has_voice(self, member: RoomMember) -> bool:
+        # Checked against the loaded translators into the member's language that list their speakers
+        if member.voice is None:
+            return True
+        with self._lock:
+            translators = [translator for (_, target), translator in self._translators.items()
+                           if target == member.language]
+        return all(voices is None or member.voice in voices
+                   for voices in (translator.voices() for translator in translators))
+
+    def synthesize(self, translator: AudioProcessorManager, text: str, voice: Optional[str]) -> np.ndarray:
+        # A voice the model turns down costs only its own listeners their choice, not the whole phrase
+        try:
+            return translator.cached_synthesize(text, voice)
+        except ValueError as e:
+            if voice is None:
+                raise
+            print(f"Room {self.room_id} falls back to the default voice: {e}")
+            return translator.cached_synthesize(text)
+
+    def release_translators(self):
+        # Pairs whose languages are no longer both in the room, all of them once it is empty
+        languages = set(self.languages)
+        with self._lock:
+            unused = [pair for pair in self._translators if not set(pair) <= languages]
+            released = [self._translators.pop(pair) for pair in unused]
+        for manager in released:
+            manager.release()
+
+    def encode(self, codec: str, audio: np.ndarray) -> bytes:
+        # One encoder per codec for the whole room, kept like a connection keeps its own
+        with self._lock:
+            if codec not in self._encoders:
+                self._encoders[codec] = create_encoder(codec)
+            encoder = self._encoders[codec]
+        return encoder.encode(audio)
+
+    def listeners(self, speaker_id) -> List[RoomMember]:
+        return [member for member in list(self.members.values()) if member.user_id != speaker_id]
+
+    def recognize_phrase(self, speaker: RoomMember, phrase: np.ndarray, timings: Dict[str, float]):
+        self.last_active = time.monotonic()
+        # Any pair out of the speaker's language carries a Whisper model for it
+        translator = next((self.translator(speaker.language, listener.language)
+                           for listener in self.listeners(speaker.user_id)
+                           if listener.language != speaker.language), None)
+        if translator is None:
+            # Everyone speaks the same language, listeners get the original audio without a transcript
+            return datetime.utcnow(), normalize_audio(phrase), None
+        return translator.recognize_phrase(phrase, timings)
+
+    def translate_phrase(self, speaker: RoomMember, timestamp: datetime, audio_np: np.ndarray,
+                         recognized_result) -> List[Delivery]:
+        listeners = self.listeners(speaker.user_id)
+        groups: Dict[str, Dict[Optional[str], Dict[str, List[RoomMember]]]] = {}
+        for listener in listeners:
+            language = speaker.language if recognized_result is None else listener.language
+            voice = None if language == speaker.language else listener.voice
+            groups.setdefault(language, {}).setdefault(voice, {}).setdefault(listener.codec, []).append(listener)
+
+        original_text = recognized_result['text'] if recognized_result else ''
+        segments = [segment for segment in (recognized_result or {}).get('segments', []) if is_translated(segment)]
+        if recognized_result is not None and not segments:
+            return []
+
+        deliveries = []
+        translations = syntheses = encodes = 0
+        for language, voices in groups.items():
+            translator = self.translator(speaker.language, language)
+            same_language = (language == speaker.language or translator is None
+                             or recognized_result['language'] == translator.language_to)
+            if not same_language:
+                translations += 1
+                translated_text = ' '.join(filter(None, (translator.cached_translate(segment['text'])
+                                                         for segment in segments)))
+            for voice, codecs in voices.items():
+                if same_language:
+                    translated_text, audio = original_text, audio_np
+                else:
+                    syntheses += 1
+                    audio = self.synthesize(translator, translated_text, voice) if translated_text else None
+                for codec, members in codecs.items():
+                    encoded = None
+                    if audio is not None and len(audio):
+                        encodes += 1
+                        with metrics.stage('encode'):
+                            encoded = self.encode(codec, audio)
+                    deliveries.append((members, codec, encoded, {
+                        'timestamp': timestamp,
+                        'original_text': original_text,
+                        'translated_text': translated_text,
+                        'language': speaker.language if same_language else language,
+                        'synthesis_delay': (datetime.utcnow() - timestamp).total_seconds(),
+                    }))
+
+        translating = [listener for listener in listeners if listener.language != speaker.language]
+        self.stats.add_phrase()
+        if recognized_result is not None:
+            self.stats.record('recognition', 1, len(translating))
+        self.stats.record('translation', translations, len(translating))
+        self.stats.record('synthesis', syntheses, len(translating))
+        self.stats.record('encode', encodes, len(listeners))
+        return deliveries
+
+
+class RoomManager:
+    def __init__(self, max_members: int = ROOM_MAX_MEMBERS):
+        self.max_members = max_members
+        self.rooms: Dict[str, Room] = {}
+        self._member_rooms: Dict = {}
+
+    def configure(self, max_members: Optional[int] = None):
+        if max_members is not None:
+            self.max_members = max_members
+
+    def create(self, model_name: str) -> Room:
+        room = Room(uuid.uuid4().hex, model_name)
+        self.rooms[room.room_id] = room
+        return room
+
+    def get(self, room_id: str) -> Optional[Room]:
+        return self.rooms.get(room_id)
+
+    def find_member_room(self, user_id) -> Optional[Room]:
+        room_id = self._member_rooms.get(user_id)
+        return self.rooms.get(room_id) if room_id else None
+
+    def join(self, room: Room, member: RoomMember) -> bool:
+        if member.user_id not in room.members and len(room.members) >= self.max_members:
+            return False
+        room.members[member.user_id] = member
+        room.last_active = time.monotonic()
+        self._member_rooms[member.user_id] = room.room_id
+        return True
+
+    def leave(self, user_id) -> Optional[Tuple[Room, RoomMember]]:
+        # The room closes with its last member, release() gives back the models afterwards
+        room = self.find_member_room(user_id)
+        if room is None:
+            return None
+        del self._member_rooms[user_id]
+        member = room.members.pop(user_id)
+        if not room.members:
+            self.rooms.pop(room.room_id, None)
+        return room, member
+
+    def release(self, room: Room, member: RoomMember):
+        # Blocking, translators no other member needs are released with the member who left
+        member.processor.release()
+        room.release_translators()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {room_id: {'members': len(room.members), 'languages': room.languages, **room.stats.snapshot()}
+                for room_id, room in list(self.rooms.items())}
+
+
+rooms = RoomManager()
@@ -1,45 +1,128 @@
+import asyncio
+import time
 import uuid
-from typing import Dict
+from typing import Dict, List, Optional
 
 from audio_processing import AudioProcessorManager
 
+SESSION_IDLE_TIMEOUT = 1800
+SESSION_SWEEP_INTERVAL = 60
+
+
+class Participant:
+    __slots__ = ('user_id', 'processor', 'connection')
+
+    def __init__(self, user_id, processor: Optional[AudioProcessorManager], connection=None):
+        self.user_id = user_id
+        self.processor = processor
+        self.connection = connection
+
+
+class Session:
+    __slots__ = ('session_id', 'host', 'guest', 'language_from', 'language_to', 'model_name', 'last_active')
+
+    def __init__(self, session_id: str, host: Participant, language_from, language_to, model_name):
+        self.session_id = session_id
+        self.host = host
+        self.guest: Optional[Participant] = None
+        # The host's pair, kept on the session because a host on another worker has no local processor
+        self.language_from = language_from
+        self.language_to = language_to
+        self.model_name = model_name
+        self.last_active = time.monotonic()
+
+    @property
+    def participants(self) -> List[Participant]:
+        return [participant for participant in (self.host, self.guest) if participant]
+
+    def get(self, user_id) -> Optional[Participant]:
+        for participant in self.participants:
+            if participant.user_id == user_id:
+                return participant
+        return None
+
+    def opponent(self, user_id) -> Optional[Participant]:
+        if self.host.user_id == user_id:
+            return self.guest
+        if self.guest and self.guest.user_id == user_id:
+            return self.host
+        return None
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
 
 class SessionManager:
-    def __init__(self):
-        self.sessions: Dict[str, Dict] = {}
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = {}
+        self._user_sessions: Dict = {}
 
-    def create_session(self, user_id, processor: AudioProcessorManager):
+    def create_session(self, user_id, processor: AudioProcessorManager, connection=None):
         session_id = uuid.uuid4().hex
-        self.sessions[session_id] = {
-            'user1': user_id,
-            'processor1': processor,
-            'connection1': None,
-            'user2': None,
-            'processor2': None,
-            'connection2': None
-        }
+        self.add_session(Session(session_id, Participant(user_id, processor, connection),
+                                 processor.language_from, processor.language_to, processor.model_name))
         return session_id
 
-    def join_session(self, session_id, user_id, processor: AudioProcessorManager, connection):
+    def add_session(self, session: Session):
+        self.sessions[session.session_id] = session
+        self._user_sessions[session.host.user_id] = session.session_id
+
+    def join_session(self, session_id, user_id, processor: Optional[AudioProcessorManager], connection):
         session = self.sessions.get(session_id)
-        if session and not session['user2'] and session['user1'] is not user_id:
-            session['user2'] = user_id
-            session['processor2'] = processor
-            session['connection2'] = connection
+        if not session:
+            return False
+        if session.get(user_id):
             return True
-        if session and (session['user2'] is user_id or session['user1'] is user_id):
-            return True
-        return False
+        if session.guest:
+            return False
+        session.guest = Participant(user_id, processor, connection)
+        session.touch()
+        self._user_sessions[user_id] = session_id
+        return True
+
+    def get_session(self, session_id) -> Optional[Session]:
+        return self.sessions.get(session_id)
+
+    def find_user_session(self, user_id) -> Optional[Session]:
+        session_id = self._user_sessions.get(user_id)
+        return self.sessions.get(session_id) if session_id else None
 
     def get_opponent(self, session_id, user_id):
         session = self.sessions.get(session_id)
         if session:
-            if session['user1'] == user_id:
-                return session['connection2']
-            if session['user2'] == user_id:
-                return session['connection1']
+            session.touch()
+            opponent = session.opponent(user_id)
+            return opponent.connection if opponent else None
         return None
 
+    def leave(self, user_id) -> Optional[Session]:
+        # A conversation needs both sides, so whoever leaves ends the whole session
+        session = self.find_user_session(user_id)
+        if session:
+            self.remove_session(session.session_id)
+        return session
+
     def remove_session(self, session_id):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        for participant in session.participants:
+            if self._user_sessions.get(participant.user_id) == session_id:
+                del self._user_sessions[participant.user_id]
+            # Half-collected phrases have no listener anymore, the clear waits for a take_phrase on the pool
+            if participant.processor:
+                participant.processor.clear_phrase()
+
+    def expire_idle(self, now: Optional[float] = None) -> List[Session]:
+        now = time.monotonic() if now is None else now
+        expired = [session for session in self.sessions.values() if now - session.last_active > self.idle_timeout]
+        for session in expired:
+            self.remove_session(session.session_id)
+        return expired
+
+    async def run_sweeper(self, on_expire, interval: float = SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for session in self.expire_idle():
+                await on_expire(session)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
+
+from binary_protocol import ClientProtocol
+from utils import base64_to_bytes, bytes_to_base64
+
+SESSION_BACKENDS = ('local', 'redis')
+SESSION_KEY_TTL = 3600
+CHANNEL_PREFIX = 'babylon:worker:'
+KEY_PREFIX = 'babylon:session:'
+
+Event = Dict[str, Any]
+
+
+class LocalBackend:
+    # Single process: the registry and the event queues live in memory
+    def __init__(self):
+        self._sessions: Dict[str, Dict] = {}
+        self._guests: Dict[str, str] = {}
+        self._queues: Dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+    async def register(self, session_id: str, info: Dict):
+        self._sessions[session_id] = info
+
+    async def lookup(self, session_id: str) -> Optional[Dict]:
+        return self._sessions.get(session_id)
+
+    async def claim_guest(self, session_id: str, user_id: str) -> bool:
+        return self._guests.setdefault(session_id, user_id) == user_id
+
+    async def remove(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._guests.pop(session_id, None)
+
+    async def publish(self, worker_id: str, event: Event):
+        self._queues[worker_id].put_nowait(event)
+
+    async def listen(self, worker_id: str, handler: Callable):
+        queue = self._queues[worker_id]
+        while True:
+            await handler(await queue.get())
+
+
+class RedisBackend:
+    # Any Redis-compatible server, "unix:///path/to/socket" URLs work for a broker on the same host
+    def __init__(self, url: str, key_ttl: int = SESSION_KEY_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError("The redis session backend needs the 'redis' package")
+        self._client = redis.from_url(url or 'redis://localhost:6379')
+        self.key_ttl = key_ttl
+
+    async def register(self, session_id: str, info: Dict):
+        await self._client.set(KEY_PREFIX + session_id, json.dumps(info), ex=self.key_ttl)
+
+    async def lookup(self, session_id: str) -> Optional[Dict]:
+        value = await self._client.get(KEY_PREFIX + session_id)
+        return json.loads(value) if value else None
+
+    async def claim_guest(self, session_id: str, user_id: str) -> bool:
+        key = KEY_PREFIX + session_id + ':guest'
+        if await self._client.set(key, user_id, nx=True, ex=self.key_ttl):
+            return True
+        # The key is gone when the session was removed or expired between the two calls
+        guest = await self._client.get(key)
+        return guest is not None and guest.decode() == user_id
+
+    async def remove(self, session_id: str):
+        await self._client.delete(KEY_PREFIX + session_id, KEY_PREFIX + session_id + ':guest')
+
+    async def publish(self, worker_id: str, event: Event):
+        data = event.get('data')
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            event = {**event, 'data': bytes_to_base64(bytes(data)), 'binary': True}
+        await self._client.publish(CHANNEL_PREFIX + worker_id, json.dumps(event))
+
+    async def listen(self, worker_id: str, handler: Callable):
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(CHANNEL_PREFIX + worker_id)
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            event = json.loads(message['data'])
+            if event.pop('binary', False):
+                event['data'] = base64_to_bytes(event['data'])
+            await handler(event)
+
+
+class RemoteConnection:
+    # Stands in for a websocket that is connected to another worker, sends are relayed through the backend
+    def __init__(self, store: 'SessionStore', worker_id: str, user_id: str, protocol: ClientProtocol):
+        self.id = user_id
+        self.worker_id = worker_id
+        self.protocol = protocol
+        self._store = store
+
+    async def send(self, data):
+        await self._store.publish(self.worker_id, {'type': 'send', 'user_id': self.id, 'data': data})
+
+    async def close(self):
+        await self._store.publish(self.worker_id, {'type': 'close', 'user_id': self.id})
+
+
+class SessionStore:
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.backend = LocalBackend()
+
+    def configure(self, backend: str = 'local', url: str = ''):
+        if backend not in SESSION_BACKENDS:
+            raise ValueError(f"Unknown session backend '{backend}', expected one of {SESSION_BACKENDS}")
+        self.backend = RedisBackend(url) if backend == 'redis' else LocalBackend()
+
+    def new_worker(self):
+        # Forked workers inherit the parent's id, each of them needs its own channel
+        self.worker_id = uuid.uuid4().hex
+
+    def is_remote(self, worker_id: Optional[str]) -> bool:
+        return worker_id is not None and worker_id != self.worker_id
+
+    def remote_connection(self, worker_id: str, user_id: str, protocol: str, stream_audio: bool,
+                          codec: str, partials: bool = False) -> RemoteConnection:
+        client_protocol = ClientProtocol()
+        client_protocol.negotiate(protocol, stream_audio, codec, partials)
+        return RemoteConnection(self, worker_id, user_id, client_protocol)
+
+    async def register(self, session_id: str, info: Dict):
+        await self.backend.register(session_id, {**info, 'worker_id': self.worker_id})
+
+    async def lookup(self, session_id: str) -> Optional[Dict]:
+        return await self.backend.lookup(session_id)
+
+    async def claim_guest(self, session_id: str, user_id: str) -> bool:
+        return await self.backend.claim_guest(session_id, user_id)
+
+    async def remove(self, session_id: str):
+        await self.backend.remove(session_id)
+
+    async def publish(self, worker_id: str, event: Event):
+        await self.backend.publish(worker_id, event)
+
+    async def listen(self, handler: Callable):
+        async def safe_handler(event: Event):
+            try:
+                await handler(event)
+            except Exception as e:
+                print(f"Relay event '{event.get('type')}' failed: {e}")
+
+        await self.backend.listen(self.worker_id, safe_handler)
+
+
+session_store = SessionStore()
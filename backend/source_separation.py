@@ -0,0 +1,197 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from audio_convert import downmix, Resampler
+
+SEPARATION_WINDOW = 10.0
+SEPARATION_OVERLAP = 1.0
+SEPARATION_WORKERS = 2
+READ_BLOCK_DURATION = 1.0
+
+# Voice and background of the same stretch of audio
+Stems = Tuple[np.ndarray, np.ndarray]
+
+
+class DemucsSeparator:
+    # Hybrid Demucs from torchaudio. It separates waveforms held in memory, so windows go from the
+    # stream to the model without the WAV round trips of file based separators.
+    def __init__(self, device: Optional[str] = None):
+        try:
+            import torch
+            from torchaudio.pipelines import HDEMUCS_HIGH_MUSDB_PLUS
+        except ImportError:
+            raise ValueError("Source separation needs the 'torch' and 'torchaudio' packages")
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.sample_rate = HDEMUCS_HIGH_MUSDB_PLUS.sample_rate
+        self.model = HDEMUCS_HIGH_MUSDB_PLUS.get_model().to(self.device).eval()
+        self.voice_index = self.model.sources.index('vocals')
+
+    def separate_voice(self, window: np.ndarray) -> np.ndarray:
+        import torch
+        # Normalized like the training data, the model is stereo so mono goes to both channels
+        mean, std = float(window.mean()), float(window.std()) or 1.0
+        mix = torch.from_numpy((window - mean) / std).to(self.device).view(1, 1, -1).repeat(1, 2, 1)
+        try:
+            with torch.inference_mode():
+                sources = self.model(mix)
+        except Exception as e:
+            raise ValueError(f"Separation error: {e}")
+        return (sources[0, self.voice_index].mean(0) * std).cpu().numpy().astype(np.float32)
+
+
+class StreamingSeparator:
+    # Overlap-add over fixed windows: every window is separated on its own and consecutive windows share
+    # `overlap` samples that are crossfaded, so the seams do not click. Up to `workers` windows are
+    # separated at once, until that many are buffered nothing comes out unless the stream is final.
+    def __init__(self, separate_voice: Callable[[np.ndarray], np.ndarray], window: int, overlap: int,
+                 workers: int = 1, executor: Optional[ThreadPoolExecutor] = None):
+        if not 0 <= overlap < window:
+            raise ValueError(f"Overlap of {overlap} samples does not fit a window of {window}")
+        self.separate_voice = separate_voice
+        self.window = window
+        self.overlap = overlap
+        self.hop = window - overlap
+        self.workers = workers
+        self._executor = executor
+        self._fade_in = ((np.arange(overlap) + 0.5) / overlap).astype(np.float32)
+        self._pending = np.empty(0, dtype=np.float32)
+        self._tail: Optional[np.ndarray] = None
+
+    def process(self, audio: np.ndarray, final: bool = False) -> Stems:
+        self._pending = np.concatenate((self._pending, np.asarray(audio, dtype=np.float32)))
+        count = max(0, (len(self._pending) - self.overlap) // self.hop)
+        if not final and count < self.workers:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        windows = [self._pending[index * self.hop:index * self.hop + self.window] for index in range(count)]
+        rest = len(self._pending) - count * self.hop
+        if final and (rest > self.overlap or (self._tail is None and rest)):
+            # The last window is padded with silence, whatever the padding turns into is cut off below
+            windows.append(np.pad(self._pending[count * self.hop:], (0, self.window - rest)))
+        if self._executor is not None and len(windows) > 1:
+            voices = list(self._executor.map(self.separate_voice, windows))
+        else:
+            voices = [self.separate_voice(window) for window in windows]
+
+        pieces = []
+        for voice in voices:
+            voice = np.array(voice, dtype=np.float32)
+            if self._tail is not None and self.overlap:
+                voice[:self.overlap] = self._tail * (1 - self._fade_in) + voice[:self.overlap] * self._fade_in
+            # The end of a window waits for the next one to fade into
+            pieces.append(voice[:self.hop])
+            self._tail = voice[self.hop:]
+
+        if final:
+            if self._tail is not None:
+                pieces.append(self._tail)
+            voice = np.concatenate(pieces)[:len(self._pending)] if pieces else self._pending[:0]
+            mix, self._pending, self._tail = self._pending[:len(voice)], self._pending[:0], None
+        else:
+            voice = np.concatenate(pieces)
+            mix, self._pending = self._pending[:len(voice)], self._pending[len(voice):]
+        # What is not voice is background, so both stems always add up to the input
+        return voice, mix - voice
+
+
+class SourceSeparators:
+    def __init__(self, window: float = SEPARATION_WINDOW, overlap: float = SEPARATION_OVERLAP,
+                 workers: int = SEPARATION_WORKERS, device: Optional[str] = None):
+        self.window = window
+        self.overlap = overlap
+        self.workers = workers
+        self.device = device
+        self.loader: Callable[[Optional[str]], DemucsSeparator] = DemucsSeparator
+        self._model: Optional[DemucsSeparator] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def configure(self, window: Optional[float] = None, overlap: Optional[float] = None,
+                  workers: Optional[int] = None, device: Optional[str] = None,
+                  loader: Optional[Callable[[Optional[str]], DemucsSeparator]] = None):
+        if window is not None:
+            self.window = window
+        if overlap is not None:
+            self.overlap = overlap
+        if workers is not None:
+            self.workers = workers
+        if device is not None:
+            self.device = device
+        if loader is not None:
+            self.loader = loader
+
+    @property
+    def model(self) -> DemucsSeparator:
+        # Loaded on first use and shared, jobs that never separate do not pay for it
+        with self._lock:
+            if self._model is None:
+                self._model = self.loader(self.device)
+            return self._model
+
+    def create(self) -> StreamingSeparator:
+        model = self.model
+        with self._lock:
+            if self._executor is None and self.workers > 1:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='separation')
+        return StreamingSeparator(model.separate_voice, int(self.window * model.sample_rate),
+                                  int(self.overlap * model.sample_rate), self.workers, self._executor)
+
+    def separate_blocks(self, blocks: Iterable[np.ndarray], sample_rate: int) -> Iterator[Stems]:
+        # Mono float32 blocks at any rate in, stems at the same rate out. Only the voice makes the round
+        # trip through the model's rate, the background is the input minus the voice.
+        model = self.model
+        to_model = Resampler(sample_rate, model.sample_rate)
+        from_model = Resampler(model.sample_rate, sample_rate)
+        separator = self.create()
+        mix = np.empty(0, dtype=np.float32)
+        for block in blocks:
+            block = np.asarray(block, dtype=np.float32)
+            mix = np.concatenate((mix, block))
+            voice = from_model.process(separator.process(to_model.process(block))[0])
+            yield voice, mix[:len(voice)] - voice
+            mix = mix[len(voice):]
+        voice, _ = separator.process(to_model.process(np.empty(0, dtype=np.float32), final=True), final=True)
+        voice = from_model.process(voice, final=True)[:len(mix)]
+        yield voice, mix - voice
+
+    def separate_file(self, path: str, block_duration: float = READ_BLOCK_DURATION) -> Iterator[Stems]:
+        # Read block by block, so memory stays bounded by the windows in flight whatever the file length
+        sample_rate = sf.info(path).samplerate
+        blocks = (downmix(block) for block in sf.blocks(path, blocksize=int(block_duration * sample_rate),
+                                                         dtype='float32', always_2d=True))
+        return self.separate_blocks(blocks, sample_rate)
+
+
+source_separators = SourceSeparators()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split an audio file into voice and background stems.')
+    parser.add_argument('input', type=str, help='Audio file in any format libsndfile reads')
+    parser.add_argument('voice', type=str, help='File to write the voice to, the format follows the extension')
+    parser.add_argument('background', type=str, help='File to write everything but the voice to')
+    parser.add_argument('--window', type=float, default=SEPARATION_WINDOW, help='Seconds separated at once')
+    parser.add_argument('--overlap', type=float, default=SEPARATION_OVERLAP,
+                        help='Seconds consecutive windows share and crossfade')
+    parser.add_argument('--workers', type=int, default=SEPARATION_WORKERS, help='Windows separated concurrently')
+    parser.add_argument('--device', type=str, default=None, help='Torch device, cuda when available by default')
+    args = parser.parse_args()
+
+    source_separators.configure(window=args.window, overlap=args.overlap, workers=args.workers, device=args.device)
+    sample_rate = sf.info(args.input).samplerate
+    with sf.SoundFile(args.voice, 'w', samplerate=sample_rate, channels=1) as voice_file, \
+            sf.SoundFile(args.background, 'w', samplerate=sample_rate, channels=1) as background_file:
+        for voice, background in source_separators.separate_file(args.input):
+            voice_file.write(voice)
+            background_file.write(background)
+            print(f"\r{voice_file.frames / sample_rate:.1f} s separated", end='', flush=True)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from audio_codecs import Mp3Encoder
+from model_registry import ModelKey, model_registry
+from utils import SAMPLE_RATE
+
+WARMUP_DURATION = 1.0
+# Recognized when the dummy phrase comes out as silence, so translation and synthesis still run once
+WARMUP_TEXT = 'Hello'
+
+
+def warmup_audio(seconds: float = WARMUP_DURATION) -> np.ndarray:
+    # Harmonics of a 150 Hz pitch, voiced enough that Whisper runs the decoder instead of skipping silence
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    voice = sum(np.sin(2 * np.pi * 150 * harmonic * t) / harmonic for harmonic in range(1, 6))
+    return (0.2 * voice).astype(np.float32)
+
+
+class Readiness:
+    # Liveness is the process answering at all, readiness waits until the server listens and
+    # the startup work (preloading, cache prewarm, warm-up) is done
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.listening = False
+        self.warm = False
+        self.error: Optional[str] = None
+        self.warmup_errors: List[str] = []
+        self.phases: Dict[str, float] = {}
+        self.milestones: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.listening and self.warm
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.phases[name] = round(self.phases.get(name, 0) + elapsed, 3)
+            print(f"Startup phase {name} took {elapsed:.2f} s")
+
+    def milestone(self, name: str):
+        with self._lock:
+            self.milestones[name] = round(time.monotonic() - self.started_at, 3)
+
+    def mark_listening(self):
+        self.listening = True
+        self.milestone('listening')
+
+    def run(self, start_up: Callable[[], None]):
+        # Startup work runs next to the server, /readyz answers 503 until it finishes
+        def target():
+            try:
+                start_up()
+            except Exception as e:
+                self.error = str(e)
+                print(f"Startup failed, the server stays unready: {e}")
+                return
+            self.warm = True
+            self.milestone('ready')
+            print(f"Ready after {self.milestones['ready']:.2f} s")
+
+        threading.Thread(target=target, name='startup', daemon=True).start()
+
+    def status(self) -> Dict:
+        with self._lock:
+            status = {
+                'ready': self.ready,
+                'listening': self.listening,
+                'uptime_seconds': round(time.monotonic() - self.started_at, 3),
+                'phases': dict(self.phases),
+                'milestones': dict(self.milestones),
+            }
+        if self.error:
+            status['error'] = self.error
+        if self.warmup_errors:
+            status['warmup_errors'] = list(self.warmup_errors)
+        return status
+
+    def collect(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        yield 'ready', {}, int(self.ready)
+        with self._lock:
+            phases, milestones = list(self.phases.items()), list(self.milestones.items())
+        for name, seconds in phases:
+            yield 'startup_phase_seconds', {'phase': name}, seconds
+        # Seconds since the server modules were imported until it listened and until it was ready
+        for name, seconds in milestones:
+            yield 'startup_milestone_seconds', {'milestone': name}, seconds
+
+    def warm_up(self, key: ModelKey):
+        # One dummy phrase through recognition, translation and synthesis, so the first session does
+        # not pay for lazy initialization, kernel selection and first allocations. The translation
+        # cache is bypassed to keep the dummy phrase out of it.
+        processor = model_registry.acquire(*key)
+        try:
+            with self.phase('warmup_recognition'), model_registry.model_lock(key, 'recognition'):
+                text = processor.recognize_speech(warmup_audio())['text'].strip() or WARMUP_TEXT
+            with self.phase('warmup_translation'), model_registry.model_lock(key, 'translation'):
+                translated_text = processor.translate_text(text) or text
+            with self.phase('warmup_synthesis'), model_registry.model_lock(key, 'synthesis'):
+                audio_np = np.asarray(processor.synthesize_speech(translated_text), dtype=np.float32)
+            with self.phase('warmup_encode'):
+                Mp3Encoder().encode(audio_np)
+        except ValueError as e:
+            # A model that loaded but fails on the dummy phrase still serves, the first user pays for it
+            self.warmup_errors.append(f"{':'.join(key)}: {e}")
+            print(f"Warm-up of {key} failed: {e}")
+        finally:
+            model_registry.release(*key)
+
+
+readiness = Readiness()
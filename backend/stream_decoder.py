@@ -0,0 +1,174 @@
+from typing import List, Optional
+
+import numpy as np
+
+from audio_convert import float32_to_int16
+from utils import audio_file_to_array, SAMPLE_RATE, CHANNELS
+
+OPUS_CODEC_ID = 'A_OPUS'
+# Longest Opus packet is 120 ms
+OPUS_MAX_FRAME_SIZE = SAMPLE_RATE * 120 // 1000
+
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+CLUSTER_ID = 0x1F43B675
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+CODEC_ID = 0x86
+BLOCK_GROUP_ID = 0xA0
+BLOCK_ID = 0xA1
+SIMPLE_BLOCK_ID = 0xA3
+# Masters whose children we need, they are entered instead of skipped
+MASTER_IDS = {SEGMENT_ID, CLUSTER_ID, TRACKS_ID, TRACK_ENTRY_ID, BLOCK_GROUP_ID}
+LEAF_IDS = {TRACK_NUMBER_ID, CODEC_ID, BLOCK_ID, SIMPLE_BLOCK_ID}
+
+
+def read_vint(data, pos: int, keep_marker: bool = False):
+    if pos >= len(data):
+        return None, 0
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable size integer")
+    if pos + length > len(data):
+        return None, 0
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1  # unknown size
+    return value, length
+
+
+class WebmDemuxer:
+    def __init__(self):
+        self.codec_id: Optional[str] = None
+        self.audio_track: Optional[int] = None
+        self._track_number: Optional[int] = None
+        self._buffer = bytearray()
+        self._skip = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer += data
+        frames = []
+        pos = 0
+        while True:
+            if self._skip:
+                skipped = min(self._skip, len(self._buffer) - pos)
+                self._skip -= skipped
+                pos += skipped
+                if self._skip:
+                    break
+
+            element_id, id_length = read_vint(self._buffer, pos, keep_marker=True)
+            if element_id is None:
+                break
+            size, size_length = read_vint(self._buffer, pos + id_length)
+            if size is None:
+                break
+            header_end = pos + id_length + size_length
+
+            if element_id in MASTER_IDS:
+                pos = header_end
+                continue
+            if size < 0:
+                raise ValueError(f"Unknown size for EBML element {element_id:#x}")
+            if element_id not in LEAF_IDS:
+                self._skip = size
+                pos = header_end
+                continue
+            if header_end + size > len(self._buffer):
+                break
+
+            payload = bytes(self._buffer[header_end:header_end + size])
+            pos = header_end + size
+            if element_id == TRACK_NUMBER_ID:
+                self._track_number = int.from_bytes(payload, 'big')
+            elif element_id == CODEC_ID:
+                self.codec_id = payload.decode('ascii').rstrip('\x00')
+                if self.audio_track is None:
+                    self.audio_track = self._track_number
+            else:
+                frames.extend(self._parse_block(payload))
+
+        del self._buffer[:pos]
+        return frames
+
+    def _parse_block(self, block: bytes) -> List[bytes]:
+        track, track_length = read_vint(block, 0)
+        if self.audio_track is not None and track != self.audio_track:
+            return []
+        pos = track_length + 3  # 16-bit relative timecode and flags follow the track number
+        lacing = block[track_length + 2] & 0x06
+        if not lacing:
+            return [block[pos:]]
+
+        frame_count = block[pos] + 1
+        pos += 1
+        if lacing == 0x04:  # fixed-size lacing
+            frame_size = (len(block) - pos) // frame_count
+            sizes = [frame_size] * frame_count
+        elif lacing == 0x02:  # Xiph lacing
+            sizes = []
+            for _ in range(frame_count - 1):
+                size = 0
+                while block[pos] == 0xFF:
+                    size += 0xFF
+                    pos += 1
+                size += block[pos]
+                pos += 1
+                sizes.append(size)
+            sizes.append(len(block) - pos - sum(sizes))
+        else:  # EBML lacing, later sizes are signed differences
+            size, length = read_vint(block, pos)
+            pos += length
+            sizes = [size]
+            for _ in range(frame_count - 2):
+                delta, length = read_vint(block, pos)
+                pos += length
+                sizes.append(sizes[-1] + delta - ((1 << (7 * length - 1)) - 1))
+            sizes.append(len(block) - pos - sum(sizes))
+
+        frames = []
+        for size in sizes:
+            frames.append(block[pos:pos + size])
+            pos += size
+        return frames
+
+
+class StreamingDecoder:
+    def __init__(self):
+        self._demuxer = WebmDemuxer()
+        self._decoder = None
+        self._decode_error = None
+        self._fallback = False
+
+    def decode(self, data: bytes) -> np.ndarray:
+        if self._fallback:
+            return float32_to_int16(audio_file_to_array(data, audio_format="webm"))
+
+        try:
+            packets = self._demuxer.feed(data)
+            if self._demuxer.codec_id not in (None, OPUS_CODEC_ID):
+                raise ValueError(f"Unsupported codec {self._demuxer.codec_id}")
+            if self._decoder is None:
+                import opuslib
+                # libopus resamples and downmixes itself, so frames come out as 24 kHz mono
+                self._decoder = opuslib.Decoder(SAMPLE_RATE, CHANNELS)
+                self._decode_error = opuslib.OpusError
+        except Exception as e:
+            # Without the libopus shared library opuslib raises a bare Exception on import
+            print(f"Streaming decoder unavailable, falling back to ffmpeg per chunk: {e}")
+            self._fallback = True
+            return self.decode(data)
+
+        try:
+            pcm = b''.join(self._decoder.decode(packet, OPUS_MAX_FRAME_SIZE) for packet in packets)
+        except self._decode_error as e:
+            print(f"Opus decoding failed, falling back to ffmpeg per chunk: {e}")
+            self._fallback = True
+            return self.decode(data)
+        return np.frombuffer(pcm, dtype=np.int16)
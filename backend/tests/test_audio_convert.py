@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from audio_convert import Resampler, resample
+
+
+def sine(rate: int, duration: float = 1.0, frequency: float = 440.0) -> np.ndarray:
+    return np.sin(2 * np.pi * frequency * np.arange(int(rate * duration)) / rate).astype(np.float32)
+
+
+@pytest.mark.parametrize('rate_from, rate_to', [(48000, 24000), (16000, 24000), (44100, 24000)])
+def test_output_length(rate_from, rate_to):
+    audio = sine(rate_from)
+    out = resample(audio, rate_from, rate_to)
+    assert len(out) == Resampler(rate_from, rate_to).output_length(len(audio))
+    assert out.dtype == np.float32
+
+
+@pytest.mark.parametrize('rate_from, rate_to', [(48000, 24000), (16000, 24000), (44100, 24000)])
+def test_preserves_tone(rate_from, rate_to):
+    out = resample(sine(rate_from), rate_from, rate_to)
+    expected = sine(rate_to)
+    # The filter edges settle within a few ms, compare the steady part
+    middle = slice(rate_to // 10, -rate_to // 10)
+    assert np.max(np.abs(out[middle] - expected[middle])) < 0.01
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 480, 4096])
+def test_chunks_match_whole_stream(chunk_size):
+    audio = sine(44100, 0.5) + 0.1 * np.random.default_rng(0).standard_normal(22050).astype(np.float32)
+    whole = resample(audio, 44100, 24000)
+    resampler = Resampler(44100, 24000)
+    pieces = [resampler.process(audio[start:start + chunk_size]) for start in range(0, len(audio), chunk_size)]
+    pieces.append(resampler.process(np.empty(0, dtype=np.float32), final=True))
+    np.testing.assert_allclose(np.concatenate(pieces), whole, atol=1e-5)
+
+
+def test_same_rate_passes_through():
+    audio = sine(24000, 0.1)
+    assert Resampler(24000, 24000).process(audio) is audio
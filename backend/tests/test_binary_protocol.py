@@ -0,0 +1,56 @@
+import pickle
+import uuid
+
+import pytest
+
+from binary_protocol import HEADER, ClientProtocol, pack_frame, unpack_frame, PROTOCOL_BINARY, PROTOCOL_JSON
+
+
+def test_round_trip():
+    session_id = uuid.uuid4().hex
+    frame = pack_frame('conversation_audio', session_id, 42, 'pcm16', b'\x01\x02\x03')
+    assert unpack_frame(frame) == ('conversation_audio', session_id, 42, 'pcm16', b'\x01\x02\x03')
+
+
+def test_empty_session_id():
+    frame = pack_frame('audio_data', '', 0, 'webm_opus', b'')
+    assert len(frame) == HEADER.size
+    assert unpack_frame(frame) == ('audio_data', '', 0, 'webm_opus', b'')
+
+
+def test_audio_can_be_pickled():
+    # Decoding may run on a process pool, the audio of a memoryview frame must survive pickling
+    frame = memoryview(pack_frame('audio_data', '', 1, 'pcm16', b'audio'))
+    audio = unpack_frame(frame)[4]
+    assert isinstance(audio, bytes)
+    assert pickle.loads(pickle.dumps(audio)) == b'audio'
+
+
+@pytest.mark.parametrize('offset, value', [(0, b'X'), (2, b'\x09'), (3, b'\xff'), (4, b'\xff')])
+def test_invalid_header(offset, value):
+    # Magic, version, message type and codec
+    frame = bytearray(pack_frame('audio_data', '', 0, 'pcm16', b''))
+    frame[offset:offset + 1] = value
+    with pytest.raises(ValueError):
+        unpack_frame(bytes(frame))
+
+
+def test_short_frame():
+    with pytest.raises(ValueError):
+        unpack_frame(b'BT')
+
+
+def test_negotiate():
+    protocol = ClientProtocol()
+    assert protocol.negotiate(PROTOCOL_BINARY, stream_audio=True, codec='pcm16') == PROTOCOL_BINARY
+    assert protocol.is_binary and protocol.stream_audio and protocol.codec == 'pcm16'
+    assert protocol.negotiate('carrier pigeon') == PROTOCOL_JSON
+    # Omitting the codec keeps the one already negotiated
+    assert protocol.codec == 'pcm16'
+
+
+def test_sequence_wraps():
+    protocol = ClientProtocol()
+    protocol._sequence = 0xFFFFFFFF
+    assert protocol.next_sequence() == 0
+    assert protocol.next_sequence() == 1
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from endpointing import Endpointer, EndpointerFactory, EnergyVad, FRAME_DURATION
+from phrase_buffer import PhraseBuffer
+from utils import SAMPLE_RATE
+
+FRAME_SIZE = int(SAMPLE_RATE * FRAME_DURATION)
+
+
+def speech(duration: float) -> np.ndarray:
+    return (8000 * np.sin(2 * np.pi * 220 * np.arange(int(SAMPLE_RATE * duration)) / SAMPLE_RATE)).astype(np.int16)
+
+
+def silence(duration: float) -> np.ndarray:
+    return np.zeros(int(SAMPLE_RATE * duration), dtype=np.int16)
+
+
+def endpointer(**kwargs) -> Endpointer:
+    return Endpointer(EnergyVad(), hangover_duration=0.1, **kwargs)
+
+
+def test_endpoint_after_hangover():
+    detector = endpointer()
+    assert not detector.feed(speech(0.5))
+    assert detector.has_speech
+    assert not detector.feed(silence(0.06))
+    assert detector.feed(silence(0.06))
+
+
+def test_speech_restarts_hangover():
+    detector = endpointer()
+    detector.feed(speech(0.2))
+    assert not detector.feed(silence(0.08))
+    assert not detector.feed(speech(0.04))
+    assert not detector.feed(silence(0.08))
+
+
+def test_partial_frames_carry_over():
+    detector = endpointer()
+    chunk = silence(0.1)
+    # Chunks that do not split into whole frames still count every sample once
+    assert not detector.feed(chunk[:FRAME_SIZE // 2])
+    assert detector.feed(chunk[FRAME_SIZE // 2:])
+
+
+def test_silence_only_has_no_speech():
+    detector = endpointer()
+    assert detector.feed(silence(0.2))
+    assert not detector.has_speech
+
+
+def test_reset_drops_unfinished_frame():
+    detector = endpointer()
+    detector.feed(speech(FRAME_DURATION * 1.5))
+    detector.reset()
+    assert not detector.has_speech
+    # Were the half frame of speech kept, it would be the start of the next frame and count as speech
+    detector.feed(silence(FRAME_DURATION * 0.5))
+    assert not detector.has_speech
+
+
+def test_reset_keeps_speech_of_split_phrase():
+    detector = endpointer()
+    detector.feed(speech(0.2))
+    detector.reset(has_speech=True)
+    assert detector.has_speech
+
+
+def test_split_point_at_quietest_frame():
+    detector = endpointer(max_phrase_duration=1.0)
+    buffer = PhraseBuffer()
+    quiet_at = int(SAMPLE_RATE * 0.7) // FRAME_SIZE * FRAME_SIZE
+    audio = speech(1.0)
+    audio[quiet_at:quiet_at + FRAME_SIZE] = 0
+    buffer.append(audio.tobytes())
+    assert detector.is_too_long(buffer)
+    assert detector.find_split_point(buffer) == quiet_at
+
+
+def test_factory_rejects_unknown_vad():
+    with pytest.raises(ValueError):
+        EndpointerFactory().configure(vad_type='psychic')
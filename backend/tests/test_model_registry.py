@@ -0,0 +1,69 @@
+import pytest
+
+from model_registry import ModelRegistry, estimate_model_size, parse_model_keys, resolve_model_name
+
+
+class FakeProcessor:
+    def __init__(self, key):
+        self.key = key
+
+
+def registry(**kwargs) -> ModelRegistry:
+    model_registry = ModelRegistry(**kwargs)
+    model_registry.configure(loader=FakeProcessor)
+    return model_registry
+
+
+def test_parse_model_keys():
+    assert parse_model_keys(' en:ru:small, ru:en ,') == [('en', 'ru', 'small'), ('ru', 'en', 'small')]
+
+
+def test_english_uses_english_only_model():
+    assert resolve_model_name('en', 'small') == 'small.en'
+    assert resolve_model_name('en', 'large') == 'large'
+    assert resolve_model_name('ru', 'small') == 'small'
+    assert estimate_model_size('small.en') == estimate_model_size('small')
+
+
+def test_acquire_shares_loaded_models():
+    models = registry()
+    first = models.acquire('ru', 'en', 'small')
+    assert models.acquire('ru', 'en', 'small') is first
+    assert first.key == ('ru', 'en', 'small')
+    assert models.stats()['ru:en:small']['refcount'] == 2
+
+
+def test_idle_models_are_evicted():
+    models = registry(idle_ttl=0)
+    evicted = []
+    models.add_evict_callback(lambda key, processor: evicted.append(key))
+    models.acquire('ru', 'en', 'small')
+    assert models.evict_idle() == 0
+    models.release('ru', 'en', 'small')
+    assert evicted == [('ru', 'en', 'small')]
+    assert models.stats() == {}
+
+
+def test_preloaded_models_are_pinned():
+    models = registry(idle_ttl=0)
+    models.preload([('ru', 'en', 'small')])
+    assert models.evict_idle() == 0
+    assert models.stats()['ru:en:small'] == {'refcount': 0, 'size_mb': estimate_model_size('small'), 'pinned': True}
+
+
+def test_memory_budget_evicts_least_recently_used():
+    models = registry(memory_budget_mb=estimate_model_size('small') * 2)
+    for language in ('de', 'fr'):
+        models.acquire(language, 'en', 'small')
+        models.release(language, 'en', 'small')
+    models.acquire('es', 'en', 'small')
+    assert sorted(models.stats()) == ['es:en:small', 'fr:en:small']
+
+
+def test_model_locks_are_per_key_and_stage():
+    models = registry()
+    key = models.make_key('en', 'ru', 'small')
+    assert models.model_lock(key, 'recognition') is models.model_lock(key, 'recognition')
+    assert models.model_lock(key, 'recognition') is not models.model_lock(key, 'synthesis')
+    with pytest.raises(ValueError):
+        models.model_lock(key, 'encode')
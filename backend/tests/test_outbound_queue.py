@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from outbound_queue import OutboundQueue, OutboundQueues
+
+
+class FakeConnection:
+    def __init__(self, blocked: bool = False):
+        self.id = id(self)
+        self.sent = []
+        self.closed = False
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send(self, frame):
+        await self.unblocked.wait()
+        self.sent.append(frame)
+
+    async def close(self):
+        self.closed = True
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def test_sends_in_order_and_closes_after_sent():
+    async def scenario():
+        connection = FakeConnection()
+        queue = OutboundQueue(connection)
+        queue.put('a')
+        queue.put('b', b'audio')
+        queue.close_after_sent()
+        assert not queue.put('late')
+        await asyncio.wait_for(queue._writer, 1)
+        return connection
+
+    connection = run(scenario)
+    assert connection.sent == ['a', 'b', b'audio']
+    assert connection.closed
+
+
+def test_drop_oldest_removes_droppable_message():
+    async def scenario():
+        queue = OutboundQueue(FakeConnection(blocked=True), max_size=2)
+        queue.put('partial', droppable=True)
+        queue.put('result')
+        assert queue.put('next result')
+        messages = [message.frames for message in queue._messages]
+        queue.close()
+        return queue, messages
+
+    queue, messages = run(scenario)
+    assert queue.dropped == 1
+    assert messages == [('result',), ('next result',)]
+
+
+def test_droppable_message_is_dropped_when_nothing_else_may_be():
+    async def scenario():
+        queue = OutboundQueue(FakeConnection(blocked=True), max_size=1)
+        queue.put('result')
+        accepted = queue.put('partial', droppable=True)
+        queue.close()
+        return queue, accepted
+
+    queue, accepted = run(scenario)
+    assert not accepted
+    assert queue.dropped == 1
+
+
+def test_overflow_without_droppable_messages_disconnects():
+    async def scenario():
+        connection = FakeConnection(blocked=True)
+        queue = OutboundQueue(connection, max_size=1)
+        queue.put('result')
+        accepted = queue.put('next result')
+        await asyncio.sleep(0)
+        return connection, queue, accepted
+
+    connection, queue, accepted = run(scenario)
+    assert not accepted
+    assert queue.closed and connection.closed
+
+
+def test_coalesce_replaces_queued_message_with_same_key():
+    async def scenario():
+        queue = OutboundQueue(FakeConnection(blocked=True), policy='coalesce')
+        queue.put('first partial', coalesce_key='partial')
+        queue.put('result')
+        queue.put('second partial', coalesce_key='partial')
+        messages = [message.frames for message in queue._messages]
+        queue.close()
+        return queue, messages
+
+    queue, messages = run(scenario)
+    assert queue.coalesced == 1
+    assert messages == [('result',), ('second partial',)]
+
+
+def test_removed_connection_gets_closed_queue():
+    async def scenario():
+        queues = OutboundQueues()
+        connection = FakeConnection()
+        queue = queues.get(connection)
+        assert queues.get(connection) is queue
+        queues.remove(connection.id)
+        late = queues.get(connection)
+        return queue, late, queues.stats()
+
+    queue, late, stats = run(scenario)
+    assert late is not queue
+    assert late.closed and not late.put('late')
+    assert stats == {}
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        OutboundQueues().configure(policy='shrug')
@@ -0,0 +1,126 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+CACHE_MEMORY_BUDGET_MB = 64
+WHITESPACE = re.compile(r'\s+')
+
+CacheValue = Union[str, bytes]
+
+
+def normalize_text(text: str) -> str:
+    return WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip().casefold()
+
+
+def value_size(value: CacheValue) -> int:
+    return len(value.encode('utf-8')) if isinstance(value, str) else len(value)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class TranslationCache:
+    def __init__(self, memory_budget_mb: float = CACHE_MEMORY_BUDGET_MB, db_path: Optional[str] = None):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._entries: 'OrderedDict[str, CacheValue]' = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._stats = {'text': CacheStats(), 'audio': CacheStats()}
+        if db_path:
+            self.open_store(db_path)
+
+    def configure(self, memory_budget_mb: Optional[float] = None, db_path: Optional[str] = None):
+        if memory_budget_mb is not None:
+            self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        if db_path:
+            self.open_store(db_path)
+
+    def open_store(self, db_path: str):
+        with self._lock:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(kind: str, model_key: Tuple[str, str, str], text: str, variant: str = '') -> str:
+        return '\x1f'.join((kind, *model_key, variant, normalize_text(text)))
+
+    def get_text(self, model_key: Tuple[str, str, str], text: str) -> Optional[str]:
+        return self._get('text', self.make_key('text', model_key, text))
+
+    def put_text(self, model_key: Tuple[str, str, str], text: str, translated_text: str):
+        self._put(self.make_key('text', model_key, text), translated_text)
+
+    def get_audio(self, model_key: Tuple[str, str, str], text: str, variant: str) -> Optional[bytes]:
+        return self._get('audio', self.make_key('audio', model_key, text, variant))
+
+    def put_audio(self, model_key: Tuple[str, str, str], text: str, variant: str, audio: bytes):
+        self._put(self.make_key('audio', model_key, text, variant), audio)
+
+    def prewarm(self, manager, phrases: Iterable[str]):
+        # Runs every phrase through the manager once so both the text and the audio level are filled
+        count = 0
+        for phrase in filter(None, (phrase.strip() for phrase in phrases)):
+            manager.translate_text(phrase)
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            stats = {kind: kind_stats.as_dict() for kind, kind_stats in self._stats.items()}
+            stats['memory'] = {'entries': len(self._entries), 'bytes': self._size, 'budget': self.memory_budget}
+            return stats
+
+    def _get(self, kind: str, key: str) -> Optional[CacheValue]:
+        stats = self._stats[kind]
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                stats.hits += 1
+                return value
+            row = self._db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone() if self._db else None
+            if row is None:
+                stats.misses += 1
+                return None
+            stats.disk_hits += 1
+            value = row[0] if kind == 'audio' else row[0].decode('utf-8')
+            self._remember(key, value)
+            return value
+
+    def _put(self, key: str, value: CacheValue):
+        with self._lock:
+            self._remember(key, value)
+            if self._db:
+                blob = value.encode('utf-8') if isinstance(value, str) else value
+                self._db.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, blob))
+                self._db.commit()
+
+    def _remember(self, key: str, value: CacheValue):
+        size = value_size(value)
+        if size > self.memory_budget:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= value_size(previous)
+        self._entries[key] = value
+        self._size += size
+        while self._size > self.memory_budget:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._size -= value_size(evicted)
+            self._stats[evicted_key.split('\x1f', 1)[0]].evictions += 1
+
+
+translation_cache = TranslationCache()
@@ -2,14 +2,17 @@ from io import BytesIO
 import base64
 
 import numpy as np
-from pydub import AudioSegment
 import soundfile as sf
 
+from audio_convert import decode_audio_file, float32_to_int16, int16_to_float32
+
 SAMPLE_RATE = 24000
 SAMPLE_WIDTH = 2
 CHANNELS = 1
 EXPECTED_SILENCE_DURATION = 0.5
 SILENCE_THRESHOLD = 500
+# Peak level of -0.1 dBFS, the same headroom pydub's normalize() leaves
+NORMALIZE_PEAK = 10 ** (-0.1 / 20)
 
 
 def is_silent(data_chunk) -> bool:
@@ -17,15 +20,43 @@ def is_silent(data_chunk) -> bool:
     return np.mean(np.abs(audio_samples)) < SILENCE_THRESHOLD
 
 
+def normalize_audio(audio_data) -> np.ndarray:
+    # int16 PCM bytes or arrays, float32 arrays from the decoder are copied since they get scaled in place
+    if isinstance(audio_data, np.ndarray) and audio_data.dtype == np.float32:
+        audio_np = audio_data.copy()
+    else:
+        audio_np = int16_to_float32(audio_data)
+    peak = np.max(np.abs(audio_np)) if audio_np.size else 0
+    if peak > 0:
+        audio_np *= NORMALIZE_PEAK / peak
+    return audio_np
+
+
+def base64_to_bytes(file_base64: str) -> bytes:
+    return base64.b64decode(file_base64.split(';base64,')[-1])
+
+
+def bytes_to_base64(file_bytes: bytes) -> str:
+    return base64.b64encode(file_bytes).decode('utf-8')
+
+
+def audio_file_to_array(file_data: bytes, audio_format="mp3") -> np.ndarray:
+    return decode_audio_file(file_data, SAMPLE_RATE, audio_format)
+
+
+def audio_file_to_bytes(file_data: bytes, audio_format="mp3") -> bytes:
+    return float32_to_int16(audio_file_to_array(file_data, audio_format)).tobytes()
+
+
+def encode_audio(audio_np: np.ndarray, audio_format="mp3") -> bytes:
+    output_io = BytesIO()
+    sf.write(output_io, audio_np, SAMPLE_RATE, format=audio_format)
+    return output_io.getvalue()
+
+
 def audio_base64_to_bytes(file_base64: str, audio_format="mp3") -> bytes:
-    file_data = base64.b64decode(file_base64.split(';base64,')[-1])
-    audio_segment = AudioSegment.from_file(BytesIO(file_data),  format=audio_format)
-    audio_segment = audio_segment.set_frame_rate(SAMPLE_RATE).set_channels(CHANNELS).set_sample_width(SAMPLE_WIDTH)
-    audio_data = np.array(audio_segment.get_array_of_samples())
-    return audio_data.tobytes()
+    return audio_file_to_bytes(base64_to_bytes(file_base64), audio_format)
 
 
 def audio_bytes_to_base64(file_bytes: np.ndarray, audio_format="mp3") -> str:
-    output_io = BytesIO()
-    sf.write(output_io, file_bytes, SAMPLE_RATE, format=audio_format)
-    return base64.b64encode(output_io.getvalue()).decode('utf-8')
+    return bytes_to_base64(encode_audio(file_bytes, audio_format))
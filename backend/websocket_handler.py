@@ -1,120 +1,653 @@
+import asyncio
 import json
+import time
+from functools import partial
+from typing import Dict, Optional
+
+from admission_control import admission, AdmissionRejectedError, PhraseDroppedError
+from audio_codecs import LockedEncoder
 from audio_processing import AudioProcessorManager
+from batch_translation import batch_jobs, BatchJob
+from binary_protocol import ClientProtocol, pack_frame, unpack_frame
+from inference_scheduler import scheduler, SchedulerBusyError
+from metrics import metrics
+from outbound_queue import outbound_queues
+from partial_transcripts import partial_transcribers
+from phrase_pipeline import pipeline_factory, PhrasePipeline
+from rooms import rooms, Room, RoomMember
 import ws_messages
-from session_manager import SessionManager
-from utils import audio_base64_to_bytes
+from session_manager import SessionManager, Session, Participant
+from session_store import session_store, RemoteConnection
+from stream_decoder import StreamingDecoder
+from worker_pool import worker_affinity
+from utils import audio_file_to_array, base64_to_bytes, bytes_to_base64, SAMPLE_RATE
 
 session_manager = SessionManager()
+client_protocols: Dict = {}
+# Local websockets by str(user_id), the key other workers use when they relay to them
+connections: Dict = {}
+
+
+def send_json(connection, message: Dict, droppable: bool = False, coalesce_key=None) -> bool:
+    # Queued for the connection's writer task, so a slow peer never holds up the caller
+    return outbound_queues.get(connection).put(json.dumps(message), droppable=droppable, coalesce_key=coalesce_key)
+
+
+async def send_audio_message(connection, message_type: str, create_message, audio: bytes, *args,
+                             session_id: str = '', codec: str = 'mp3'):
+    protocol = client_protocols.get(connection.id)
+    queue = outbound_queues.get(connection)
+    if audio is None or protocol is None or not protocol.is_binary:
+        with metrics.stage('base64_encode'):
+            base64_audio = bytes_to_base64(audio) if audio is not None else None
+        message = create_message(base64_audio, *args)
+        message['payload']['audio_codec'] = codec
+        queue.put(json.dumps(message), droppable=bool(audio))
+        return
+
+    # Metadata stays in a JSON frame, the audio follows as a binary frame with the same sequence number
+    sequence = protocol.next_sequence()
+    message = create_message("", *args)
+    message['payload']['audio_sequence'] = sequence
+    message['payload']['audio_codec'] = codec
+    queue.put(json.dumps(message), pack_frame(message_type, session_id, sequence, codec, audio),
+              droppable=bool(audio))
+
+
+async def run_streaming(fn, *args, send_chunk):
+    # Chunks produced on the worker thread are sent from the event loop in the order they were made
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def on_segment(audio: bytes):
+        loop.call_soon_threadsafe(chunks.put_nowait, audio)
+
+    task = asyncio.ensure_future(scheduler.run_blocking(fn, *args, on_segment))
+    task.add_done_callback(lambda _: chunks.put_nowait(None))
+    sequence = 0
+    while (audio := await chunks.get()) is not None:
+        await send_chunk(audio, sequence)
+        sequence += 1
+    return await task, sequence
+
+
+async def submit_phrase(pipeline: PhrasePipeline, connection, chunk_type: str,
+                        audio_processor: AudioProcessorManager, phrase, send_result, session_id: str = '',
+                        user_id=None, encoder: Optional[LockedEncoder] = None):
+    # send_result(audio, log_data, chunks) runs only after every earlier phrase of the session went out.
+    # The phrase is encoded for whoever hears it, the user itself unless encoder says otherwise.
+    encoder = encoder or audio_processor.encoder
+    finish_phrase = partial(audio_processor.finish_phrase, encoder=encoder)
+    if not len(phrase):
+        await pipeline.deliver(partial(send_result, None, {"error": "Audio too silent"}, 0))
+        return
+    timings = audio_processor.phrase_timings()
+    flushed_at = time.monotonic()
+
+    async def recognize(audio, emit):
+        # The admission slot is held from recognition until the translated phrase is ready
+        ticket = await admission.acquire(user_id, len(audio) / SAMPLE_RATE, flushed_at)
+        try:
+            return ticket, await scheduler.run_blocking(audio_processor.recognize_phrase, audio, timings)
+        except BaseException:
+            admission.release(ticket)
+            raise
+
+    async def translate(admitted, emit):
+        ticket, recognized = admitted
+        try:
+            await translate_recognized(recognized, emit)
+        finally:
+            admission.release(ticket)
+
+    async def translate_recognized(recognized, emit):
+        protocol = client_protocols.get(connection.id) if connection else None
+        if not protocol or not protocol.stream_audio:
+            result = await scheduler.run_blocking(finish_phrase, timings, *recognized)
+            emit(partial(send_result, *result, 0))
+            return
+
+        async def send_chunk(audio: bytes, sequence: int):
+            emit(partial(send_audio_message, connection, chunk_type, ws_messages.create_audio_chunk_response,
+                         audio, chunk_type, sequence, session_id=session_id, codec=encoder.codec))
+
+        result, chunks = await run_streaming(finish_phrase, timings, *recognized,
+                                             send_chunk=send_chunk)
+        emit(partial(send_result, *result, chunks))
+
+    def on_error(error: Exception, emit):
+        if not isinstance(error, PhraseDroppedError):
+            print(f"Translation error: {error}")
+        emit(partial(send_result, None, {"error": str(error)}, 0))
+
+    await pipeline.submit(phrase, recognize, translate, on_error=on_error)
+
+
+def start_partial(connection, audio_processor: AudioProcessorManager, session_id: str = ''):
+    # Called between chunks of an unfinished phrase, the rerun happens in the background
+    protocol = client_protocols.get(connection.id) if connection else None
+    if not protocol or not protocol.partials or not partial_transcribers.enabled:
+        return
+    if not audio_processor.endpointer.has_speech:
+        return
+    if audio_processor.partials is None:
+        audio_processor.partials = partial_transcribers.create()
+    partials = audio_processor.partials
+    if not partials.due(len(audio_processor.buffered_audio)):
+        return
+    partials.last_run_at = time.monotonic()
+    partials.task = asyncio.create_task(send_partial(connection, audio_processor, audio_processor.phrase_id,
+                                                     audio_processor.buffered_audio.peek(), session_id))
+
+
+async def send_partial(connection, audio_processor: AudioProcessorManager, phrase_id: int, audio,
+                       session_id: str):
+    try:
+        original_text, translated_text = await scheduler.run_blocking(audio_processor.partial_transcript,
+                                                                      phrase_id, audio)
+        # Once the phrase is flushed its final result is on the way, a late partial would only confuse
+        if original_text and audio_processor.phrase_id == phrase_id:
+            # Only the latest tentative transcript matters, a newer one replaces it while it waits
+            send_json(connection, ws_messages.create_partial_transcript_response(
+                phrase_id, original_text, translated_text, session_id
+            ), droppable=True, coalesce_key='partial_transcript')
+    except Exception as e:
+        print(f"Partial transcript error: {e}")
+
+
+async def handle_conversation_audio(audio_processor: AudioProcessorManager, decoder: StreamingDecoder,
+                                    pipeline: PhrasePipeline, user_id, session_id, audio_data: bytes):
+    with metrics.stage('decode'):
+        audio_bytes = await scheduler.run_blocking(decoder.decode, audio_data)
+
+    opponent_connection = session_manager.get_opponent(session_id, user_id)
+    phrase_id = audio_processor.phrase_id
+    phrase = await scheduler.run_blocking(audio_processor.take_phrase, audio_bytes)
+    if phrase is None:
+        start_partial(opponent_connection, audio_processor, session_id)
+        return
+    encoder = audio_processor.peer_encoder or audio_processor.encoder
+
+    async def send_result(handled_audio, log_data, chunks):
+        if opponent_connection:
+            log_data['chunks'] = chunks
+            log_data['phrase_id'] = phrase_id
+            await send_audio_message(opponent_connection, 'conversation_audio',
+                                     ws_messages.create_opponent_audio_response,
+                                     b'' if chunks else handled_audio, log_data, session_id=session_id,
+                                     codec=encoder.codec)
+
+    await submit_phrase(pipeline, opponent_connection, 'conversation_audio_chunk', audio_processor, phrase,
+                        send_result, session_id, user_id, encoder)
+
+
+async def handle_room_audio(member: RoomMember, decoder: StreamingDecoder, pipeline: PhrasePipeline,
+                            audio_data: bytes):
+    with metrics.stage('decode'):
+        audio_bytes = await scheduler.run_blocking(decoder.decode, audio_data)
+
+    room = rooms.find_member_room(member.user_id)
+    if room is None:
+        return
+    phrase_id = member.processor.phrase_id
+    phrase = await scheduler.run_blocking(member.processor.take_phrase, audio_bytes)
+    if phrase is None or not len(phrase):
+        return
+    timings = member.processor.phrase_timings()
+    flushed_at = time.monotonic()
+
+    async def recognize(audio, emit):
+        # Recognized once for the whole room, the admission slot is held until every language is ready
+        ticket = await admission.acquire(member.user_id, len(audio) / SAMPLE_RATE, flushed_at)
+        try:
+            return ticket, await scheduler.run_blocking(room.recognize_phrase, member, audio, timings)
+        except BaseException:
+            admission.release(ticket)
+            raise
+
+    async def translate(admitted, emit):
+        ticket, recognized = admitted
+        try:
+            deliveries = await scheduler.run_blocking(room.translate_phrase, member, *recognized)
+        finally:
+            admission.release(ticket)
+        for delivery in deliveries:
+            emit(partial(send_room_audio, room, member, phrase_id, *delivery))
+
+    def on_error(error: Exception, emit):
+        if not isinstance(error, PhraseDroppedError):
+            print(f"Room translation error: {error}")
+        send_json(member.connection, ws_messages.create_error_response(f"Room translation error: {error}"))
+
+    await pipeline.submit(phrase, recognize, translate, on_error=on_error)
+
+
+async def send_room_audio(room: Room, speaker: RoomMember, phrase_id: int, listeners, codec: str, audio,
+                          log_data: Dict):
+    # One encoded copy goes to every listener who shares its language, voice and codec
+    log_data.update(room_id=room.room_id, speaker_id=str(speaker.user_id), phrase_id=phrase_id)
+    for listener in listeners:
+        await send_audio_message(listener.connection, 'room_audio', ws_messages.create_room_audio_response,
+                                 audio, log_data, session_id=room.room_id, codec=codec)
+
+
+async def handle_audio(websocket, audio_processor: AudioProcessorManager, decoder: StreamingDecoder,
+                       pipeline: PhrasePipeline, audio_data: bytes):
+    with metrics.stage('decode'):
+        audio_bytes = await scheduler.run_blocking(decoder.decode, audio_data)
+
+    phrase_id = audio_processor.phrase_id
+    phrase = await scheduler.run_blocking(audio_processor.take_phrase, audio_bytes)
+    if phrase is None:
+        start_partial(websocket, audio_processor)
+        return
+
+    async def send_result(translated_audio, log_data, chunks):
+        log_data['chunks'] = chunks
+        log_data['phrase_id'] = phrase_id
+        codec = audio_processor.encoder.codec
+        if chunks:
+            # Audio already went out in chunks, the closing message only carries the log data
+            translated_audio = b''
+        elif not translated_audio:
+            translated_audio, codec = audio_data, 'webm_opus'
+        await send_audio_message(websocket, 'audio_processed', ws_messages.create_audio_processed_response,
+                                 translated_audio, log_data, codec=codec)
+
+    await submit_phrase(pipeline, websocket, 'audio_processed_chunk', audio_processor, phrase, send_result,
+                        user_id=websocket.id)
+
+
+async def handle_translate_audio(websocket, audio_processor: AudioProcessorManager, file_data: bytes):
+    with metrics.stage('decode'):
+        audio_data = await scheduler.run_blocking(audio_file_to_array, file_data, picklable=True)
+
+    try:
+        processed_audio, log_data = await scheduler.run_blocking(audio_processor.translate_audio, audio_data)
+        log_data["timestamp"] = log_data["timestamp"].isoformat()
+    except ValueError as e:
+        print(f"Error during synthesis: {e}")
+        send_json(websocket, ws_messages.create_error_response(f"Error during synthesis: {e}"))
+        outbound_queues.get(websocket).close_after_sent()
+        return
+
+    encoder = audio_processor.encoder
+    await send_audio_message(websocket, 'translated_audio',
+                             partial(ws_messages.create_translated_audio_response, mime_type=encoder.mime_type),
+                             processed_audio, log_data, codec=encoder.codec)
+
+
+async def handle_translate_text(websocket, audio_processor: AudioProcessorManager, text):
+    try:
+        translated_audio, translated_text = await scheduler.run_blocking(audio_processor.translate_text, text)
+    except ValueError as e:
+        print(f"Error during synthesis: {e}")
+        send_json(websocket, ws_messages.create_error_response(f"Error during synthesis: {e}"))
+        outbound_queues.get(websocket).close_after_sent()
+        return
+
+    encoder = audio_processor.encoder
+    await send_audio_message(websocket, 'translated_text',
+                             partial(ws_messages.create_translated_text_response, mime_type=encoder.mime_type),
+                             translated_audio, translated_text, codec=encoder.codec)
+
+
+async def handle_translate_file(websocket, audio_processor: AudioProcessorManager, payload: Dict, file_data: bytes):
+    if not file_data:
+        send_json(websocket, ws_messages.create_error_response("No file to translate"))
+        return
+
+    loop = asyncio.get_running_loop()
+
+    def send_status(job: BatchJob):
+        # Called from the job thread after every stitched segment
+        message = ws_messages.create_job_status_response(job.as_dict())
+        loop.call_soon_threadsafe(partial(send_json, websocket, message, coalesce_key=('job_status', job.job_id)))
+
+    input_path = await scheduler.run_blocking(batch_jobs.save_upload, file_data, payload.get('format', 'mp3'))
+    job = batch_jobs.submit(input_path,
+                            payload.get('language_from', audio_processor.language_from or 'en'),
+                            payload.get('language_to', audio_processor.language_to or 'ru'),
+                            payload.get('model_name', audio_processor.model_name or 'small'),
+                            on_progress=send_status, keep_background=bool(payload.get('keep_background')))
+    send_json(websocket, ws_messages.create_job_status_response(job.as_dict()))
+
+
+def negotiate(websocket, protocol: ClientProtocol, requested: str, stream_audio: bool, codec: str,
+              partials: bool) -> bool:
+    try:
+        protocol.negotiate(requested, stream_audio, codec, partials)
+    except Exception as e:
+        print(f"Protocol negotiation error for {websocket.id}: {e}")
+        send_json(websocket, ws_messages.create_error_response(f"Protocol negotiation error: {e}"))
+        return False
+    return True
+
+
+async def enqueue(websocket, message_type: str, job, *args):
+    try:
+        scheduler.submit(websocket.id, job, *args)
+    except SchedulerBusyError as e:
+        print(f"Rejected '{message_type}' for {websocket.id}: {e}")
+        send_json(websocket, ws_messages.create_busy_response(message_type))
+
+
+async def release_opponent(opponent: Participant, session_id: str):
+    # The opponent's phrases were encoded for the one who left
+    if opponent.processor:
+        opponent.processor.peer_encoder = None
+    if opponent.connection:
+        send_json(opponent.connection, ws_messages.create_opponent_left(session_id))
+
+
+async def leave_session(user_id):
+    session = session_manager.leave(user_id)
+    if session is None:
+        return
+    await session_store.remove(session.session_id)
+    opponent = session.opponent(user_id)
+    if opponent is None:
+        return
+    if isinstance(opponent.connection, RemoteConnection):
+        client_protocols.pop(opponent.user_id, None)
+        outbound_queues.remove(opponent.user_id)
+        await session_store.publish(opponent.connection.worker_id, {
+            'type': 'opponent_left', 'session_id': session.session_id, 'user_id': str(user_id),
+        })
+    else:
+        await release_opponent(opponent, session.session_id)
+
+
+async def leave_room(user_id):
+    left = rooms.leave(user_id)
+    if left is None:
+        return
+    room, member = left
+    await scheduler.run_blocking(rooms.release, room, member)
+    for listener in room.listeners(user_id):
+        send_json(listener.connection, ws_messages.create_member_left(room.room_id, str(user_id)))
+
+
+async def join_room(websocket, room: Room, member: RoomMember, protocol: ClientProtocol):
+    if rooms.find_member_room(member.user_id) is not room:
+        await leave_room(member.user_id)
+    if not rooms.join(room, member):
+        send_json(websocket, ws_messages.create_error_response("Room is full"))
+        return
+    try:
+        # Translators for the pairs the new member's language adds to the room
+        await scheduler.run_blocking(room.load_translators)
+    except Exception as e:
+        print(f"Room join error: {e}")
+        send_json(websocket, ws_messages.create_error_response(f"Room join error: {e}"))
+        await leave_room(member.user_id)
+        return
+    if not room.has_voice(member):
+        send_json(websocket, ws_messages.create_error_response(
+            f"Voice '{member.voice}' is not available for language '{member.language}'"))
+        await leave_room(member.user_id)
+        return
+    members = [{'user_id': str(other.user_id), 'language': other.language} for other in room.members.values()]
+    send_json(websocket, ws_messages.create_room_joined_response(
+        room.room_id, members, protocol.protocol, protocol.codec
+    ))
+    for listener in room.listeners(member.user_id):
+        send_json(listener.connection, ws_messages.create_member_joined(
+            room.room_id, str(member.user_id), member.language
+        ))
+
+
+async def attach_remote_session(session_id: str):
+    # The session was created on another worker, mirror it here with a relayed host
+    info = await session_store.lookup(session_id)
+    if not info or not session_store.is_remote(info['worker_id']):
+        return None
+    connection = session_store.remote_connection(info['worker_id'], info['user_id'], info['protocol'],
+                                                 info['stream_audio'], info['codec'],
+                                                 info.get('partials', False))
+    session = Session(session_id, Participant(connection.id, None, connection),
+                      info['language_from'], info['language_to'], info['model_name'])
+    session_manager.add_session(session)
+    client_protocols[connection.id] = connection.protocol
+    return session
+
+
+async def notify_joined(session: Session, user_id, protocol: ClientProtocol):
+    opponent = session.opponent(user_id)
+    if opponent is None or opponent.connection is None:
+        return
+    if isinstance(opponent.connection, RemoteConnection):
+        await session_store.publish(opponent.connection.worker_id, {
+            'type': 'opponent_joined', 'session_id': session.session_id, 'user_id': str(user_id),
+            'worker_id': session_store.worker_id, 'protocol': protocol.protocol,
+            'stream_audio': protocol.stream_audio, 'codec': protocol.codec, 'partials': protocol.partials,
+        })
+    else:
+        send_json(opponent.connection, ws_messages.create_opponent_joined(session.session_id))
+
+
+async def handle_relay_event(event: Dict):
+    event_type = event['type']
+    if event_type in ('send', 'close'):
+        connection = connections.get(event['user_id'])
+        if connection is None:
+            return
+        # Traffic from the opponent keeps this worker's copy of the session alive as well
+        session = session_manager.find_user_session(connection.id)
+        if session:
+            session.touch()
+        if event_type == 'send':
+            # Whether relayed data may be dropped is not known here, a stalled peer still gets disconnected
+            outbound_queues.get(connection).put(event['data'])
+        else:
+            outbound_queues.get(connection).close_after_sent()
+
+    elif event_type == 'opponent_joined':
+        session = session_manager.get_session(event['session_id'])
+        if session is None or session.host.processor is None:
+            return
+        connection = session_store.remote_connection(event['worker_id'], event['user_id'], event['protocol'],
+                                                     event['stream_audio'], event['codec'],
+                                                     event.get('partials', False))
+        if session_manager.join_session(session.session_id, connection.id, None, connection):
+            client_protocols[connection.id] = connection.protocol
+            session.host.processor.peer_encoder = connection.protocol.encoder
+            send_json(session.host.connection, ws_messages.create_opponent_joined(session.session_id))
+
+    elif event_type == 'opponent_left':
+        session = session_manager.get_session(event['session_id'])
+        if session is None:
+            return
+        client_protocols.pop(event['user_id'], None)
+        outbound_queues.remove(event['user_id'])
+        opponent = session.opponent(event['user_id'])
+        session_manager.remove_session(session.session_id)
+        if opponent:
+            await release_opponent(opponent, session.session_id)
+
+
+async def expire_session(session: Session):
+    # Closing the connections runs the usual disconnect path, which releases processors and queued jobs
+    await session_store.remove(session.session_id)
+    for participant in session.participants:
+        if participant.connection:
+            send_json(participant.connection, ws_messages.create_session_expired(session.session_id))
+            outbound_queues.get(participant.connection).close_after_sent()
+
+
+def parse_message(message):
+    if isinstance(message, bytes):
+        message_type, session_id, _, _, audio = unpack_frame(message)
+        return message_type, {'session_id': session_id}, audio
+
+    data = json.loads(message)
+    payload = data.get('payload', {})
+    audio = payload.get('audio') or payload.get('file')
+    with metrics.stage('base64_decode'):
+        return data['type'], payload, base64_to_bytes(audio) if audio else None
 
 
 async def websocket_handler(websocket):
     audio_processor = AudioProcessorManager()
+    decoder = StreamingDecoder()
+    pipeline = pipeline_factory.create()
+    protocol = client_protocols[websocket.id] = ClientProtocol()
     user_id = websocket.id
+    connections[str(user_id)] = websocket
 
     async for message in websocket:
-        data = json.loads(message)
-        if data['type'] == 'initialize':
-            language_to = data['payload'].get('language_to', 'ru')
-            language_from = data['payload'].get('language_from', 'en')
-            model_name = data['payload'].get('model_name', 'small')
+        metrics.inc('bytes_in_total', len(message))
+        try:
+            message_type, payload, audio_data = parse_message(message)
+        except ValueError as e:
+            send_json(websocket, ws_messages.create_error_response(f"Invalid message: {e}"))
+            continue
+        metrics.inc('messages_total', type=message_type)
+        # Any message keeps the sender's session alive, a solo user never reaches get_opponent
+        session = session_manager.find_user_session(user_id)
+        if session:
+            session.touch()
+
+        if message_type == 'initialize':
+            language_to = payload.get('language_to', 'ru')
+            language_from = payload.get('language_from', 'en')
+            model_name = payload.get('model_name', 'small')
+            if not negotiate(websocket, protocol, payload.get('protocol'), payload.get('stream_audio'),
+                             payload.get('codec'), payload.get('partials')):
+                continue
+
+            redirect_port = worker_affinity.redirect_port(language_from, language_to, model_name)
+            if redirect_port:
+                send_json(websocket, ws_messages.create_redirect_response(
+                    redirect_port, language_from, language_to
+                ))
+                continue
 
             try:
-                audio_processor.initialize_processor(language_to, language_from, model_name)
-                session_id = session_manager.create_session(user_id, audio_processor)
-                session_manager.sessions[session_id]['connection1'] = websocket
-                await websocket.send(json.dumps(ws_messages.create_initialize_response(
-                    "Audio processor initialized",  session_id
-                )))
+                # A saturated server hands out a smaller model or turns the session away
+                model_name = admission.admit_session(model_name)
+            except AdmissionRejectedError as e:
+                send_json(websocket, ws_messages.create_overloaded_response(e.retry_after))
+                continue
+
+            try:
+                await scheduler.run_blocking(audio_processor.initialize_processor, language_to, language_from, model_name)
+                audio_processor.encoder = protocol.encoder
+                await leave_session(user_id)
+                session_id = session_manager.create_session(user_id, audio_processor, websocket)
+                await session_store.register(session_id, {
+                    'user_id': str(user_id), 'language_from': language_from, 'language_to': language_to,
+                    'model_name': model_name, 'protocol': protocol.protocol,
+                    'stream_audio': protocol.stream_audio, 'codec': protocol.codec,
+                    'partials': protocol.partials,
+                })
+                send_json(websocket, ws_messages.create_initialize_response(
+                    "Audio processor initialized",  session_id, protocol.protocol, protocol.codec, model_name
+                ))
             except Exception as e:
                 print(f"Initialization error: {e}")
-                await websocket.send(json.dumps(ws_messages.create_error_response(f"Initialization error: {e}")))
-                return
+                send_json(websocket, ws_messages.create_error_response(f"Initialization error: {e}"))
+                break
 
-        elif data['type'] == 'join_session':
-            session_id = data['payload']['session_id']
-            session = session_manager.sessions.get(session_id)
+        elif message_type == 'join_session':
+            session_id = payload['session_id']
+            session = session_manager.get_session(session_id) or await attach_remote_session(session_id)
             if session:
-                language_to = session['processor1'].language_from
-                language_from = session['processor1'].language_to
-                model_name = session['processor1'].model_name
+                if not negotiate(websocket, protocol, payload.get('protocol'), payload.get('stream_audio'),
+                                 payload.get('codec'), payload.get('partials')):
+                    continue
+                host = session.host
+                rejoin = session.get(user_id) is not None
+                if not rejoin:
+                    await leave_session(user_id)
+                audio_processor.release()
                 audio_processor = AudioProcessorManager()
-                audio_processor.initialize_processor(language_to, language_from, model_name)
-                success = session_manager.join_session(session_id, user_id, audio_processor, websocket)
-                await websocket.send(json.dumps(ws_messages.create_join_response(success, session_id)))
+                await scheduler.run_blocking(audio_processor.initialize_processor,
+                                             session.language_from, session.language_to, session.model_name)
+                # The shared store decides between guests racing for the same session on different workers
+                success = rejoin or await session_store.claim_guest(session_id, str(user_id))
+                success = success and session_manager.join_session(session_id, user_id, audio_processor, websocket)
+                audio_processor.encoder = protocol.encoder
+                if success and host.connection:
+                    # Each side's phrases are played by the other side, so encode them in the listener's codec
+                    audio_processor.peer_encoder = client_protocols[host.user_id].encoder
+                    if host.processor:
+                        host.processor.peer_encoder = protocol.encoder
+                elif not success and host.processor is None and session.guest is None:
+                    client_protocols.pop(host.user_id, None)
+                    outbound_queues.remove(host.user_id)
+                    session_manager.remove_session(session_id)
+                send_json(websocket, ws_messages.create_join_response(
+                    success, session_id, protocol.protocol, protocol.codec
+                ))
 
-                opponent_connection = session_manager.get_opponent(session_id, user_id)
-                if opponent_connection:
-                    opponent_message = ws_messages.create_opponent_joined(session_id)
-                    await opponent_connection.send(json.dumps(opponent_message))
+                if success:
+                    await notify_joined(session, user_id, protocol)
 
             else:
-                await websocket.send(json.dumps(ws_messages.create_error_response("Invalid session ID")))
-
-        elif data['type'] == 'conversation_audio_data':
-            session_id = data['payload'].get('session_id')
-            audio_data_base64 = data['payload']['audio']
-            base64_audio = audio_data_base64.split(",")[1]
-
-            audio_bytes = audio_base64_to_bytes(audio_data_base64, audio_format="webm")
-
-            result = audio_processor.collect_complete_phrase(audio_bytes)
-
-            handled_audio = base64_audio
-            log_data = None
-            if result:
-                handled_audio, log_data = result
-
-            opponent_connection = session_manager.get_opponent(session_id, user_id)
-            if opponent_connection and result:
-                opponent_message = ws_messages.create_opponent_audio_response(handled_audio, log_data)
-                await opponent_connection.send(json.dumps(opponent_message))
+                send_json(websocket, ws_messages.create_error_response("Invalid session ID"))
 
-        elif data['type'] == 'audio_data':
-            audio_data_base64 = data['payload']['audio']
-            base64_audio = audio_data_base64.split(",")[1]
-
-            audio_bytes = audio_base64_to_bytes(audio_data_base64, audio_format="webm")
+        elif message_type in ('create_room', 'join_room'):
+            if not negotiate(websocket, protocol, payload.get('protocol'), False, payload.get('codec'), False):
+                continue
+            if message_type == 'create_room':
+                try:
+                    room = rooms.create(admission.admit_session(payload.get('model_name', 'small')))
+                except AdmissionRejectedError as e:
+                    send_json(websocket, ws_messages.create_overloaded_response(e.retry_after))
+                    continue
+            else:
+                room = rooms.get(payload.get('room_id'))
+                if room is None:
+                    send_json(websocket, ws_messages.create_error_response("Invalid room ID"))
+                    continue
+            member = RoomMember(user_id, websocket, payload.get('language', 'en'), payload.get('voice'),
+                                protocol.codec)
+            await join_room(websocket, room, member, protocol)
 
-            result = audio_processor.collect_complete_phrase(audio_bytes)
+        elif message_type == 'leave_room':
+            await leave_room(user_id)
 
-            if result:
-                translated_audio, log_data = result
-                result_message = ws_messages.create_audio_processed_response(translated_audio or base64_audio, log_data)
-                await websocket.send(json.dumps(result_message))
+        elif message_type == 'room_audio_data':
+            room = rooms.find_member_room(user_id)
+            if room is None:
+                send_json(websocket, ws_messages.create_error_response("Join a room before sending audio"))
+                continue
+            await enqueue(websocket, message_type, handle_room_audio,
+                          room.members[user_id], decoder, pipeline, audio_data)
 
-        elif data['type'] == 'translate_audio':
-            file_base64 = data['payload'].get('file')
+        elif message_type == 'conversation_audio_data':
+            await enqueue(websocket, message_type, handle_conversation_audio,
+                          audio_processor, decoder, pipeline, user_id, payload.get('session_id'), audio_data)
 
-            audio_data = audio_base64_to_bytes(file_base64)
+        elif message_type == 'audio_data':
+            await enqueue(websocket, message_type, handle_audio,
+                          websocket, audio_processor, decoder, pipeline, audio_data)
 
-            try:
-                processed_file_base64, log_data = audio_processor.translate_audio(audio_data)
-                log_data["timestamp"] = log_data["timestamp"].isoformat()
-            except ValueError as e:
-                print(f"Error during synthesis: {e}")
-                await websocket.send(json.dumps(ws_messages.create_error_response(f"Error during synthesis: {e}")))
-                return
+        elif message_type == 'translate_audio':
+            await enqueue(websocket, message_type, handle_translate_audio,
+                          websocket, audio_processor, audio_data)
 
-            translated_audio_message = ws_messages.create_translated_audio_response(processed_file_base64, log_data)
-            await websocket.send(json.dumps(translated_audio_message))
-
-        elif data['type'] == 'translate_text':
-            try:
-                translated_audio, translated_text = audio_processor.translate_text(data['payload'].get('text'))
-            except ValueError as e:
-                print(f"Error during synthesis: {e}")
-                await websocket.send(json.dumps(ws_messages.create_error_response(f"Error during synthesis: {e}")))
-                return
+        elif message_type == 'translate_text':
+            await enqueue(websocket, message_type, handle_translate_text,
+                          websocket, audio_processor, payload.get('text'))
 
-            translated_text_message = ws_messages.create_translated_text_response(translated_audio, translated_text)
-            await websocket.send(json.dumps(translated_text_message))
+        elif message_type == 'translate_file':
+            await handle_translate_file(websocket, audio_processor, payload, audio_data)
 
     # Handle disconnection
-    for session_id, session in session_manager.sessions.items():
-        if session['user1'] == user_id or session['user2'] == user_id:
-            opponent_connection = session_manager.get_opponent(session_id, user_id)
-            session_manager.remove_session(session_id)
-            if opponent_connection:
-                opponent_message = ws_messages.create_opponent_left(session_id)
-                await opponent_connection.send(json.dumps(opponent_message))
-            break
+    scheduler.cancel_session(user_id)
+    pipeline.close()
+    if audio_processor.partials and audio_processor.partials.task:
+        audio_processor.partials.task.cancel()
+    # Models are released only after the phrases already running on the pool are done with them.
+    # Batch jobs hold models of their own and keep running.
+    await scheduler.wait_session(user_id)
+    admission.forget(user_id)
+    client_protocols.pop(user_id, None)
+    connections.pop(str(user_id), None)
+    audio_processor.release()
+    await leave_session(user_id)
+    await leave_room(user_id)
+    # Whatever is still queued, e.g. an error that ended the session, goes out before the socket closes
+    await outbound_queues.drain(user_id)
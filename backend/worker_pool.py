@@ -0,0 +1,91 @@
+import os
+import signal
+import socket
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from model_registry import ModelKey, model_registry
+
+WORKER_BACKLOG = 128
+
+
+def parse_affinity(value: str) -> Dict[ModelKey, int]:
+    # "en:ru:small=0,ru:en:small=1" -> {('en', 'ru', 'small'): 0, ('ru', 'en', 'small'): 1}
+    routes = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        pair, worker = item.rsplit('=', 1)
+        language_from, language_to, *rest = pair.split(':')
+        routes[model_registry.make_key(language_from, language_to, rest[0] if rest else 'small')] = int(worker)
+    return routes
+
+
+def reuseport_socket(host: str, port: int) -> socket.socket:
+    # Each worker binds its own socket on the shared port and the kernel balances connections between them
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(WORKER_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerAffinity:
+    def __init__(self):
+        self.worker_index: Optional[int] = None
+        self.base_port = 0
+        self.routes: Dict[ModelKey, int] = {}
+
+    def configure(self, base_port: int, routes: Dict[ModelKey, int]):
+        self.base_port = base_port
+        self.routes = routes
+
+    def worker_port(self, index: int) -> int:
+        # Besides the shared port, every worker listens on its own port so clients can be sent to it
+        return self.base_port + 1 + index
+
+    def keys_for(self, index: int) -> List[ModelKey]:
+        return [key for key, worker in self.routes.items() if worker == index]
+
+    def redirect_port(self, language_from: str, language_to: str, model_name: str) -> Optional[int]:
+        if self.worker_index is None:
+            return None
+        owner = self.routes.get(model_registry.make_key(language_from, language_to, model_name))
+        if owner is None or owner == self.worker_index:
+            return None
+        return self.worker_port(owner)
+
+
+def run_workers(count: int, run_worker: Callable[[int], None]):
+    # Nothing that holds threads, sockets or file handles may be opened before this point, each worker
+    # opens its own after the fork
+    pids = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 0
+            try:
+                run_worker(index)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        pids.append(pid)
+        print(f"Started worker {index} (pid {pid})")
+
+    def stop(signum, _):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+worker_affinity = WorkerAffinity()
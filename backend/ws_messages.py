@@ -2,10 +2,12 @@ from typing import Dict, Any
 from datetime import datetime
 
 
-def create_initialize_response(message: str, session_id: str) -> Dict[str, Any]:
+def create_initialize_response(message: str, session_id: str, protocol: str = 'json',
+                               codec: str = 'mp3', model_name: str = '') -> Dict[str, Any]:
     return {
         'type': 'initialized',
-        'payload': {"message": message, "session_id": session_id }
+        'payload': {"message": message, "session_id": session_id, "protocol": protocol, "codec": codec,
+                    "model_name": model_name}
     }
 
 
@@ -28,33 +30,49 @@ def create_audio_processed_response(base64_audio: str, log_data: Dict[str, Any])
             "synthesis_delay": log_data.get('synthesis_delay', 0),
             "recognize_result": log_data.get('recognize_result', {}),
             "audio": base64_audio,
-            "error": log_data.get('error', "")
+            "error": log_data.get('error', ""),
+            "phrase_id": log_data.get('phrase_id')
         }
     }
 
 
-def create_translated_audio_response(base64_audio: str, log_data: Dict[str, Any]) -> Dict[str, Any]:
+def create_audio_chunk_response(base64_audio: str, message_type: str, sequence: int) -> Dict[str, Any]:
+    return {
+        'type': message_type,
+        'payload': {
+            "audio": base64_audio,
+            "sequence": sequence,
+        }
+    }
+
+
+def create_translated_audio_response(base64_audio: str, log_data: Dict[str, Any],
+                                     mime_type: str = 'audio/mpeg') -> Dict[str, Any]:
     return {
         'type': 'translated_audio',
         'payload': {
-            "translatedAudio": f"data:audio/mpeg;base64,{base64_audio}",
+            "translatedAudio": f"data:{mime_type};base64,{base64_audio}",
             "logData": log_data,
         }
     }
 
 
-def create_translated_text_response(translated_audio: str, translated_text: str) -> Dict[str, Any]:
+def create_translated_text_response(translated_audio: str, translated_text: str,
+                                    mime_type: str = 'audio/mpeg') -> Dict[str, Any]:
     return {
         'type': 'translated_text',
         'payload': {
-            "translatedAudio": f"data:audio/mpeg;base64,{translated_audio}",
+            "translatedAudio": f"data:{mime_type};base64,{translated_audio}",
             "translatedText": translated_text,
         }
     }
 
 
-def create_join_response(success: bool, session_id: str) -> Dict[str, Any]:
-    return {'type': 'joined_session', 'payload': {'success': success, 'session_id': session_id}}
+def create_join_response(success: bool, session_id: str, protocol: str = 'json', codec: str = 'mp3') -> Dict[str, Any]:
+    return {
+        'type': 'joined_session',
+        'payload': {'success': success, 'session_id': session_id, 'protocol': protocol, 'codec': codec}
+    }
 
 
 def create_opponent_audio_response(base64_audio: str, log_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -69,7 +87,21 @@ def create_opponent_audio_response(base64_audio: str, log_data: Dict[str, Any])
             "translated_text": log_data.get('translated_text', ""),
             "synthesis_delay": log_data.get('synthesis_delay', 0),
             "recognize_result": log_data.get('recognize_result', {}),
-            "error": log_data.get('error', "")
+            "error": log_data.get('error', ""),
+            "phrase_id": log_data.get('phrase_id')
+        }
+    }
+
+
+def create_partial_transcript_response(phrase_id: int, original_text: str, translated_text: str,
+                                       session_id: str = '') -> Dict[str, Any]:
+    return {
+        'type': 'partial_transcript',
+        'payload': {
+            'phrase_id': phrase_id,
+            'original_text': original_text,
+            'translated_text': translated_text,
+            'session_id': session_id,
         }
     }
 
@@ -90,3 +122,98 @@ def create_opponent_left(session_id: str) -> Dict[str, Any]:
             'session_id': session_id,
         }
     }
+
+
+def create_session_expired(session_id: str) -> Dict[str, Any]:
+    return {
+        'type': 'session_expired',
+        'payload': {
+            'session_id': session_id,
+        }
+    }
+
+
+def create_room_joined_response(room_id: str, members: list, protocol: str = 'json',
+                                codec: str = 'mp3') -> Dict[str, Any]:
+    return {
+        'type': 'room_joined',
+        'payload': {'room_id': room_id, 'members': members, 'protocol': protocol, 'codec': codec}
+    }
+
+
+def create_member_joined(room_id: str, user_id: str, language: str) -> Dict[str, Any]:
+    return {
+        'type': 'member_joined',
+        'payload': {
+            'room_id': room_id,
+            'user_id': user_id,
+            'language': language,
+        }
+    }
+
+
+def create_member_left(room_id: str, user_id: str) -> Dict[str, Any]:
+    return {
+        'type': 'member_left',
+        'payload': {
+            'room_id': room_id,
+            'user_id': user_id,
+        }
+    }
+
+
+def create_room_audio_response(base64_audio: str, log_data: Dict[str, Any]) -> Dict[str, Any]:
+    timestamp = log_data.get('timestamp', datetime.utcnow())
+
+    return {
+        'type': 'room_audio',
+        'payload': {
+            'audio': base64_audio,
+            "room_id": log_data.get('room_id', ""),
+            "speaker_id": log_data.get('speaker_id', ""),
+            "language": log_data.get('language', ""),
+            "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            "original_text": log_data.get('original_text', ""),
+            "translated_text": log_data.get('translated_text', ""),
+            "synthesis_delay": log_data.get('synthesis_delay', 0),
+            "phrase_id": log_data.get('phrase_id')
+        }
+    }
+
+
+def create_redirect_response(port: int, language_from: str, language_to: str) -> Dict[str, Any]:
+    return {
+        'type': 'redirect',
+        'payload': {
+            'port': port,
+            'message': f"Models for {language_from}->{language_to} are served by another worker",
+        }
+    }
+
+
+def create_busy_response(rejected_type: str) -> Dict[str, Any]:
+    return {
+        'type': 'server_busy',
+        'payload': {
+            'message': "Server is busy, try again later",
+            'rejected_type': rejected_type,
+        }
+    }
+
+
+def create_overloaded_response(retry_after: int) -> Dict[str, Any]:
+    return {
+        'type': 'server_overloaded',
+        'payload': {
+            'message': "Server is overloaded, try again later",
+            'retry_after': retry_after,
+        }
+    }
+
+
+def create_job_status_response(job_info: Dict[str, Any]) -> Dict[str, Any]:
+    result_url = f"/jobs/{job_info['job_id']}/result" if job_info['status'] == 'done' else ""
+    return {
+        'type': 'job_status',
+        'payload': {**job_info, 'result_url': result_url}
+    }